@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from cache import PER_SHARE
+from screen import MAX_CRITERIA, MIN_CRITERIA, passes
+from technicals import TRADING_YEAR
+
+BENCHMARK = '^TWII'       # 加權指數
+# 換股頻率：每幾個月一次，在每段的第一個交易日收盤後調整
+REBALANCE_MONTHS = {'M': 1, 'Q': 3, 'H': 6, 'Y': 12}
+
+
+# --- 回測資料 (日期 x 股票的密集陣列) ---
+# 價格來自本機歷史股價；基本面用快取每天記下的每股數值 (EPS / 每股淨值 / 每股股利 / ROE)，
+# 往後沿用到下一筆為止，任一天的本益比、淨值比、殖利率都用當天收盤價重算。
+# 第一筆時點基本面之前沒有股票能通過條件，只會持有現金拉低報酬，所以起始日最早從那天開始
+# (panel['start'] 是實際的起始日)。backfill=True 會把最早一筆基本面往前套用，可以回測更久，但有前視偏差。
+def build_panel(history, cache, tickers=None, start='2015-01-01', backfill=False):
+    all_dates, all_tickers, data = history.dense(('Close', 'Adj Close'))
+    column = {t: i for i, t in enumerate(all_tickers)}
+    # tickers 為 None 時用本機存過的全部股票 (含已下市的)，避免只回測存活下來的公司
+    wanted = None if tickers is None else set(tickers)
+    cols = [i for t, i in column.items() if t != BENCHMARK and (wanted is None or t in wanted)]
+    tickers = [all_tickers[i] for i in cols]
+
+    points = cache.daily_points(tickers)
+    points = points.assign(day=pd.to_datetime(points['day']))
+    start = pd.Timestamp(start)
+    if not backfill:
+        if points.empty:
+            raise ValueError("快取裡還沒有時點基本面 (每次抓取基本面會記一筆)，或勾選「基本面往前套用」")
+        start = max(start, points['day'].min())
+    rows = np.flatnonzero(all_dates >= start)
+    if not cols or not len(rows):
+        raise ValueError("沒有本機歷史股價，請先下載")
+    dates = all_dates[rows]
+    bench = None
+    if BENCHMARK in column:
+        bench = pd.Series(data['Close'][rows, column[BENCHMARK]]).ffill().to_numpy()
+    panel = {
+        'start': dates[0],
+        'dates': dates,
+        'tickers': tickers,
+        'close': data['Close'][np.ix_(rows, cols)],
+        'adj': data['Adj Close'][np.ix_(rows, cols)],
+        'bench': bench,
+    }
+    for field in PER_SHARE:
+        wide = points.pivot_table(index='day', columns='yf_ticker', values=field, aggfunc='last')
+        wide = wide.reindex(index=wide.index.union(dates), columns=tickers).ffill()
+        if backfill:
+            wide = wide.bfill()
+        panel[field] = wide.reindex(dates).to_numpy(dtype=float)
+    return panel
+
+
+def rebalance_positions(dates, freq):
+    months = REBALANCE_MONTHS[freq]
+    key = (dates.year * 12 + dates.month - 1) // months
+    return np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+
+
+# 每檔的累積報酬指數 (還原股價)，缺值當天報酬為 0
+def growth_index(adj):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = adj[1:] / adj[:-1] - 1
+    return np.vstack([np.ones(adj.shape[1]), np.cumprod(1 + np.nan_to_num(daily, nan=0.0), axis=0)])
+
+
+# 取其中一段日期 (列位置 [start, stop))，陣列都是 view 不複製
+def slice_panel(panel, start, stop):
+    out = {k: v[start:stop] if isinstance(v, np.ndarray) else v for k, v in panel.items()}
+    out['dates'] = panel['dates'][start:stop]
+    return out
+
+
+# 每個換股日 x 股票是否通過條件；規則與即時篩選相同
+def selection(panel, rb, criteria):
+    price = panel['close'][rb]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'pe': price / panel['eps'][rb],
+            'pb': price / panel['bvps'][rb],
+            'yield': panel['dps'][rb] / price * 100,
+            'roe': panel['roe'][rb],
+        }
+    mask = ~np.isnan(price)
+    for key in MAX_CRITERIA + MIN_CRITERIA:
+        mask &= passes(key, metrics[key], criteria[key])
+    return mask
+
+
+# --- 向量化回測 ---
+# 每個換股日等權買進通過條件的股票，持有到下一個換股日 (期間不再平衡，權重隨漲跌漂移)；
+# 沒有股票通過時該期持有現金。cost 為單邊交易成本 (比例)，依換手率扣除。
+# 停牌或下市後沒有價格的日子報酬視為 0。
+# growth 可由呼叫端預先算好 (同一段資料反覆回測不同條件時共用)
+def run_backtest(panel, criteria, freq='M', cost=0.0, growth=None):
+    dates = panel['dates']
+    rb = rebalance_positions(dates, freq)
+    mask = selection(panel, rb, criteria)
+    counts = mask.sum(axis=1)
+    weights = np.divide(mask, counts[:, None], out=np.zeros(mask.shape), where=counts[:, None] > 0)
+
+    if growth is None:
+        growth = growth_index(panel['adj'])
+
+    # 每一天屬於哪一期 (上一個換股日)；第一個換股日之前不計
+    t = np.arange(rb[0], len(dates))
+    period = np.searchsorted(rb, t, side='left') - 1
+    period[0] = 0
+    held = weights[period]
+    relative = (held * growth[t] / growth[rb[period]]).sum(axis=1) + (1 - held.sum(axis=1))
+
+    # 各期期末的淨值倍數串起來；換股日當天屬於上一期的最後一天
+    period_end = np.r_[rb[1:], len(dates) - 1] - rb[0]
+    factors = relative[period_end]
+    if period[-1] != len(rb) - 1:
+        factors[-1] = 1.0      # 最後一個換股日剛好是最後一天，這期還沒開始
+    turnover = np.abs(np.diff(weights, axis=0, prepend=0)).sum(axis=1)
+    factors_net = factors * (1 - cost * turnover)
+    chained = np.r_[1.0, np.cumprod(factors_net)[:-1]]
+    value = chained[period] * relative * (1 - cost * turnover[period])
+
+    curve = pd.DataFrame({'策略': value}, index=dates[t])
+    if panel['bench'] is not None:
+        bench = panel['bench'][t]
+        curve['加權指數'] = bench / bench[0]
+
+    bench_factors = (curve['加權指數'].to_numpy()[period_end] / curve['加權指數'].to_numpy()[rb - rb[0]]
+                     if '加權指數' in curve else np.full(len(rb), np.nan))
+    periods = pd.DataFrame({
+        '換股日': dates[rb],
+        '持股數': counts,
+        '期間報酬(%)': (factors_net - 1) * 100,
+        '加權指數(%)': (bench_factors - 1) * 100,
+        '換手率(%)': turnover * 100,
+    })
+    stats = summarize(curve)
+    # 有持股的天數比例；條件太嚴或基本面資料不足時大半時間持有現金，報酬要對照這個看
+    stats.loc['持股天數(%)', '策略'] = (held.sum(axis=1) > 0).mean() * 100
+    return curve, periods, stats
+
+
+def summarize(curve):
+    out = {}
+    years = max(len(curve) / TRADING_YEAR, 1 / TRADING_YEAR)
+    for name, series in curve.items():
+        values = series.to_numpy()
+        returns = values[1:] / values[:-1] - 1
+        out[name] = {
+            '累積報酬(%)': (values[-1] / values[0] - 1) * 100,
+            '年化報酬(%)': ((values[-1] / values[0]) ** (1 / years) - 1) * 100,
+            '年化波動(%)': returns.std() * np.sqrt(TRADING_YEAR) * 100 if len(returns) else np.nan,
+            '最大回撤(%)': (values / np.maximum.accumulate(values) - 1).min() * 100,
+        }
+    return pd.DataFrame(out)
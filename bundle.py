@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+import time
+
+import pandas as pd
+
+from cache import FIELDS
+from http_client import get_session
+from sources import BUNDLE
+from universe import CHUNK_SIZE, COLUMNS
+
+BUNDLE_PATH = os.path.join('bundle', 'market.json.gz')
+# CI (.github/workflows/bundle.yml) 每次重建後更新 release "bundle" 附的檔案；設成空字串就不下載
+BUNDLE_URL = os.environ.get('BUNDLE_URL',
+                            'https://github.com/jentichuang-afk/Stock-value/releases/download/bundle/market.json.gz')
+BUNDLE_FORMAT = 1      # 檔案結構變動時加一，舊格式的快照直接忽略
+
+
+# --- 內建離線快照 ---
+# 全市場清單與每檔最近一次的基本面，壓縮成一個 gzip JSON 跟著程式發佈 (由 tools/build_bundle.py 產生)。
+# 證交所連不上時用它當股票清單；快取沒有的股票先用快照的數值，背景預抓再慢慢換成新的。
+def build_bundle(universe, loaded, path=BUNDLE_PATH):
+    payload = {
+        'format': BUNDLE_FORMAT,
+        'built_at': time.time(),
+        'universe': universe[COLUMNS].values.tolist(),
+        # {yf_ticker: [info, fetched_at]}，保留原始抓取時間，載入後仍依 TTL 判斷是否過期
+        'fundamentals': {t: [{f: info[f] for f in FIELDS if f in info}, ts] for t, (info, ts) in loaded.items()},
+    }
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=9) as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+    return payload
+
+
+# 讀不到或格式不符就回傳 None，呼叫端退回其他來源
+def load_bundle(path=BUNDLE_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if payload.get('format') != BUNDLE_FORMAT:
+        return None
+    return payload
+
+
+# 本機沒有快照時 (例如剛部署) 下載 CI 發佈的那一份；失敗或格式不符時回傳 False，照沒有快照的流程走
+def download_bundle(url=BUNDLE_URL, path=BUNDLE_PATH, session=None):
+    if not url:
+        return False
+    session = session or get_session()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    try:
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        if load_bundle(tmp) is None:
+            raise ValueError("快照格式不符")
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def bundle_universe(payload):
+    return pd.DataFrame(payload['universe'], columns=COLUMNS, dtype=str)
+
+
+def bundle_date(payload):
+    return pd.Timestamp(payload['built_at'], unit='s', tz='Asia/Taipei').strftime('%Y-%m-%d')
+
+
+# 只補快取裡完全沒有的股票，不覆蓋已抓過的較新資料；回傳補了幾檔。
+# 來源記成 BUNDLE；快照裡沒有的欄位不寫 (不留 null)，背景預抓會當成還沒抓過
+def seed_cache(cache, payload):
+    fundamentals = payload['fundamentals']
+    have = cache.load_many(fundamentals)
+    missing = [(t, *fundamentals[t]) for t in fundamentals if t not in have]
+    cache.put_many(missing, source=BUNDLE, partial=True)
+    return len(missing)
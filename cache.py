@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from sources import YAHOO
+
+CACHE_PATH = os.environ.get('STOCK_CACHE_DB', os.path.join('data', 'fundamentals.sqlite'))
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# 各欄位的有效時間：跟股價連動的欄位要常更新，ROE / 產業一季或更久才變一次
+FIELD_TTLS = {
+    'currentPrice': 6 * HOUR,
+    'regularMarketPrice': 6 * HOUR,
+    'trailingPE': 6 * HOUR,
+    'forwardPE': 6 * HOUR,
+    'priceToBook': 6 * HOUR,
+    'dividendYield': 6 * HOUR,
+    'returnOnEquity': 7 * DAY,
+    'industry': 30 * DAY,
+}
+FIELDS = tuple(FIELD_TTLS)
+# 不隨股價變動的欄位；價格另外整批更新時，只有這些過期才需要重抓整份 .info
+SLOW_FIELDS = ('returnOnEquity', 'industry')
+# 每股數值 (EPS / 每股淨值 / 每股股利) 一季才變一次
+PER_SHARE_TTL = 120 * DAY
+PER_SHARE = ('eps', 'bvps', 'dps', 'roe')
+
+TAIPEI_OFFSET = 8 * HOUR
+
+
+# 由一次抓取的股價與比率反推每股數值，之後任一天的本益比等可用當天收盤價重算 (回測用)
+def per_share(info):
+    price = info.get('currentPrice') or info.get('regularMarketPrice')
+    if not isinstance(price, (int, float)) or price <= 0:
+        return None
+
+    def ratio(key):
+        value = info.get(key)
+        return float(value) if isinstance(value, (int, float)) else None
+
+    pe = ratio('trailingPE') or ratio('forwardPE')
+    pb = ratio('priceToBook')
+    dy = ratio('dividendYield')
+    roe = ratio('returnOnEquity')
+    return {
+        'eps': price / pe if pe and pe > 0 else None,
+        'bvps': price / pb if pb and pb > 0 else None,
+        'dps': dy * price if dy is not None else None,
+        'roe': roe * 100 if roe is not None else None,
+    }
+
+
+# --- 基本面本機快取 (SQLite) ---
+# 每個 (yf_ticker, 欄位) 一列，記錄抓取時間；缺值也存成 null，
+# 才能分辨「Yahoo 本來就沒有」和「還沒抓過」。
+# 另外每檔每天留一筆每股數值 (fundamentals_daily)，作為回測用的時點資料；
+# 清除快取或股票下市都不刪，避免回測只看到存活下來的公司。
+class FundamentalsCache:
+    def __init__(self, path=CACHE_PATH, ttls=None):
+        self.path = path
+        self.ttls = {**FIELD_TTLS, **(ttls or {})}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS fundamentals (
+                    yf_ticker  TEXT NOT NULL,
+                    field      TEXT NOT NULL,
+                    value      TEXT,
+                    fetched_at REAL NOT NULL,
+                    source     TEXT,
+                    PRIMARY KEY (yf_ticker, field)
+                )""")
+            # 舊版資料庫沒有來源欄
+            if 'source' not in [c[1] for c in self._conn.execute("PRAGMA table_info(fundamentals)")]:
+                self._conn.execute("ALTER TABLE fundamentals ADD COLUMN source TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS fundamentals_daily (
+                    yf_ticker TEXT NOT NULL,
+                    day       TEXT NOT NULL,
+                    eps       REAL,
+                    bvps      REAL,
+                    dps       REAL,
+                    roe       REAL,
+                    PRIMARY KEY (yf_ticker, day)
+                )""")
+            self._conn.commit()
+
+    def _rows(self, tickers):
+        tickers = list(tickers)
+        out = {}
+        with self._lock:
+            for i in range(0, len(tickers), 500):   # SQLite 參數數量有上限
+                chunk = tickers[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                for t, field, value, fetched_at in self._conn.execute(
+                        f"SELECT yf_ticker, field, value, fetched_at FROM fundamentals WHERE yf_ticker IN ({marks})", chunk):
+                    out.setdefault(t, {})[field] = (json.loads(value), fetched_at)
+        return out
+
+    # 指定欄位全都在有效期限內才算命中，回傳 {yf_ticker: info}；其餘視為需要重新抓取
+    def get_many(self, tickers, fields=FIELDS, ttls=None):
+        ttls = {**self.ttls, **(ttls or {})}
+        now = time.time()
+        hits = {}
+        for t, cached in self._rows(tickers).items():
+            if all(f in cached and now - cached[f][1] <= ttls[f] for f in fields):
+                hits[t] = {f: v for f, (v, _) in cached.items() if v is not None}
+        return hits
+
+    # 不管有效期限，回傳所有已快取的資料與最舊欄位的抓取時間 {yf_ticker: (info, fetched_at)}
+    def load_many(self, tickers):
+        out = {}
+        for t, cached in self._rows(tickers).items():
+            info = {f: v for f, (v, _) in cached.items() if v is not None}
+            out[t] = (info, min(ts for _, ts in cached.values()))
+        return out
+
+    # 每個有值的欄位來自哪個來源 {yf_ticker: {欄位: 來源}}
+    def sources_many(self, tickers):
+        tickers = list(tickers)
+        out = {}
+        with self._lock:
+            for i in range(0, len(tickers), 500):
+                chunk = tickers[i:i + 500]
+                for t, field, source in self._conn.execute(
+                        f"SELECT yf_ticker, field, COALESCE(source, ?) FROM fundamentals "
+                        f"WHERE value != 'null' AND yf_ticker IN ({','.join('?' * len(chunk))})", [YAHOO, *chunk]):
+                    out.setdefault(t, {})[field] = source
+        return out
+
+    # 需要重新抓取的代號，依資料新舊排序 (沒抓過的排最前面)
+    def stale(self, tickers, fields=FIELDS, ttls=None):
+        tickers = list(tickers)
+        fresh = self.get_many(tickers, fields, ttls)
+        loaded = self.load_many(t for t in tickers if t not in fresh)
+        return sorted((t for t in tickers if t not in fresh), key=lambda t: loaded[t][1] if t in loaded else 0.0)
+
+    def get(self, ticker, fields=FIELDS, ttls=None):
+        return self.get_many([ticker], fields, ttls).get(ticker)
+
+    def put(self, ticker, info, fields=FIELDS, source=YAHOO):
+        self.put_many([(ticker, info, None)], fields, source)
+
+    # [(ticker, info, fetched_at)]，一次交易寫入；fetched_at 為 None 代表現在，匯入離線快照時沿用原始抓取時間。
+    # source 記錄這批數值來自哪個來源 (sources.py)；partial 時只寫 info 裡有的欄位，其餘保留快取原值
+    def put_many(self, items, fields=FIELDS, source=YAHOO, partial=False):
+        now = time.time()
+        items = list(items)
+        rows = [(t, f, json.dumps(info.get(f)), ts or now, source) for t, info, ts in items for f in fields
+                if not partial or f in info]
+        daily = []
+        for t, info, ts in items:
+            ps = per_share(info)
+            if ps is not None:
+                day = time.strftime('%Y-%m-%d', time.gmtime((ts or now) + TAIPEI_OFFSET))
+                daily.append((t, day, ps['eps'], ps['bvps'], ps['dps'], ps['roe']))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fundamentals (yf_ticker, field, value, fetched_at, source) VALUES (?, ?, ?, ?, ?)", rows)
+            # 同一天多次抓取以最後一次為準；只更新到部分欄位 (批次報價沒有 ROE) 時保留已有的值
+            self._conn.executemany("""
+                INSERT INTO fundamentals_daily (yf_ticker, day, eps, bvps, dps, roe) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (yf_ticker, day) DO UPDATE SET
+                    eps = COALESCE(excluded.eps, eps), bvps = COALESCE(excluded.bvps, bvps),
+                    dps = COALESCE(excluded.dps, dps), roe = COALESCE(excluded.roe, roe)""", daily)
+            self._conn.commit()
+
+    # 下市的股票整檔移除
+    def delete(self, tickers):
+        tickers = list(tickers)
+        with self._lock:
+            for i in range(0, len(tickers), 500):
+                chunk = tickers[i:i + 500]
+                self._conn.execute(f"DELETE FROM fundamentals WHERE yf_ticker IN ({','.join('?' * len(chunk))})", chunk)
+            self._conn.commit()
+
+    # 時點每股數值 (回測用)：DataFrame [yf_ticker, day, eps, bvps, dps, roe]
+    def daily_points(self, tickers=None):
+        with self._lock:
+            rows = self._conn.execute("SELECT yf_ticker, day, eps, bvps, dps, roe FROM fundamentals_daily").fetchall()
+        df = pd.DataFrame(rows, columns=['yf_ticker', 'day', 'eps', 'bvps', 'dps', 'roe'])
+        return df if tickers is None else df[df['yf_ticker'].isin(set(tickers))]
+
+    # 每檔最近一天的每股數值，超過 max_age 的不用；最近一天是空值就是空值 (例如轉虧後本益比 N/A，
+    # 不能沿用以前的 EPS)。只有 ROE 取最後一個非空值：官方批次檔沒有 ROE，只寫官方檔的那幾天 ROE 都是空的。
+    # 回傳以 yf_ticker 為 index 的 DataFrame [eps, bvps, dps, roe, as_of]
+    def latest_per_share(self, tickers, max_age=PER_SHARE_TTL):
+        since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - max_age + TAIPEI_OFFSET))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT yf_ticker, day, eps, bvps, dps, roe FROM fundamentals_daily WHERE day >= ? ORDER BY day",
+                (since,)).fetchall()
+        points = pd.DataFrame(rows, columns=['yf_ticker', 'day', *PER_SHARE])
+        points = points[points['yf_ticker'].isin(set(tickers))]
+        latest = points.sort_values('day').groupby('yf_ticker').tail(1).set_index('yf_ticker')
+        latest['roe'] = points.groupby('yf_ticker')['roe'].last()
+        return latest.rename(columns={'day': 'as_of'})[[*PER_SHARE, 'as_of']]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT yf_ticker) FROM fundamentals").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM fundamentals")
+            self._conn.commit()
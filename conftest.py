@@ -0,0 +1 @@
+# 根目錄放一個 conftest.py，pytest 會把專案根目錄加進 sys.path，tests/ 才能直接 import 各模組與 tools 替身
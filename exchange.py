@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from http_client import get_session
+
+# 證交所 / 櫃買中心 OpenAPI；環境變數可改指向本機替身伺服器 (tools/fake_exchange.py)
+TWSE_BASE = os.environ.get('TWSE_OPENAPI', 'https://openapi.twse.com.tw/v1')
+TPEX_BASE = os.environ.get('TPEX_OPENAPI', 'https://www.tpex.org.tw/openapi/v1')
+MARKET_SUFFIX = {'twse': '.TW', 'tpex': '.TWO'}
+
+# 每日個股本益比、殖利率及股價淨值比 (全部上市 / 上櫃股票一個檔案)
+VALUATION_FEEDS = {
+    'twse': ('/exchangeReport/BWIBBU_ALL',
+             {'code': 'Code', 'name': 'Name', 'pe': 'PEratio', 'pb': 'PBratio', 'yield': 'DividendYield'}),
+    'tpex': ('/tpex_mainboard_peratio_analysis',
+             {'code': 'SecuritiesCompanyCode', 'name': 'CompanyName', 'pe': 'PriceEarningRatio',
+              'pb': 'PriceBookRatio', 'yield': 'YieldRatio'}),
+}
+# 官方檔案提供的欄位 (對應 Yahoo .info 的鍵，寫進同一個快取)
+VALUATION_FIELDS = ('trailingPE', 'priceToBook', 'dividendYield')
+OFFICIAL_FIELDS = VALUATION_FIELDS + ('currentPrice',)
+
+# 每日收盤行情 (全部上市 / 上櫃股票一個檔案)
+PRICE_FEEDS = {
+    'twse': ('/exchangeReport/STOCK_DAY_ALL',
+             {'code': 'Code', 'name': 'Name', 'date': 'Date', 'open': 'OpeningPrice', 'high': 'HighestPrice',
+              'low': 'LowestPrice', 'close': 'ClosingPrice', 'volume': 'TradeVolume'}),
+    'tpex': ('/tpex_mainboard_daily_close_quotes',
+             {'code': 'SecuritiesCompanyCode', 'name': 'CompanyName', 'date': 'Date', 'open': 'Open', 'high': 'High',
+              'low': 'Low', 'close': 'Close', 'volume': 'TradingShares'}),
+}
+PRICE_COLUMNS = ['yf_ticker', 'name', 'date', 'open', 'high', 'low', 'close', 'volume']
+PRICES_DIR = os.path.join('data', 'exchange')
+CLOSE_TIME = '14:30'      # 盤後資料 (含盤後定價) 大約這時候之後才是當天的
+RETRY_LAGGING = 600       # 檔案日期還沒跟上最近交易日 (還沒更新或國定假日) 時，隔幾秒再下載一次
+TRADING_HOURS = ('09:00', '13:30')
+
+
+# 官方數字是字串，虧損或無資料時為空字串、"-" 或 "N/A"
+def parse_number(text):
+    try:
+        return float(str(text).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+# 官方檔的日期是民國年 "1151016"，轉成 "2026-10-16"；沒有或格式不對時為 None
+def roc_date(text):
+    text = str(text).strip()
+    if len(text) != 7 or not text.isdigit():
+        return None
+    return f"{int(text[:3]) + 1911}-{text[3:5]}-{text[5:]}"
+
+
+# 整欄一次轉數字，千分位逗號去掉，"--" 之類的無成交標記變成 NaN
+def to_numbers(series):
+    return pd.to_numeric(series.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+
+# 一列官方資料轉成 Yahoo .info 格式；殖利率官方是 %，Yahoo 是比例
+def row_to_info(row, columns):
+    dy = parse_number(row.get(columns['yield']))
+    pe = parse_number(row.get(columns['pe']))
+    pb = parse_number(row.get(columns['pb']))
+    return {
+        'trailingPE': pe if pe and pe > 0 else None,
+        'priceToBook': pb if pb and pb > 0 else None,
+        'dividendYield': dy / 100 if dy is not None else None,
+    }
+
+
+def get_rows(feeds, market, session=None, base=None):
+    path, columns = feeds[market]
+    session = session or get_session()
+    response = session.get((base or (TWSE_BASE if market == 'twse' else TPEX_BASE)) + path,
+                           headers={'Accept': 'application/json'}, verify=False)
+    response.raise_for_status()
+    return response.json(), columns
+
+
+# 與股票清單一致，只收 4 碼普通股
+def is_stock_code(code):
+    return len(code) == 4 and code.isdigit()
+
+
+# 兩個市場並行下載；其中一個失敗時仍回傳另一個，錯誤放在 errors
+def fetch_markets(fetch, session=None, twse_base=None, tpex_base=None):
+    bases = {'twse': twse_base, 'tpex': tpex_base}
+    with ThreadPoolExecutor(max_workers=len(bases)) as pool:
+        futures = {m: pool.submit(fetch, m, session, bases[m]) for m in bases}
+    results, errors = {}, {}
+    for market, future in futures.items():
+        try:
+            results[market] = future.result()
+        except Exception as e:
+            errors[market] = e
+    return results, errors
+
+
+# 回傳 ({yf_ticker: info}, 檔案日期)；上市的估值檔沒有日期欄，日期為 None
+def fetch_valuation_feed(market, session=None, base=None):
+    rows, columns = get_rows(VALUATION_FEEDS, market, session, base)
+    out, days = {}, set()
+    for row in rows:
+        code = str(row.get(columns['code'], '')).strip()
+        if is_stock_code(code):
+            out[code + MARKET_SUFFIX[market]] = row_to_info(row, columns)
+        days.add(roc_date(row.get('Date', '')))
+    days.discard(None)
+    return out, max(days) if days else None
+
+
+# --- 官方批次估值 ---
+# 上市、上櫃各一個請求就拿到全市場的本益比 / 淨值比 / 殖利率，回傳 ({yf_ticker: info}, errors, 檔案日期)。
+# 檔案日期取有日期欄的市場中最舊的，都沒有時為 None
+def fetch_valuations(session=None, twse_base=None, tpex_base=None):
+    results, errors = fetch_markets(fetch_valuation_feed, session, twse_base, tpex_base)
+    infos, days = {}, []
+    for part, day in results.values():
+        infos.update(part)
+        if day:
+            days.append(day)
+    return infos, errors, min(days) if days else None
+
+
+# 整個檔案建成 DataFrame 後逐欄向量化轉換，不逐列解析
+def fetch_price_feed(market, session=None, base=None):
+    rows, columns = get_rows(PRICE_FEEDS, market, session, base)
+    df = pd.DataFrame.from_records(rows).reindex(columns=list(columns.values()))
+    df.columns = list(columns)
+    df['code'] = df['code'].astype(str).str.strip()
+    df = df[df['code'].str.fullmatch(r'\d{4}')]
+    for col in ('open', 'high', 'low', 'close', 'volume'):
+        df[col] = to_numbers(df[col])
+    df['date'] = df['date'].map(roc_date)
+    df['yf_ticker'] = df['code'] + MARKET_SUFFIX[market]
+    return df.set_index('code')[PRICE_COLUMNS]
+
+
+# --- 官方批次收盤價 ---
+# 回傳 (以 code 為 index 的 DataFrame, errors)；當天沒有成交的股票 close 為 NaN
+def fetch_prices(session=None, twse_base=None, tpex_base=None):
+    results, errors = fetch_markets(fetch_price_feed, session, twse_base, tpex_base)
+    frames = [f for f in results.values() if not f.empty]
+    prices = pd.concat(frames) if frames else pd.DataFrame(columns=PRICE_COLUMNS).rename_axis('code')
+    return prices[~prices.index.duplicated(keep='first')], errors
+
+
+# 收盤價是哪一天的：各市場取檔案裡的日期，兩個市場不一致時取舊的；沒有日期時為 None
+def prices_day(prices):
+    days = prices.groupby(prices['yf_ticker'].str.rsplit('.', n=1).str[1])['date'].max().dropna()
+    return days.min() if len(days) else None
+
+
+# 目前時間對應的最近一個交易日 (收盤資料已出來的那天)；只跳過週末，國定假日沿用前一個檔案
+def trading_day(now=None):
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='Asia/Taipei').tz_localize(None)
+    day = now.normalize()
+    if now < day + pd.Timedelta(CLOSE_TIME + ':00'):
+        day -= pd.Timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= pd.Timedelta(days=1)
+    return day.strftime('%Y-%m-%d')
+
+
+# 現在是否在盤中 (只看週末與時段，不含國定假日)
+def market_open(now=None):
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='Asia/Taipei').tz_localize(None)
+    start, end = (now.normalize() + pd.Timedelta(t + ':00') for t in TRADING_HOURS)
+    return now.weekday() < 5 and start <= now <= end
+
+
+# --- 每個交易日只下載一次的收盤價 ---
+# 以檔案裡的日期為鍵存成 data/exchange/prices-<日期>.parquet；兩個市場都成功才寫檔，
+# 部分失敗時回傳拿到的部分，下次呼叫再重試。收盤後官方還沒更新時檔案仍是前一個交易日的，
+# 這時不寫檔、也不當成今天已下載，先回傳舊資料，每 RETRY_LAGGING 秒重新下載一次直到跟上。
+class DailyPrices:
+    def __init__(self, root=PRICES_DIR, session=None, twse_base=None, tpex_base=None):
+        self.root = root
+        self.session = session
+        self.bases = (twse_base, tpex_base)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._day = None          # 目前資料 (檔案日期) 是哪一天
+        self._frame = None
+        self._checked = 0.0       # 上次下載的時間 (monotonic)
+
+    def _path(self, day):
+        return os.path.join(self.root, f'prices-{day}.parquet')
+
+    # 回傳 (prices, errors)
+    def get(self, now=None):
+        expected = trading_day(now)
+        with self._lock:
+            if self._day is not None and self._day >= expected:
+                return self._frame, {}
+            path = self._path(expected)
+            if os.path.exists(path):
+                self._frame, self._day = pd.read_parquet(path), expected
+                return self._frame, {}
+            if self._frame is not None and time.monotonic() - self._checked < RETRY_LAGGING:
+                return self._frame, {}
+            prices, errors = fetch_prices(self.session, *self.bases)
+            if errors:
+                return prices, errors
+            self._checked = time.monotonic()
+            day = prices_day(prices)
+            self._frame, self._day = prices, day
+            if day is not None and day >= expected:
+                path = self._path(day)
+                tmp = path + '.tmp'
+                prices.to_parquet(tmp)
+                os.replace(tmp, path)
+                for name in os.listdir(self.root):   # 前幾天的檔案用不到了
+                    if name.startswith('prices-') and name != os.path.basename(path):
+                        os.remove(os.path.join(self.root, name))
+            return prices, errors
+
+    def status(self):
+        with self._lock:
+            return {'day': self._day, 'count': 0 if self._frame is None else int(self._frame['close'].notna().sum())}
+
+
+# --- 官方估值 + 收盤價 ---
+# 兩種檔案合成 {yf_ticker: info} (本益比、淨值比、殖利率與當天收盤價，彼此一致)，
+# 每個交易日各下載一次。回傳 (資料日期, infos, errors)；有錯誤時下次呼叫會重試失敗的部分。
+# 資料日期取兩種檔案裡較舊的那天；還沒跟上最近交易日時跟 DailyPrices 一樣每 RETRY_LAGGING 秒重新下載。
+# 沒有收盤價的股票 (當天沒成交、不在收盤檔或該市場收盤檔下載失敗) info 裡就沒有 currentPrice，
+# 寫快取時只寫 info 有的欄位 (put_many(partial=True))，不會拿 null 蓋掉快取裡的價格。
+class OfficialFeed:
+    def __init__(self, prices=None, session=None, twse_base=None, tpex_base=None):
+        self.session = session
+        self.bases = (twse_base, tpex_base)
+        self.prices = prices or DailyPrices(session=session, twse_base=twse_base, tpex_base=tpex_base)
+        self._lock = threading.Lock()
+        self._day = None          # 估值檔的日期
+        self._valuations = {}
+        self._checked = 0.0
+
+    def _lagging(self, expected):
+        if self._day is None:
+            return True
+        return self._day < expected and time.monotonic() - self._checked >= RETRY_LAGGING
+
+    def get(self, now=None):
+        expected = trading_day(now)
+        prices, price_errors = self.prices.get(now)
+        price_day = self.prices.status()['day']
+        errors = {}
+        with self._lock:
+            if self._lagging(expected):
+                valuations, errors, day = fetch_valuations(self.session, *self.bases)
+                if not errors:
+                    # 估值檔都沒有日期欄時沿用收盤檔的日期 (兩種檔案同時更新)
+                    self._day = day or price_day or expected
+                    self._valuations, self._checked = valuations, time.monotonic()
+            else:
+                valuations = self._valuations
+            valuation_day = self._day
+        days = [d for d in (valuation_day, price_day) if d]
+        closes = prices.set_index('yf_ticker')['close'].dropna().to_dict()
+        infos = {t: {**info, **({'currentPrice': closes[t]} if t in closes else {})} for t, info in valuations.items()}
+        return min(days) if days else None, infos, {**errors, **price_errors}
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import yfinance as yf
+
+from http_client import get_session
+from rate_control import OK, BLOCKED, ERROR
+
+HISTORY_DIR = os.path.join('data', 'history')
+HISTORY_START = '2015-01-01'   # 第一次下載從這天開始
+BATCH_SIZE = 100               # 每次 yf.download 帶幾檔
+BLOCKED_RATIO = 0.5            # 一批裡超過這個比例拿回空資料，視為被限流
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+# --- 歷史股價 (Parquet，依股票與年份分割) ---
+# 目錄結構 data/history/ticker=2330.TW/year=2024.parquet，manifest.json 記錄每檔最後一個交易日。
+# 更新時依「最後交易日」分組，同一組只下載缺的那幾天，多檔合併成一次 yf.download；
+# 每天的例行更新通常整個市場同一組，只是幾次小批次請求。
+# 價格不做還原 (auto_adjust=False)，另存 Adj Close；還原價在除權息後會整段改變，不適合只追加新的日子。
+class HistoryStore:
+    def __init__(self, root=HISTORY_DIR, controller=None, batch_size=BATCH_SIZE):
+        self.root = root
+        self.controller = controller
+        self.batch_size = batch_size
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self._lock = threading.Lock()
+        self._dense_lock = threading.Lock()
+        self._manifest = self._read_manifest()
+
+        self.state = 'idle'      # idle / running / done
+        self.done = 0
+        self.total = 0
+        self.failed = []
+        self.last_error = None
+        self._thread = None
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.root, f'ticker={ticker}')
+
+    def last_date(self, ticker):
+        with self._lock:
+            entry = self._manifest.get(ticker)
+        return entry['last'] if entry else None
+
+    # 依下載起始日分組：{起始日: [tickers]}；同一天收盤後再跑只會重抓當天
+    def plan(self, tickers, start=HISTORY_START, today=None):
+        today = pd.Timestamp(today or pd.Timestamp.now(tz='Asia/Taipei').date())
+        groups = defaultdict(list)
+        for t in tickers:
+            last = self.last_date(t)
+            # 從最後一天重抓：盤中存進來的當日資料收盤後會被覆蓋成正式價格
+            begin = pd.Timestamp(last) if last else pd.Timestamp(start)
+            if begin <= today:
+                groups[begin.strftime('%Y-%m-%d')].append(t)
+        return dict(groups)
+
+    def _record(self, outcome, t0):
+        if self.controller is not None:
+            self.controller.record(outcome, time.monotonic() - t0)
+
+    # 回傳 (df, 沒拿到資料的代號)。yf.download 對抓失敗 (包括被限流) 的代號不會省略，
+    # 而是給一整欄 NaN，所以逐檔檢查；大半都是空的就回報速率控制器被鎖，讓它退避
+    def _download(self, tickers, start):
+        if self.controller is not None:
+            self.controller.acquire()
+        t0 = time.monotonic()
+        try:
+            df = yf.download(tickers, start=start, group_by='ticker', auto_adjust=False, actions=False,
+                             threads=True, progress=False, session=get_session('yahoo'))
+        except Exception:
+            self._record(ERROR, t0)
+            raise
+        present = set(df.columns.get_level_values(0)) if df is not None and not df.empty else set()
+        empty = [t for t in tickers if t not in present or df[t].isna().all().all()]
+        self._record(BLOCKED if len(empty) > len(tickers) * BLOCKED_RATIO else OK, t0)
+        return df, empty
+
+    # 新資料依年份併進既有分割檔，同一天以新的為準
+    def _append(self, ticker, frame):
+        frame = frame.dropna(how='all')
+        if frame.empty:
+            return False
+        frame = frame.reindex(columns=PRICE_COLUMNS)
+        frame.index = pd.DatetimeIndex(frame.index).tz_localize(None).normalize()
+        frame.index.name = 'Date'
+        path = self._ticker_dir(ticker)
+        os.makedirs(path, exist_ok=True)
+        for year, part in frame.groupby(frame.index.year):
+            file = os.path.join(path, f'year={year}.parquet')
+            if os.path.exists(file):
+                part = pd.concat([pd.read_parquet(file), part])
+                part = part[~part.index.duplicated(keep='last')].sort_index()
+            tmp = file + '.tmp'
+            part.to_parquet(tmp)
+            os.replace(tmp, file)
+        with self._lock:
+            entry = self._manifest.setdefault(ticker, {'first': frame.index[0].strftime('%Y-%m-%d')})
+            entry['last'] = max(entry.get('last', ''), frame.index[-1].strftime('%Y-%m-%d'))
+            entry['updated_at'] = time.time()
+        return True
+
+    # 下載缺的交易日並寫入；回傳 {'fetched': 檔數, 'failed': [...]}
+    def update(self, tickers, start=HISTORY_START):
+        plan = self.plan(tickers, start)
+        self.total = sum(len(v) for v in plan.values())
+        self.done = 0
+        self.failed = []
+        fetched = 0
+        for begin, group in plan.items():
+            for i in range(0, len(group), self.batch_size):
+                chunk = group[i:i + self.batch_size]
+                try:
+                    df, empty = self._download(chunk, begin)
+                except Exception as e:
+                    self.failed.extend(chunk)
+                    self.last_error = str(e)
+                    self.done += len(chunk)
+                    continue
+                empty = set(empty)
+                for t in chunk:
+                    # 整欄 NaN 分不出是抓失敗還是停牌，一律算失敗，下次更新再試
+                    if t in empty:
+                        self.failed.append(t)
+                    elif self._append(t, df[t]):
+                        fetched += 1
+                    self.done += 1
+                if empty:
+                    self.last_error = f"{len(empty)}/{len(chunk)} 檔沒有拿到資料"
+                with self._lock:
+                    self._write_manifest()
+        return {'fetched': fetched, 'failed': list(self.failed)}
+
+    def update_in_background(self, tickers, start=HISTORY_START):
+        if self.running:
+            return
+        tickers = list(tickers)
+        self.state = 'running'
+
+        def run():
+            try:
+                self.update(tickers, start)
+            except Exception as e:
+                self.last_error = str(e)
+            self.state = 'done'
+
+        self._thread = threading.Thread(target=run, name="history-ingest", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # 單檔歷史，index 為日期
+    def load(self, ticker, start=None):
+        path = self._ticker_dir(ticker)
+        if not os.path.isdir(path):
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        year_from = pd.Timestamp(start).year if start else 0
+        files = sorted(f for f in os.listdir(path)
+                       if f.endswith('.parquet') and int(f[len('year='):-len('.parquet')]) >= year_from)
+        if not files:
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        df = pd.concat([pd.read_parquet(os.path.join(path, f)) for f in files])
+        return df.loc[start:] if start else df
+
+    # 讀多檔的指定欄位，回傳 (日期, 股票, {欄位: 日期 x 股票陣列})。
+    # 所有分割檔交給 pyarrow 一次多執行緒讀取，再用整數位置直接填進陣列，不經過 pivot。
+    def _read(self, tickers, fields, start=None):
+        year_from = pd.Timestamp(start).year if start else 0
+        files = []
+        for t in tickers:
+            path = self._ticker_dir(t)
+            if os.path.isdir(path):
+                files += [os.path.join(path, f) for f in os.listdir(path)
+                          if f.endswith('.parquet') and int(f[len('year='):-len('.parquet')]) >= year_from]
+        if not files:
+            return pd.DatetimeIndex([]), [], {f: np.empty((0, 0)) for f in fields}
+        dataset = ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=self.root)
+        flt = ds.field('Date') >= pd.Timestamp(start) if start else None
+        table = dataset.to_table(columns=['Date', 'ticker', *fields], filter=flt)
+        dates, row = np.unique(table.column('Date').to_numpy(), return_inverse=True)
+        codes = pd.Categorical(table.column('ticker').to_pandas().astype(str))
+        out = {}
+        for field in fields:
+            matrix = np.full((len(dates), len(codes.categories)), np.nan)
+            matrix[row, codes.codes] = table.column(field).to_numpy(zero_copy_only=False)
+            out[field] = matrix
+        return pd.DatetimeIndex(dates), list(codes.categories), out
+
+    # 多檔同一欄位組成寬表 (日期 x 股票)
+    def load_many(self, tickers, field='Close', start=None):
+        dates, columns, data = self._read(tickers, [field], start)
+        return pd.DataFrame(data[field], index=dates, columns=columns)
+
+    # --- 全市場密集陣列 ---
+    # 上萬個小分割檔每次都重讀太慢 (每檔約 0.5 ms)，所以整個市場的指定欄位另存成 .npy，
+    # 以 manifest 內容的雜湊為版本，歷史資料有更新才重建；讀取用 memmap，幾乎不花時間。
+    def _build_dense(self, tickers, fields, base, version):
+        path = os.path.join(base, version)
+        dates, columns, data = self._read(tickers, list(fields))
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        if os.path.isdir(path):
+            shutil.copytree(path, tmp)
+        os.makedirs(tmp, exist_ok=True)
+        for f in fields:
+            np.save(os.path.join(tmp, f.replace(' ', '_') + '.npy'), data[f])
+        with open(os.path.join(tmp, 'index.json'), 'w', encoding='utf-8') as fp:
+            json.dump({'dates': [d.strftime('%Y-%m-%d') for d in dates], 'tickers': columns}, fp)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        for old in os.listdir(base):   # 舊版本用不到了
+            if old != version:
+                shutil.rmtree(os.path.join(base, old), ignore_errors=True)
+
+    def dense(self, fields=('Close', 'Adj Close')):
+        with self._lock:
+            version = hashlib.sha1(json.dumps(self._manifest, sort_keys=True).encode()).hexdigest()[:12]
+            tickers = sorted(self._manifest)
+        base = os.path.join(self.root, 'dense')
+        path = os.path.join(base, version)
+        names = {f: os.path.join(path, f.replace(' ', '_') + '.npy') for f in fields}
+        with self._dense_lock:
+            if not all(os.path.exists(n) for n in names.values()):
+                self._build_dense(tickers, fields, base, version)
+        with open(os.path.join(path, 'index.json'), encoding='utf-8') as fp:
+            index = json.load(fp)
+        return (pd.DatetimeIndex(index['dates']), index['tickers'],
+                {f: np.load(n, mmap_mode='r') for f, n in names.items()})
+
+    def status(self):
+        with self._lock:
+            stored = len(self._manifest)
+            last = max((e['last'] for e in self._manifest.values()), default=None)
+        return {
+            'state': 'running' if self.running else self.state,
+            'done': self.done,
+            'total': self.total,
+            'failed': len(self.failed),
+            'stored': stored,
+            'last': last,
+            'last_error': self.last_error,
+        }
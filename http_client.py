@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from curl_cffi import requests as curl_requests
+except ImportError:  # yfinance 沒裝 curl_cffi 時退回 requests
+    curl_requests = None
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+DEFAULT_TIMEOUT = (5, 30)     # (連線, 讀取) 秒，避免卡死的 socket 拖住整個掃描
+
+# 每個主機同時在途的請求上限；證交所 ISIN 頁面很大又慢，不需要多開
+HOST_LIMITS = {
+    'isin.twse.com.tw': 2,
+    'openapi.twse.com.tw': 2,
+    'www.tpex.org.tw': 2,
+    'mis.twse.com.tw': 2,
+    'query1.finance.yahoo.com': 16,
+    'query2.finance.yahoo.com': 16,
+}
+DEFAULT_HOST_LIMIT = 8
+
+
+# --- 請求統計 (依主機) ---
+class HttpMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(lambda: {'requests': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0,
+                                           'in_flight': 0, 'status': defaultdict(int)})
+
+    def begin(self, host):
+        with self._lock:
+            self._hosts[host]['in_flight'] += 1
+
+    def end(self, host, elapsed, status=None, size=0):
+        with self._lock:
+            self._hosts[host]['in_flight'] -= 1
+        self.record(host, elapsed, status, size)
+
+    # status 為 None 代表連線層錯誤 (逾時、DNS、連線被重設)
+    def record(self, host, elapsed, status=None, size=0):
+        with self._lock:
+            h = self._hosts[host]
+            h['requests'] += 1
+            h['seconds'] += elapsed
+            h['bytes'] += size
+            if status is None:
+                h['errors'] += 1
+            else:
+                h['status'][status] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {host: {**h, 'status': dict(h['status']),
+                           'avg_latency': h['seconds'] / h['requests'] if h['requests'] else None}
+                    for host, h in self._hosts.items()}
+
+
+metrics = HttpMetrics()
+_host_sems = {}
+_sem_lock = threading.Lock()
+
+
+def host_semaphore(host):
+    with _sem_lock:
+        if host not in _host_sems:
+            _host_sems[host] = threading.BoundedSemaphore(HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT))
+        return _host_sems[host]
+
+
+# 包在 Session.request 外層：預設逾時、每主機並行上限、記錄統計。
+# requests 與 curl_cffi 的 Session 都能套用，yfinance 也收得下這兩種 Session。
+class _InstrumentedMixin:
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = DEFAULT_TIMEOUT
+        host = urlsplit(url).hostname or ''
+        with host_semaphore(host):
+            metrics.begin(host)
+            t0 = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except Exception:
+                metrics.end(host, time.monotonic() - t0)
+                raise
+            # stream=True 的回應還沒讀 body，讀 .content 會整包載進記憶體，改用 Content-Length (沒有就記 0)
+            if kwargs.get('stream'):
+                size = int(response.headers.get('Content-Length') or 0)
+            else:
+                size = len(response.content or b'')
+            metrics.end(host, time.monotonic() - t0, response.status_code, size)
+            return response
+
+
+class PooledSession(_InstrumentedMixin, requests.Session):
+    def __init__(self, pool_size=32):
+        super().__init__()
+        # 連線池 + 針對暫時性錯誤的重試 (指數退避)；429 交給速率控制器處理，這裡不重試
+        retry = Retry(total=3, connect=3, read=2, backoff_factor=0.5,
+                      status_forcelist=(500, 502, 503, 504), allowed_methods=('GET', 'HEAD'))
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+
+
+if curl_requests is not None:
+    class ImpersonatedSession(_InstrumentedMixin, curl_requests.Session):
+        # Yahoo 會擋一般 Python 的 TLS 指紋，沿用 yfinance 預設的 Chrome 模擬
+        def __init__(self):
+            super().__init__(impersonate="chrome")
+else:
+    ImpersonatedSession = PooledSession
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# 整個程序共用的 Session：'default' 給證交所等一般網站，'yahoo' 給 yfinance
+def get_session(kind='default'):
+    with _sessions_lock:
+        if kind not in _sessions:
+            _sessions[kind] = ImpersonatedSession() if kind == 'yahoo' else PooledSession()
+        return _sessions[kind]
+
+
+# httpx (asyncio 抓取) 用的 event hook，讓統計與同步 Session 放在一起
+def httpx_hooks():
+    async def on_request(request):
+        request.extensions['t0'] = time.monotonic()
+
+    async def on_response(response):
+        await response.aread()
+        request = response.request
+        elapsed = time.monotonic() - request.extensions.get('t0', time.monotonic())
+        metrics.record(request.url.host, elapsed, response.status_code, len(response.content))
+
+    return {'request': [on_request], 'response': [on_response]}
@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from exchange import market_open
+from http_client import get_session
+from screen import MAX_CRITERIA, MIN_CRITERIA, passes
+
+# 證交所基本市況報導 (MIS)；環境變數可改指向本機替身伺服器 (tools/fake_mis.py)
+MIS_BASE = os.environ.get('TWSE_MIS', 'https://mis.twse.com.tw')
+MIS_PATH = '/stock/api/getStockInfo.jsp'
+MIS_CHUNK = 50            # 一次請求帶幾檔 (ex_ch 以 | 串接，太長會被擋)
+POLL_INTERVAL = 5.0       # MIS 約每 5 秒更新一次，輪詢更快也拿不到新資料
+IDLE_TIMEOUT = 60.0       # 頁面這麼久沒來讀取 (分頁關掉了) 就停止輪詢
+MAX_EVENTS = 500
+
+
+# yf_ticker 轉 MIS 的頻道代號：上市 tse_2330.tw、上櫃 otc_6488.tw
+def channel(yf_ticker):
+    code, _, suffix = yf_ticker.partition('.')
+    return f"{'otc' if suffix == 'TWO' else 'tse'}_{code}.tw"
+
+
+def _number(text):
+    try:
+        value = float(text)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+# 最新成交價 z 在該次揭示沒有成交時為 "-"，改用最佳買價，再沒有就用昨收
+def quote_price(row):
+    price = _number(row.get('z'))
+    if price is None:
+        price = _number(str(row.get('b', '')).split('_')[0])
+    if price is None:
+        price = _number(row.get('y'))
+    return price
+
+
+def fetch_chunk(tickers, session=None, base=None):
+    session = session or get_session()
+    response = session.get((base or MIS_BASE) + MIS_PATH, verify=False, params={
+        'ex_ch': '|'.join(channel(t) for t in tickers), 'json': 1, 'delay': 0,
+        '_': int(time.time() * 1000)})
+    response.raise_for_status()
+    suffix = {'tse': '.TW', 'otc': '.TWO'}
+    out = {}
+    for row in response.json().get('msgArray') or []:
+        price = quote_price(row)
+        if price is not None and row.get('ex') in suffix:
+            out[row['c'] + suffix[row['ex']]] = price
+    return out
+
+
+# --- 批次即時報價 ---
+# 每個請求帶 MIS_CHUNK 檔，全部的批次並行送出 (每主機並行上限由 http_client 控制)。
+# 回傳 ({yf_ticker: 價格}, [錯誤訊息])；部分批次失敗時其餘照常回傳
+def fetch_live_prices(tickers, session=None, base=None):
+    tickers = list(tickers)
+    chunks = [tickers[i:i + MIS_CHUNK] for i in range(0, len(tickers), MIS_CHUNK)]
+    prices, errors = {}, []
+    if not chunks:
+        return prices, errors
+    with ThreadPoolExecutor(max_workers=min(4, len(chunks))) as pool:
+        futures = [pool.submit(fetch_chunk, c, session, base) for c in chunks]
+        for future in futures:
+            try:
+                prices.update(future.result())
+            except Exception as e:
+                errors.append(str(e))
+    return prices, errors
+
+
+# --- 增量重新篩選 ---
+# 每股數值固定 (一季才變)，只有價格在動：每次只重算價格有變的那幾列的本益比 / 淨值比 / 殖利率，
+# 跟上一次的通過狀態比較，回傳新進入與跌出篩選的列位置。
+class LiveScreen:
+    def __init__(self, snapshot, per_share, criteria):
+        self.snapshot = snapshot
+        self.tickers = list(snapshot['yf_ticker'])
+        self._position = {t: i for i, t in enumerate(self.tickers)}
+        ps = per_share.reindex(self.tickers)
+        self.eps, self.bvps, self.dps = (ps[c].to_numpy(dtype=float) for c in ('eps', 'bvps', 'dps'))
+        # 沒有每股數值的股票沒辦法隨股價重算，維持快照上的比率
+        self.live = ps[['eps', 'bvps', 'dps']].notna().any(axis=1).to_numpy()
+        self.values = {k: snapshot[k].to_numpy(dtype=float).copy() for k in ('price', 'pe', 'pb', 'yield', 'roe')}
+        self.set_criteria(criteria)
+
+    def set_criteria(self, criteria):
+        self.criteria = dict(criteria)
+        self.mask = self._passes(np.arange(len(self.tickers)))
+
+    def _passes(self, rows):
+        keep = np.ones(len(rows), dtype=bool)
+        for key in MAX_CRITERIA + MIN_CRITERIA:
+            keep &= passes(key, self.values[key][rows], self.criteria[key])
+        return keep
+
+    # prices 為 {yf_ticker: 價格}，回傳 (entered, exited, changed) 三組列位置
+    def apply(self, prices):
+        rows = np.array([self._position[t] for t in prices if t in self._position], dtype=int)
+        new = np.array([prices[self.tickers[r]] for r in rows], dtype=float)
+        moved = new != self.values['price'][rows]
+        rows, new = rows[moved], new[moved]
+        self.values['price'][rows] = new
+        rows = rows[self.live[rows]]
+        new = self.values['price'][rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eps, bvps, dps = self.eps[rows], self.bvps[rows], self.dps[rows]
+            self.values['pe'][rows] = np.where(eps > 0, new / eps, np.nan)
+            self.values['pb'][rows] = np.where(bvps > 0, new / bvps, np.nan)
+            self.values['yield'][rows] = dps / new * 100
+        now = self._passes(rows)
+        before = self.mask[rows]
+        self.mask[rows] = now
+        return rows[now & ~before], rows[before & ~now], rows
+
+    def current(self):
+        out = self.snapshot.copy()
+        for key, values in self.values.items():
+            out[key] = values
+        return out
+
+
+# --- 盤中輪詢 ---
+# 背景執行緒每 interval 秒抓一次整批即時報價，交給 LiveScreen 增量重算，
+# 進出篩選的股票記成事件 (序號遞增)，頁面依序號取出新的事件推播。
+# 非交易時段 (is_open 為 False) 不送請求；頁面超過 idle_timeout 秒沒讀取 (events / matches / status)
+# 就自行停止，分頁關掉後不會在背景一直打 MIS。
+class LivePoller:
+    def __init__(self, screen, interval=POLL_INTERVAL, session=None, base=None,
+                 is_open=market_open, idle_timeout=IDLE_TIMEOUT):
+        self.screen = screen
+        self.interval = interval
+        self.session = session
+        self.base = base
+        self.is_open = is_open
+        self.idle_timeout = idle_timeout
+        self.market_open = None
+        self.polls = 0
+        self.updated = 0
+        self.last_poll = None
+        self.last_error = None
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_read = time.monotonic()
+
+    # 每次啟動用新的停止旗標，剛停下還在等回應的舊執行緒不會被重新喚醒
+    def start(self):
+        self._last_read = time.monotonic()
+        if self.running:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="live-poll", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def set_criteria(self, criteria):
+        with self._lock:
+            if criteria != self.screen.criteria:
+                self.screen.set_criteria(criteria)
+
+    def poll(self):
+        prices, errors = fetch_live_prices(self.screen.tickers, self.session, self.base)
+        now = time.time()
+        with self._lock:
+            entered, exited, changed = self.screen.apply(prices)
+            for kind, rows in (('entry', entered), ('exit', exited)):
+                for r in rows:
+                    self._seq += 1
+                    self._events.append({'seq': self._seq, 'at': now, 'kind': kind,
+                                         'yf_ticker': self.screen.tickers[r],
+                                         'price': float(self.screen.values['price'][r])})
+            self.polls += 1
+            self.updated = len(changed)
+            self.last_poll = now
+            self.last_error = errors[0] if errors else None
+
+    def _run(self, stop):
+        while not stop.is_set():
+            if time.monotonic() - self._last_read > self.idle_timeout:
+                stop.set()
+                break
+            self.market_open = self.is_open()
+            if self.market_open:
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.last_error = str(e)
+            stop.wait(self.interval)
+
+    # 序號大於 after 的事件 (舊到新)
+    def events(self, after=0):
+        with self._lock:
+            self._last_read = time.monotonic()
+            return [e for e in self._events if e['seq'] > after]
+
+    def matches(self):
+        with self._lock:
+            self._last_read = time.monotonic()
+            frame = self.screen.current()
+            return frame[self.screen.mask]
+
+    def status(self):
+        with self._lock:
+            self._last_read = time.monotonic()
+            return {
+                'running': self.running,
+                'market_open': self.market_open,
+                'polls': self.polls,
+                'updated': self.updated,
+                'matched': int(self.screen.mask.sum()),
+                'last_poll': self.last_poll,
+                'last_error': self.last_error,
+            }
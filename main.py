@@ -1,10 +1,27 @@
 import streamlit as st
 import yfinance as yf
+import numpy as np
 import pandas as pd
-import requests
-import urllib3
-from io import StringIO
 import time
+import urllib3
+from scanner import scan, DEFAULT_WORKERS, MAX_WORKERS
+from http_client import get_session, metrics as http_metrics
+from universe import UniverseStore, change_tickers
+from bundle import load_bundle, download_bundle, bundle_universe, bundle_date, seed_cache
+from rate_control import RateController
+from yahoo import fetch_info, fetch_quotes, QUOTE_CHUNK, QUOTE_FIELDS
+from yahoo_async import fetch_many
+from exchange import OfficialFeed, OFFICIAL_FIELDS, market_open
+from cache import FundamentalsCache, HOUR, DAY, FIELDS, SLOW_FIELDS
+from screen import info_to_metrics, build_snapshot, screen_mask, format_results, attach_freshness, SnapshotIndex, IndustryStats, DISPLAY_COLUMNS, reprice
+from prefetch import Prefetcher
+from scan_job import ScanJob
+from history import HistoryStore
+from technicals import TechnicalsCache
+from backtest import build_panel, run_backtest, BENCHMARK
+from optimize import optimize, grid_candidates, random_candidates
+from live import LiveScreen, LivePoller, MIS_CHUNK
+from sources import SourceHealth, SourceUnavailable, fuse, resolve_cached, source_label, yahoo_fields, OFFICIAL, YAHOO, CACHE, SOURCE_LABELS
 
 # --- 0. 基礎設定 ---
 st.set_page_config(page_title="台股價值大師雷達", layout="wide")
@@ -17,51 +34,115 @@ st.markdown("""
 > *如果出現「找不到符合條件」，通常是 Yahoo Finance 暫時阻擋了連線。*
 """)
 
+# 速率控制器跨 rerun 共用，才能記住 Yahoo 目前的健康狀態
+@st.cache_resource
+def get_rate_controller():
+    return RateController()
+
+rate_controller = get_rate_controller()
+
+# 各資料來源 (官方批次檔 / Yahoo) 的健康狀態，決定欄位改從哪個來源取
+@st.cache_resource
+def get_source_health():
+    return SourceHealth()
+
+source_health = get_source_health()
+
+# 內建離線快照只讀一次；沒有快照檔時先下載 CI 發佈的那一份，還是沒有就為 None
+@st.cache_resource
+def get_bundle():
+    payload = load_bundle()
+    if payload is None and download_bundle():
+        payload = load_bundle()
+    return payload
+
+bundle = get_bundle()
+
+# 快取裡沒有的股票先用快照的數值 (保留原始抓取時間，過期的由背景預抓更新)
+@st.cache_resource
+def get_fundamentals_cache():
+    cache = FundamentalsCache()
+    if bundle is not None:
+        seed_cache(cache, bundle)
+    return cache
+
+fundamentals_cache = get_fundamentals_cache()
+
+# 證交所 / 櫃買中心的每日估值與收盤價檔，每個交易日各下載一次，整個程序共用
+@st.cache_resource
+def get_official_feed():
+    return OfficialFeed()
+
+official_feed = get_official_feed()
+
+# 背景預抓整個市場，整個程序只有一個，與使用者 session 無關
+@st.cache_resource
+def get_prefetcher():
+    prefetcher = Prefetcher(fundamentals_cache, rate_controller, feed=official_feed, health=source_health)
+    prefetcher.start()
+    return prefetcher
+
+prefetcher = get_prefetcher()
+
+# 全市場掃描任務有檢查點，rerun 或重啟後都能接續
+@st.cache_resource
+def get_scan_job():
+    return ScanJob(fundamentals_cache, rate_controller)
+
+scan_job = get_scan_job()
+
+# 歷史股價存成依股票與年份分割的 Parquet，下載任務在背景執行
+@st.cache_resource
+def get_history_store():
+    return HistoryStore(controller=rate_controller)
+
+history_store = get_history_store()
+
+# 技術面指標只讀本機歷史股價，每個交易日算一次
+@st.cache_resource
+def get_technicals():
+    return TechnicalsCache(history_store)
+
+technicals = get_technicals()
+
 # --- 2. 核心功能：獲取股票清單 ---
-@st.cache_data(ttl=86400)
+# 清單有異動時只處理差異：下市的從快取刪除，新上市的交給背景預抓優先補抓
+def on_universe_change(change):
+    new, dropped = change_tickers(change)
+    fundamentals_cache.delete(dropped)
+    prefetcher.apply_change(new, dropped)
+    scan_job.apply_change(new, dropped)
+    get_tw_stock_list.clear()
+
+@st.cache_resource
+def get_universe_store():
+    store = UniverseStore()
+    store.subscribe(on_universe_change)
+    return store
+
+# 清單存在本機，重啟後直接讀檔；過期時背景用條件式 GET 跟證交所確認，內容有變才重新解析
+@st.cache_data(ttl=600)
 def get_tw_stock_list():
     status_placeholder = st.empty()
-    status_placeholder.text("正在連線證交所抓取最新清單...")
+    status_placeholder.text("正在讀取股票清單...")
 
+    bundled = bundle_universe(bundle) if bundle is not None else None
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        
-        def fetch_and_process(url, suffix):
-            response = requests.get(url, verify=False, headers=headers)
-            response.encoding = 'big5' 
-            dfs = pd.read_html(StringIO(response.text))
-            if not dfs: return pd.DataFrame()
-            df = dfs[0]
-            
-            header_idx = -1
-            for i in range(min(5, len(df))):
-                row_str = str(df.iloc[i].values)
-                if '有價證券代號' in row_str:
-                    header_idx = i
-                    break
-            
-            if header_idx == -1: return pd.DataFrame()
-
-            df.columns = df.iloc[header_idx]
-            df = df.iloc[header_idx+1:].copy()
-            df = df.dropna(subset=['有價證券代號及名稱'])
-            df = df[df['有價證券代號及名稱'].astype(str).str.contains('　')]
-            df['code'] = df['有價證券代號及名稱'].str.split('　').str[0]
-            df['name'] = df['有價證券代號及名稱'].str.split('　').str[1]
-            df = df[df['code'].str.len() == 4]
-            df['yf_ticker'] = df['code'] + suffix
-            return df[['code', 'name', 'yf_ticker']]
-
-        df_tw = fetch_and_process("https://isin.twse.com.tw/isin/C_public.jsp?strMode=2", ".TW")
-        df_two = fetch_and_process("https://isin.twse.com.tw/isin/C_public.jsp?strMode=4", ".TWO")
-        df_final = pd.concat([df_tw, df_two], ignore_index=True)
+        # 上市、上櫃兩頁並行下載，邊下載邊解析，只留 4 碼普通股；還沒有存檔時先用內建快照的清單
+        df_final = get_universe_store().get(fallback=bundled)
         
-        if df_final.empty: raise Exception("抓取到的清單為空")
+        if df_final is None or df_final.empty: raise Exception("抓取到的清單為空")
 
-        status_placeholder.success(f"成功抓取 {len(df_final)} 檔股票！")
+        if df_final is bundled:
+            status_placeholder.info(f"使用內建快照清單 ({len(df_final)} 檔，{bundle_date(bundle)})，背景更新中...")
+        else:
+            status_placeholder.success(f"成功載入 {len(df_final)} 檔股票！")
         return df_final
 
     except Exception as e:
+        if bundled is not None:
+            status_placeholder.warning(f"無法連線證交所 ({e})，改用內建快照清單 ({len(bundled)} 檔，{bundle_date(bundle)})。")
+            return bundled
         status_placeholder.warning(f"無法連線證交所 ({e})，切換至救援模式。")
         fallback_data = [
             {"code": "2330", "name": "台積電", "yf_ticker": "2330.TW"},
@@ -73,12 +154,110 @@ def get_tw_stock_list():
         return pd.DataFrame(fallback_data)
 
 df_stocks = get_tw_stock_list()
+prefetcher.set_universe(df_stocks['yf_ticker'])
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "-"
+    minutes, sec = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} 小時 {minutes} 分" if hours else f"{minutes} 分 {sec} 秒"
+
+# 從快取組出快照，附上每檔的資料時間
+def snapshot_from_cache(rows):
+    loaded = fundamentals_cache.load_many(r['yf_ticker'] for r in rows)
+    origins = fundamentals_cache.sources_many(loaded)
+    records = [{**r, **info_to_metrics(loaded[r['yf_ticker']][0]), 'source': source_label(origins.get(r['yf_ticker'], {}))}
+               for r in rows if r['yf_ticker'] in loaded]
+    return attach_freshness(build_snapshot(records), {t: ts for t, (_, ts) in loaded.items()})
+
+# 快照的排序索引跟著快照走，快照換了才重建
+def snapshot_index():
+    snapshot = st.session_state.get('snapshot')
+    if snapshot is None:
+        return None
+    index = st.session_state.get('snapshot_index')
+    if index is None or index.snapshot is not snapshot:
+        index = st.session_state['snapshot_index'] = SnapshotIndex(snapshot)
+    return index
+
+# 產業統計建立一次後跟著快照走；快照只有部分股票更新時沿用並增量調整 (見 apply_cache_updates)
+def industry_stats():
+    snapshot = st.session_state['snapshot']
+    owner, stats = st.session_state.get('industry_stats', (None, None))
+    if owner is not snapshot:
+        stats = IndustryStats(snapshot)
+        st.session_state['industry_stats'] = (snapshot, stats)
+    return stats
+
+# 把背景預抓在快照之後更新的股票套進快照，只動有變的列
+def apply_cache_updates():
+    snapshot = st.session_state['snapshot']
+    stats = industry_stats()
+    loaded = fundamentals_cache.load_many(snapshot['yf_ticker'])
+    fresh = attach_freshness(snapshot, {t: ts for t, (_, ts) in loaded.items()})['updated']
+    positions = np.flatnonzero((fresh > snapshot['updated']).to_numpy())
+    if not len(positions):
+        return 0
+    updated = snapshot.copy()
+    origins = fundamentals_cache.sources_many(snapshot['yf_ticker'].iloc[positions])
+    for pos in positions:
+        ticker = snapshot['yf_ticker'].iat[pos]
+        metrics = info_to_metrics(loaded[ticker][0])
+        for key, value in metrics.items():
+            updated.iat[pos, updated.columns.get_loc(key)] = value
+        updated.iat[pos, updated.columns.get_loc('source')] = source_label(origins.get(ticker, {}))
+        stats.update(pos, metrics)
+    updated['updated'] = fresh.where(fresh > snapshot['updated'], snapshot['updated'])
+    st.session_state['snapshot'] = updated
+    st.session_state['industry_stats'] = (updated, stats)
+    return len(positions)
+
+# 最新股價 ({yf_ticker: 價格}, {yf_ticker: 來源})：先用官方收盤價檔 (每個交易日兩個請求)，
+# 盤中再用 Yahoo 批次報價 (每次請求 QUOTE_CHUNK 檔) 蓋過去；批次報價失敗或 Yahoo 暫停時沿用收盤價
+def latest_prices(tickers):
+    official, _ = official_infos(tickers)
+    prices = {t: info['currentPrice'] for t, info in official.items() if info.get('currentPrice')}
+    origin = dict.fromkeys(prices, OFFICIAL)
+    if market_open() and source_health.available(YAHOO):
+        chunks = [tickers[i:i + QUOTE_CHUNK] for i in range(0, len(tickers), QUOTE_CHUNK)]
+        for _, got, _ in scan(chunks, lambda c: call_yahoo(fetch_quotes, c, rate_controller), DEFAULT_WORKERS):
+            for t, q in (got or {}).items():
+                prices[t], origin[t] = q['regularMarketPrice'], YAHOO
+    return prices, origin
+
+# 只換股價：每股數值沿用快取，整個快照一次重算本益比 / 淨值比 / 殖利率
+def reprice_snapshot():
+    snapshot = st.session_state['snapshot']
+    tickers = list(snapshot['yf_ticker'])
+    prices, origin = latest_prices(tickers)
+    updated, positions = reprice(snapshot, fundamentals_cache.latest_per_share(tickers), prices)
+    # 價格與三個比率都跟著新股價的來源；ROE / 產業維持快取裡的來源
+    cached = fundamentals_cache.sources_many(updated['yf_ticker'].iloc[positions])
+    for pos in positions:
+        t = tickers[pos]
+        fields = {f: origin[t] for f in ('currentPrice', 'trailingPE', 'priceToBook', 'dividendYield')}
+        fields.update({f: s for f, s in cached.get(t, {}).items() if f in SLOW_FIELDS})
+        updated.iat[pos, updated.columns.get_loc('source')] = source_label(fields)
+    st.session_state['snapshot'] = updated
+    return len(positions)
+
+def show_rate_state(placeholder):
+    state = rate_controller.state()
+    latency = f"{state['latency']:.2f}s" if state['latency'] is not None else "-"
+    text = (f"速率: {state['rate']:.2f} 檔/秒　平均延遲: {latency}\n\n"
+            f"成功 {state['ok']} / 被鎖 {state['blocked']} / 錯誤 {state['error']}")
+    if state['backoff'] > 0:
+        placeholder.warning(f"⏸️ 退避中，{state['backoff']:.0f} 秒後恢復\n\n{text}")
+    else:
+        placeholder.info(text)
 
 # --- 3. 側邊欄設定 ---
 st.sidebar.header("⚙️ 1. 連線測試")
 if st.sidebar.button("測試 Yahoo 連線 (台積電)"):
     try:
-        test_stock = yf.Ticker("2330.TW")
+        test_stock = yf.Ticker("2330.TW", session=get_session('yahoo'))
         test_info = test_stock.info
         st.sidebar.json(test_info) # 顯示原始數據
         if 'currentPrice' in test_info or 'regularMarketPrice' in test_info:
@@ -90,101 +269,476 @@ if st.sidebar.button("測試 Yahoo 連線 (台積電)"):
 
 st.sidebar.markdown("---")
 st.sidebar.header("⚙️ 2. 篩選參數")
-cr_pe = st.sidebar.number_input("最大本益比 (P/E)", value=25.0) # 放寬預設值
-cr_pb = st.sidebar.number_input("最大股價淨值比 (P/B)", value=5.0)
-cr_yield = st.sidebar.slider("最低殖利率 (%)", 0.0, 10.0, 3.0)
-cr_roe = st.sidebar.slider("最低 ROE (%)", 0.0, 30.0, 5.0)
+index = snapshot_index()
+
+# 每個條件下方即時顯示快照中單獨符合的檔數 (二分搜尋，拖動滑桿不必重掃)
+def match_count(key, value):
+    if index is not None:
+        st.sidebar.caption(f"{index.count(key, value)} 檔符合")
+    return value
+
+cr_pe = match_count('pe', st.sidebar.number_input("最大本益比 (P/E)", value=25.0)) # 放寬預設值
+cr_pb = match_count('pb', st.sidebar.number_input("最大股價淨值比 (P/B)", value=5.0))
+cr_yield = match_count('yield', st.sidebar.slider("最低殖利率 (%)", 0.0, 10.0, 3.0))
+cr_roe = match_count('roe', st.sidebar.slider("最低 ROE (%)", 0.0, 30.0, 5.0))
+criteria = {'pe': cr_pe, 'pb': cr_pb, 'yield': cr_yield, 'roe': cr_roe}
+if index is not None:
+    st.sidebar.caption(f"四項同時符合：{len(index.positions(criteria))} / {len(index)} 檔")
+
+# 排名模式：四個指標在整個快照的百分位依權重加總，取分數最高的前 N 檔
+rank_mode = st.sidebar.toggle("🏅 綜合評分排名", help="本益比、淨值比越低越好，殖利率、ROE 越高越好；缺值以最差計")
+if rank_mode:
+    with st.sidebar.expander("評分權重", expanded=True):
+        weights = {
+            'pe': st.slider("本益比權重", 0.0, 5.0, 1.0, 0.5),
+            'pb': st.slider("股價淨值比權重", 0.0, 5.0, 1.0, 0.5),
+            'yield': st.slider("殖利率權重", 0.0, 5.0, 1.0, 0.5),
+            'roe': st.slider("ROE 權重", 0.0, 5.0, 1.0, 0.5),
+        }
+        top_n = st.number_input("取前 N 檔", 1, 500, 30)
+        rank_within = st.checkbox("只排名符合上述條件的股票", value=False)
+
+# 產業相對篩選：每檔在同產業內的百分位 (越大越好)，與上面的絕對條件同時成立
+industry_mode = st.sidebar.toggle("🏭 產業相對篩選", help="例如本益比設 70 代表本益比要比同產業 70% 的公司低")
+if industry_mode:
+    with st.sidebar.expander("至少優於同業 (%)", expanded=True):
+        rel_criteria = {
+            'pe': st.slider("本益比優於同業", 0, 100, 50, 5),
+            'pb': st.slider("股價淨值比優於同業", 0, 100, 0, 5),
+            'yield': st.slider("殖利率優於同業", 0, 100, 0, 5),
+            'roe': st.slider("ROE 優於同業", 0, 100, 0, 5),
+        }
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("🚀 3. 執行控制")
 total_stocks = len(df_stocks)
 batch_size = st.sidebar.slider(f"掃描範圍 (建議一次 50 檔)", 0, total_stocks, (0, 50))
 start_idx, end_idx = batch_size
+fetch_mode = st.sidebar.radio("抓取模式", ["執行緒池", "asyncio", "批次報價", "官方批次檔"], horizontal=True,
+                              help="asyncio 模式在少量 HTTP/2 連線上同時送出大量請求 (仍受速率控制器限制，"
+                                   f"最多 {rate_controller.max_rate:g} 檔/秒)；"
+                                   f"批次報價一次請求 {QUOTE_CHUNK} 檔，只對初篩通過的股票補抓 ROE；"
+                                   "官方批次檔用證交所 / 櫃買中心的每日估值檔 (各一個請求)，Yahoo 只補 ROE 與產業")
+if fetch_mode == "asyncio":
+    max_workers = st.sidebar.number_input("同時在途請求數", 1, 500, 200)
+else:
+    max_workers = st.sidebar.number_input("並行連線數", 1, MAX_WORKERS, DEFAULT_WORKERS, help="同時分析的股票數量，實際送出速率由下方速率控制器自動調整")
+st.sidebar.caption("📡 Yahoo 連線速率 (AIMD 自動調整)")
+rate_placeholder = st.sidebar.empty()
+show_rate_state(rate_placeholder)
+
+with st.sidebar.expander("💾 本機快取"):
+    use_cache = st.checkbox("使用快取 (有效期內不重新連線)", value=True)
+    price_ttl = st.number_input("價格類欄位有效時間 (小時)", 0.0, 720.0, 6.0)
+    slow_ttl = st.number_input("ROE / 產業有效時間 (天)", 0.0, 365.0, 7.0)
+    st.caption(f"已快取 {fundamentals_cache.count()} 檔")
+    if st.button("清除快取"):
+        fundamentals_cache.clear()
+with st.sidebar.expander("🛰️ 背景預抓 (全市場)"):
+    status = prefetcher.status()
+    cached_count = len(fundamentals_cache.load_many(df_stocks['yf_ticker']))
+    st.caption(f"{'執行中' if status['running'] else '已暫停'}　已快取 {cached_count}/{total_stocks} 檔，待更新 {status['pending']} 檔")
+    if status['current']:
+        st.caption(f"正在更新: {status['current']}　(本次啟動已抓 {status['fetched']} 檔，失敗 {status['failed']} 檔)")
+    if status['bulk_day']:
+        st.caption(f"官方批次檔已寫入 {status['bulk_day']} 的價格與估值")
+    if status['last_error']:
+        st.caption(f"最近錯誤: {status['last_error']}")
+    recent = get_universe_store().changes(limit=5)
+    if recent:
+        st.caption("清單異動 (最近 5 次)")
+        st.dataframe(pd.DataFrame([
+            {'時間': pd.Timestamp(c['at'], unit='s', tz='Asia/Taipei').strftime('%m-%d %H:%M'),
+             '新上市': ', '.join(r['code'] for r in c['added']),
+             '下市': ', '.join(r['code'] for r in c['removed']),
+             '改名/轉市場': ', '.join(f"{r['code']} {r['old_name']}→{r['name']}" for r in c['renamed'])}
+            for c in recent]), hide_index=True)
+    if status['running']:
+        if st.button("暫停背景預抓"):
+            prefetcher.pause()
+    elif st.button("啟動背景預抓"):
+        prefetcher.start()
+
+@st.fragment(run_every=2)
+def scan_job_panel():
+    job = scan_job.status()
+    labels = {'idle': '尚未建立', 'running': '執行中', 'paused': '已暫停 (可繼續)', 'done': '已完成'}
+    st.caption(f"狀態: {labels[job['state']]}　{job['done']}/{job['total']} 檔，失敗 {job['failed']} 檔")
+    if job['total']:
+        st.progress(job['done'] / job['total'])
+    if job['rate']:
+        st.caption(f"實測 {job['rate']:.2f} 檔/秒，預估剩餘 {format_eta(job['eta'])}")
+    col_a, col_b = st.columns(2)
+    if job['state'] == 'running':
+        if col_a.button("暫停任務"):
+            scan_job.pause()
+    elif job['total'] and job['done'] < job['total'] and col_a.button("繼續任務"):
+        scan_job.resume()
+    if col_b.button("重新開始"):
+        scan_job.start_new(df_stocks['yf_ticker'])
+
+with st.sidebar.expander("🗂️ 全市場掃描任務 (可續傳)"):
+    scan_job_panel()
+
+@st.fragment(run_every=2)
+def history_panel():
+    hist = history_store.status()
+    st.caption(f"已存 {hist['stored']} 檔，最新交易日 {hist['last'] or '-'}")
+    if hist['state'] == 'running':
+        st.caption(f"更新中 {hist['done']}/{hist['total']} 檔，失敗 {hist['failed']} 檔")
+        if hist['total']:
+            st.progress(hist['done'] / hist['total'])
+    elif hist['state'] == 'done':
+        st.caption(f"上次更新 {hist['done']} 檔，失敗 {hist['failed']} 檔")
+    if hist['last_error']:
+        st.caption(f"最近錯誤: {hist['last_error']}")
+    if hist['state'] != 'running' and st.button("下載 / 更新歷史股價 (全市場)"):
+        history_store.update_in_background([*df_stocks['yf_ticker'], BENCHMARK])
+
+with st.sidebar.expander("📈 歷史股價 (日線)"):
+    history_panel()
+
+with st.sidebar.expander("🩺 資料來源狀態"):
+    health = source_health.status()
+    if health:
+        labels = {'ok': '正常', 'slow': '偏慢 (降低優先)', 'down': '暫停使用'}
+        st.dataframe(pd.DataFrame([
+            {'來源': SOURCE_LABELS.get(name, name), '狀態': labels[h['state']], '成功': h['ok'], '失敗': h['errors'],
+             '平均延遲(s)': round(h['latency'], 2) if h['latency'] is not None else None,
+             '最近錯誤': h['last_error']}
+            for name, h in health.items()]), hide_index=True)
+    else:
+        st.caption("尚無請求")
+    st.caption("各欄位優先順序：價格 / 本益比 / 淨值比 / 殖利率 官方 → Yahoo → 快取；ROE / 產業 Yahoo → 快取")
+
+with st.sidebar.expander("🌐 連線統計"):
+    host_stats = http_metrics.snapshot()
+    if host_stats:
+        st.dataframe(pd.DataFrame([
+            {'主機': host, '請求數': h['requests'], '錯誤': h['errors'], '進行中': h['in_flight'],
+             '平均延遲(s)': round(h['avg_latency'], 3) if h['avg_latency'] is not None else None,
+             '下載(KB)': round(h['bytes'] / 1024, 1),
+             '狀態碼': ', '.join(f"{k}×{v}" for k, v in sorted(h['status'].items()))}
+            for host, h in host_stats.items()]), hide_index=True)
+    else:
+        st.caption("尚無請求")
+
+cache_ttls = {f: price_ttl * HOUR for f in QUOTE_FIELDS + ('currentPrice',)}
+cache_ttls.update({'returnOnEquity': slow_ttl * DAY, 'industry': max(slow_ttl * DAY, 30 * DAY)})
 
 # --- 4. 分析邏輯 (增強版) ---
-def analyze_stock(ticker_info, criteria):
+# 經過健康檢查呼叫 Yahoo：連續失敗而暫停使用時直接略過 (欄位改由其他來源補，見 fetch_stream)
+def call_yahoo(fn, *args):
+    return source_health.call(YAHOO, fn, *args)
+
+def load_info(ticker_info, official=None):
+    # 抓取 (由速率控制器排隊，抓不到價格會視為被鎖並自動退避)，成功就寫進快取；
+    # official 為這次掃描的官方檔數值，官方已有的欄位不拿 Yahoo 的蓋掉
+    t = ticker_info['yf_ticker']
+    info = call_yahoo(fetch_info, t, rate_controller)
+    fundamentals_cache.put(t, info, yahoo_fields(FIELDS, (official or {}).get(t)))
+    return info
+
+# 官方批次檔 (每個交易日下載一次)；暫停使用或下載失敗的市場不在結果裡
+def official_infos(tickers):
+    if not source_health.available(OFFICIAL):
+        return {}, {}
+    t0 = time.monotonic()
     try:
-        stock = yf.Ticker(ticker_info['yf_ticker'])
-        info = stock.info
-        
-        # 1. 寬鬆的價格檢查
-        price = info.get('currentPrice') or info.get('regularMarketPrice')
-        if not price:
-            return None # 真的抓不到價格才跳過
-
-        # 2. 數據獲取 (缺值補 0 或 999)
-        pe = info.get('trailingPE')
-        if pe is None: pe = info.get('forwardPE', 999) # 嘗試用預估本益比替補
-        
-        pb = info.get('priceToBook', 999)
-        dy = info.get('dividendYield', 0)
-        roe = info.get('returnOnEquity', 0)
-        
-        if pe is None: pe = 999
-        if pb is None: pb = 999
-        if dy is None: dy = 0
-        if roe is None: roe = 0
-        
-        dy_pct = dy * 100
-        roe_pct = roe * 100
-        
-        # 3. 條件篩選
-        if (pe < criteria['pe'] and pb < criteria['pb'] and 
-            dy_pct >= criteria['yield'] and roe_pct >= criteria['roe']):
-            
-            return {
-                '代號': ticker_info['code'],
-                '名稱': ticker_info['name'],
-                '股價': price,
-                '本益比': round(pe, 2) if pe != 999 else "N/A",
-                '股價淨值比': round(pb, 2),
-                '殖利率(%)': round(dy_pct, 2),
-                'ROE(%)': round(roe_pct, 2),
-                '產業': info.get('industry', 'N/A')
-            }
-    except Exception:
-        return None
-    return None
+        _, infos, errors = official_feed.get()
+    except Exception as e:
+        infos, errors = {}, {'twse': e, 'tpex': e}
+    source_health.record(OFFICIAL, not errors, time.monotonic() - t0, '; '.join(f"{m} {e}" for m, e in errors.items()) or None)
+    official = {t: infos[t] for t in tickers if t in infos}
+    if official:
+        fundamentals_cache.put_many([(t, info, None) for t, info in official.items()], OFFICIAL_FIELDS, OFFICIAL, partial=True)
+    return official, errors
+
+# 批次模式：先用多檔報價一次取得價格/本益比/淨值比/殖利率做初篩，
+# 報價沒有 ROE 與產業，只對初篩通過的少數股票再逐檔抓 .info
+def batch_fetch(rows, criteria, max_workers, official):
+    by_ticker = {r['yf_ticker']: r for r in rows}
+    quotes = fundamentals_cache.get_many(by_ticker, QUOTE_FIELDS, cache_ttls) if use_cache else {}
+    tickers = [t for t in by_ticker if t not in quotes]
+    chunks = [tickers[i:i + QUOTE_CHUNK] for i in range(0, len(tickers), QUOTE_CHUNK)]
+    prefilter = {**criteria, 'roe': float('-inf')}
+
+    for chunk, got, err in scan(chunks, lambda c: call_yahoo(fetch_quotes, c, rate_controller), max_workers):
+        for sym in chunk:
+            if got and sym in got:
+                fundamentals_cache.put(sym, got[sym], yahoo_fields(QUOTE_FIELDS, official.get(sym)))
+                quotes[sym] = got[sym]
+            else:
+                yield by_ticker[sym], None, err
+
+    candidates = []
+    if quotes:
+        prescreen = build_snapshot([{'yf_ticker': sym, **info_to_metrics(info)} for sym, info in quotes.items()])
+        passed = set(prescreen.loc[screen_mask(prescreen, prefilter), 'yf_ticker'])
+        for sym, info in quotes.items():
+            if sym in passed:
+                candidates.append(by_ticker[sym])
+            else:
+                yield by_ticker[sym], info, None
+    yield from scan(candidates, lambda r: load_info(r, official), max_workers)
+
+# 官方批次檔模式：本益比 / 淨值比 / 殖利率與收盤價來自證交所與櫃買中心的全市場檔案 (由 fetch_stream 合併)，
+# 官方沒有 ROE 與產業，只對初篩通過的股票補：快取裡還有效就直接用，否則再逐檔抓 Yahoo。
+# 官方檔裡沒有的股票 (或該市場下載失敗) 整檔改抓 Yahoo。
+def official_fetch(rows, criteria, max_workers, official):
+    by_ticker = {r['yf_ticker']: r for r in rows}
+    slow = fundamentals_cache.get_many(official, SLOW_FIELDS, cache_ttls) if use_cache else {}
+    passed = set()
+    if official:
+        prescreen = build_snapshot([{'yf_ticker': t, **info_to_metrics(info)} for t, info in official.items()])
+        passed = set(prescreen.loc[screen_mask(prescreen, {**criteria, 'roe': float('-inf')}), 'yf_ticker'])
+    need_yahoo = [r for r in rows if r['yf_ticker'] not in official]
+    for t in official:
+        if t in passed and t not in slow:
+            need_yahoo.append(by_ticker[t])
+        else:
+            yield by_ticker[t], None, None
+    yield from scan(need_yahoo, lambda r: load_info(r, official), max_workers)
+
+# 依抓取模式逐檔回傳 (股票, info, 錯誤, 來源說明)；快取有效的股票直接回傳，不碰網路。
+# 各模式只負責抓 Yahoo，最後每個欄位依來源優先順序與健康狀態在官方檔、Yahoo、快取之間挑選 (sources.fuse)，
+# Yahoo 被鎖時掃描照樣有官方數值與快取可用，不會整批失敗。
+def fetch_stream(rows, criteria, mode, max_workers):
+    by_ticker = {r['yf_ticker']: r for r in rows}
+    cached = fundamentals_cache.get_many(by_ticker, ttls=cache_ttls) if use_cache else {}
+    origins = fundamentals_cache.sources_many(by_ticker)
+    for sym, info in cached.items():
+        yield by_ticker[sym], info, None, source_label(origins.get(sym, {}))
+    misses = [r for r in rows if r['yf_ticker'] not in cached]
+    if not misses:
+        return
+
+    official, errors = official_infos([r['yf_ticker'] for r in misses])
+    if mode == "官方批次檔":
+        for market, err in errors.items():
+            st.warning(f"{market.upper()} 官方批次檔下載失敗，該市場改抓 Yahoo: {err}")
+    stale = {t: info for t, (info, _) in fundamentals_cache.load_many(by_ticker).items()} if use_cache else {}
+
+    if mode == "asyncio":
+        if source_health.available(YAHOO):
+            def stream():
+                for sym, info, err in fetch_many([r['yf_ticker'] for r in misses], concurrency=max_workers, controller=rate_controller):
+                    source_health.record(YAHOO, info is not None, error=str(err) if err else None)
+                    if info:
+                        fundamentals_cache.put(sym, info, yahoo_fields(FIELDS, official.get(sym)))
+                    yield by_ticker[sym], info, err
+            raw = stream()
+        else:
+            raw = ((r, None, SourceUnavailable("Yahoo 暫停使用")) for r in misses)
+    elif mode == "批次報價":
+        raw = batch_fetch(misses, criteria, max_workers, official)
+    elif mode == "官方批次檔":
+        raw = official_fetch(misses, criteria, max_workers, official)
+    else:
+        raw = scan(misses, lambda r: load_info(r, official), max_workers)
+
+    for row, info, err in raw:
+        t = row['yf_ticker']
+        fused, origin = fuse({OFFICIAL: official.get(t), YAHOO: info, CACHE: stale.get(t)}, source_health)
+        yield row, fused, err if fused is None else None, source_label(resolve_cached(origin, origins.get(t, {})))
 
 # --- 5. 執行按鈕 ---
-if st.button('開始掃描選股'):
+# 掃描只負責抓原始數據並存成快照；篩選在下一段對快照做向量化運算，
+# 調整側邊欄條件時不需要重新連線。
+col_scan, col_warm, col_job = st.columns([1, 1.5, 1.5])
+with col_warm:
+    if st.button('📦 直接讀取背景快照 (全市場)'):
+        st.session_state['snapshot'] = snapshot_from_cache(df_stocks.to_dict('records'))
+        st.session_state['scan_stats'] = {'scanned': total_stocks, 'failed': total_stocks - len(st.session_state['snapshot'])}
+with col_job:
+    if st.button('🗂️ 讀取掃描任務結果'):
+        job_rows = df_stocks[df_stocks['yf_ticker'].isin(scan_job.done)].to_dict('records')
+        st.session_state['snapshot'] = snapshot_from_cache(job_rows)
+        st.session_state['scan_stats'] = {'scanned': len(scan_job.tickers), 'failed': scan_job.status()['failed']}
+
+if col_scan.button('開始掃描選股'):
     target_list = df_stocks.iloc[start_idx:end_idx]
     st.write(f"🔍 正在掃描: {start_idx} ~ {end_idx} (共 {len(target_list)} 檔)...")
     
-    results = []
+    records = []
     progress_bar = st.progress(0)
     status_text = st.empty()
+    table_placeholder = st.empty()
     
     # 用於統計失敗原因
     fail_count = 0
     
-    for i, (_, row) in enumerate(target_list.iterrows()):
-        progress = (i + 1) / len(target_list)
-        progress_bar.progress(progress)
-        status_text.text(f"分析中: {row['code']} {row['name']}")
+    rows = target_list.to_dict('records')
+    
+    # 並行分析：每完成一檔就更新進度與即時結果表
+    for i, (row, info, err, source) in enumerate(fetch_stream(rows, criteria, fetch_mode, max_workers)):
+        progress_bar.progress((i + 1) / len(rows))
+        status_text.text(f"已完成: {row['code']} {row['name']} ({i + 1}/{len(rows)})")
         
-        criteria = {'pe': cr_pe, 'pb': cr_pb, 'yield': cr_yield, 'roe': cr_roe}
-        res = analyze_stock(row, criteria)
+        show_rate_state(rate_placeholder)
         
-        if res:
-            results.append(res)
+        if info:
+            records.append({**row, **info_to_metrics(info), 'source': source})
         else:
             fail_count += 1
-            
-        # 重要：強制休息，避免被 Yahoo 封鎖
-        time.sleep(0.5)
+        
+        # 即時結果表每 20 檔重算一次就好，避免大範圍掃描時反覆重建表格
+        if records and (i % 20 == 0 or i + 1 == len(rows)):
+            live = build_snapshot(records)
+            table_placeholder.dataframe(format_results(live[screen_mask(live, criteria)]), use_container_width=True)
 
     progress_bar.empty()
+    table_placeholder.empty()
     status_text.text("掃描完成！")
     
-    if results:
-        df_res = pd.DataFrame(results)
-        st.success(f"✅ 找到 {len(df_res)} 檔潛力股！")
+    loaded = fundamentals_cache.load_many(r['yf_ticker'] for r in records)
+    st.session_state['snapshot'] = attach_freshness(build_snapshot(records), {t: ts for t, (_, ts) in loaded.items()})
+    st.session_state['scan_stats'] = {'scanned': len(rows), 'failed': fail_count}
+
+# --- 6. 篩選結果 (對快照即時重算) ---
+if 'snapshot' in st.session_state:
+    snapshot = st.session_state['snapshot']
+    stats = st.session_state['scan_stats']
+    col_apply, col_reprice = st.columns(2)
+    if col_apply.button("🔄 套用背景預抓的新數據"):
+        st.toast(f"更新了 {apply_cache_updates()} 檔")
+        snapshot = st.session_state['snapshot']
+    if col_reprice.button("⚡ 以最新股價重算比率", help="每股盈餘 / 淨值 / 股利沿用快取，只整批更新股價；盤中用 Yahoo 批次報價，收盤後用官方收盤價"):
+        st.toast(f"重算了 {reprice_snapshot()} 檔")
+        snapshot = st.session_state['snapshot']
+    index = snapshot_index()
+    positions = index.positions(criteria)
+    if industry_mode:
+        positions = positions[industry_stats().mask(rel_criteria)[positions]]
+    if rank_mode:
+        selected = index.top(weights, top_n, positions if rank_within else None)
+    else:
+        selected = snapshot.iloc[positions]
+    # 有本機歷史股價時附上 52 週區間、均線與回撤，幫忙分辨便宜股和價值陷阱
+    show_tech = history_store.status()['stored'] > 0 and st.checkbox("顯示技術面 (本機歷史股價)", value=True)
+    if show_tech:
+        selected = selected.join(technicals.get(selected['yf_ticker']), on='yf_ticker')
+    df_res = format_results(selected)
+    
+    if not df_res.empty:
+        if rank_mode:
+            st.success(f"🏅 綜合評分前 {len(df_res)} 名 (快照共 {len(snapshot)} 檔，調整權重會立即重新排名)")
+        else:
+            st.success(f"✅ 找到 {len(df_res)} 檔潛力股！(快照共 {len(snapshot)} 檔，調整條件會立即重新篩選)")
+        if snapshot['updated'].notna().any():
+            st.caption(f"資料時間：{snapshot['updated'].min():%Y-%m-%d %H:%M} ~ {snapshot['updated'].max():%Y-%m-%d %H:%M}")
         st.dataframe(df_res.style.highlight_max(axis=0, color='lightgreen'), use_container_width=True)
         
         csv = df_res.to_csv(index=False).encode('utf-8-sig')
         st.download_button("📥 下載 Excel", csv, "value_stocks.csv", "text/csv")
+        if industry_mode:
+            with st.expander("🏭 產業中位數"):
+                summary = industry_stats().summary().rename(columns={'industry': '產業', 'count': '檔數', **DISPLAY_COLUMNS})
+                st.dataframe(summary.round(2), hide_index=True)
     else:
         st.error(f"⚠️ 在此區間未發現符合條件的股票。")
-        st.warning(f"診斷資訊：已掃描 {len(target_list)} 檔，全部不符合條件或數據抓取失敗。")
+        st.warning(f"診斷資訊：已掃描 {stats['scanned']} 檔，{stats['failed']} 檔數據抓取失敗，其餘不符合條件。")
         st.info("建議：1. 使用側邊欄「測試 Yahoo 連線」確認 IP 是否被鎖。 2. 嘗試縮小掃描範圍。")
+
+# --- 7. 歷史回測 ---
+# 用目前側邊欄的四個條件，在本機歷史股價與快取累積的時點基本面上回測，和加權指數比較
+with st.expander("📈 歷史回測 (套用目前的篩選條件)"):
+    if history_store.status()['stored'] == 0:
+        st.info("請先在側邊欄「📈 歷史股價」下載歷史股價。")
+    else:
+        bt_cols = st.columns(4)
+        bt_start = bt_cols[0].date_input("起始日", value=pd.Timestamp.now() - pd.DateOffset(years=10))
+        bt_freq = bt_cols[1].selectbox("換股頻率", ['M', 'Q', 'H', 'Y'],
+                                      format_func={'M': '每月', 'Q': '每季', 'H': '每半年', 'Y': '每年'}.get)
+        bt_cost = bt_cols[2].number_input("單邊交易成本 (%)", 0.0, 2.0, 0.3, 0.05)
+        bt_backfill = bt_cols[3].checkbox("基本面往前套用", help="把最早一筆基本面套到更早的日期，可回測更久但有前視偏差")
+        if st.button("執行回測"):
+            try:
+                panel = build_panel(history_store, fundamentals_cache, start=str(bt_start), backfill=bt_backfill)
+                curve, periods, stats = run_backtest(panel, criteria, bt_freq, bt_cost / 100)
+            except ValueError as e:
+                st.warning(str(e))
+            else:
+                if panel['start'] > pd.Timestamp(bt_start):
+                    st.info(f"時點基本面從 {panel['start']:%Y-%m-%d} 才有資料，回測從這天開始 (勾選「基本面往前套用」可回測更早)")
+                st.caption(f"{len(panel['tickers'])} 檔 x {len(panel['dates'])} 個交易日，平均持股 {periods['持股數'].mean():.1f} 檔")
+                st.line_chart(curve)
+                st.dataframe(stats.round(2))
+                st.dataframe(periods.set_index('換股日').round(2))
+
+        # 門檻最佳化：每組門檻做走勢前推回測 (滾動的訓練期 / 測試期)，分散到所有 CPU 核心
+        st.markdown("---")
+        st.markdown("**🔍 門檻最佳化 (走勢前推)**")
+        opt_cols = st.columns(4)
+        opt_mode = opt_cols[0].radio("搜尋方式", ["網格", "隨機"], horizontal=True)
+        opt_n = opt_cols[1].number_input("隨機組數", 10, 5000, 200, disabled=opt_mode == "網格")
+        opt_train = opt_cols[2].number_input("訓練期 (年)", 1, 8, 3)
+        opt_test = opt_cols[3].number_input("測試期 (年)", 1, 3, 1)
+        candidates = grid_candidates() if opt_mode == "網格" else random_candidates(opt_n)
+        if st.button(f"開始最佳化 ({len(candidates)} 組)"):
+            opt_bar = st.progress(0.0)
+            try:
+                panel = build_panel(history_store, fundamentals_cache, start=str(bt_start), backfill=bt_backfill)
+                table, walk = optimize(panel, candidates, bt_freq, bt_cost / 100, opt_train, opt_test,
+                                       progress=lambda done, total: opt_bar.progress(done / total))
+            except ValueError as e:
+                st.warning(str(e))
+            else:
+                st.session_state['optimize'] = (table, walk)
+            opt_bar.empty()
+        if 'optimize' in st.session_state:
+            table, walk = st.session_state['optimize']
+            st.caption("各組門檻 (依測試期平均年化報酬排序，點欄位標題可改排序)")
+            st.dataframe(table.round(2), hide_index=True)
+            st.caption("每個區段用訓練期最佳的門檻，在下一段測試期的實際表現")
+            st.dataframe(walk.round(2), hide_index=True)
+
+# --- 8. 盤中即時監控 ---
+# 以目前的快照為底，背景輪詢證交所 MIS 批次即時報價 (每次請求 MIS_CHUNK 檔)，
+# 只重算價格有變的股票；新進入或跌出篩選條件時推播到頁面
+@st.fragment(run_every=2)
+def live_panel():
+    poller = st.session_state['live']
+    poller.start()   # 分頁被瀏覽器節流太久而閒置停止時接回來
+    status = poller.status()
+    last = pd.Timestamp(status['last_poll'], unit='s', tz='Asia/Taipei').strftime('%H:%M:%S') if status['last_poll'] else '-'
+    st.caption(f"已輪詢 {status['polls']} 次 (最近 {last})，上次 {status['updated']} 檔價格變動，目前 {status['matched']} 檔符合")
+    if status['last_error']:
+        st.caption(f"最近錯誤: {status['last_error']}")
+    snapshot = poller.screen.snapshot
+    names = dict(zip(snapshot['yf_ticker'], snapshot['code'].astype(str) + ' ' + snapshot['name'].astype(str)))
+    new = poller.events(st.session_state.get('live_seen', 0))
+    for e in new[-5:]:
+        st.toast(f"{'🟢 進入' if e['kind'] == 'entry' else '🔴 跌出'}篩選: {names.get(e['yf_ticker'], e['yf_ticker'])} @ {e['price']:.2f}")
+    if new:
+        st.session_state['live_seen'] = new[-1]['seq']
+    st.dataframe(format_results(poller.matches()), use_container_width=True)
+    events = poller.events()[-20:]
+    if events:
+        st.caption("最近進出 (新的在上)")
+        st.dataframe(pd.DataFrame([
+            {'時間': pd.Timestamp(e['at'], unit='s', tz='Asia/Taipei').strftime('%H:%M:%S'),
+             '股票': names.get(e['yf_ticker'], e['yf_ticker']),
+             '變化': '進入' if e['kind'] == 'entry' else '跌出',
+             '價格': round(e['price'], 2)}
+            for e in reversed(events)]), hide_index=True)
+
+if 'snapshot' in st.session_state:
+    with st.expander("⏱️ 盤中即時監控 (套用目前的篩選條件)"):
+        poller = st.session_state.get('live')
+        live_on = st.toggle("啟動即時監控", key='live_on', help=f"每 5 秒一輪，每次請求 {MIS_CHUNK} 檔")
+        if not market_open():
+            st.caption("目前非交易時段，暫停輪詢，開盤後自動開始")
+        if live_on:
+            snapshot = st.session_state['snapshot']
+            if poller is None or poller.screen.snapshot is not snapshot:
+                if poller is not None:
+                    poller.stop()
+                screen = LiveScreen(snapshot, fundamentals_cache.latest_per_share(snapshot['yf_ticker']), criteria)
+                poller = st.session_state['live'] = LivePoller(screen)
+                st.session_state['live_seen'] = 0
+            poller.set_criteria(criteria)
+            poller.start()
+            live_panel()
+        elif poller is not None:
+            poller.stop()
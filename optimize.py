@@ -0,0 +1,132 @@
+import itertools
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest import growth_index, run_backtest, slice_panel
+from technicals import TRADING_YEAR
+
+ARRAYS = ('close', 'adj', 'eps', 'bvps', 'dps', 'roe', 'bench')
+
+# 預設的搜尋範圍：網格用列出的值，隨機搜尋在 (最小, 最大) 之間均勻抽樣
+GRID = {
+    'pe': [10, 15, 20, 25, 30],
+    'pb': [1.0, 1.5, 2.0, 3.0, 5.0],
+    'yield': [0.0, 2.0, 3.0, 4.0, 5.0],
+    'roe': [0.0, 5.0, 10.0, 15.0],
+}
+RANGES = {'pe': (5, 40), 'pb': (0.5, 6), 'yield': (0, 8), 'roe': (0, 25)}
+
+
+def grid_candidates(grid=GRID):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def random_candidates(n, ranges=RANGES, seed=0):
+    rng = np.random.default_rng(seed)
+    draws = {k: rng.uniform(lo, hi, n).round(1) for k, (lo, hi) in ranges.items()}
+    return [{k: float(draws[k][i]) for k in ranges} for i in range(n)]
+
+
+# 滾動的 (訓練, 測試) 區段，以交易日列位置表示；每次往後移一個測試期
+def walk_forward_folds(n_dates, train_years=3, test_years=1):
+    train, test = int(train_years * TRADING_YEAR), int(test_years * TRADING_YEAR)
+    folds = []
+    start = 0
+    while start + train + test <= n_dates:
+        folds.append(((start, start + train), (start + train, start + train + test)))
+        start += test
+    return folds
+
+
+# --- 子程序 ---
+# 陣列事先存成 .npy，每個子程序啟動時以 memmap 開啟一次，不必把幾百 MB 的資料 pickle 給每個工作。
+# 各區段的累積報酬指數與條件無關，在子程序內算一次後重複使用。
+_panel = None
+_growth = {}
+
+
+def _init_worker(array_dir, dates, tickers):
+    global _panel
+    _panel = {'dates': pd.DatetimeIndex(dates), 'tickers': tickers}
+    for name in ARRAYS:
+        path = os.path.join(array_dir, f'{name}.npy')
+        _panel[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+
+def _segment(start, stop):
+    if (start, stop) not in _growth:
+        part = slice_panel(_panel, start, stop)
+        _growth[(start, stop)] = (part, growth_index(np.asarray(part['adj'])))
+    return _growth[(start, stop)]
+
+
+def _annual(stats, name):
+    return stats.at['年化報酬(%)', name] if name in stats else np.nan
+
+
+def _evaluate(candidate, folds, freq, cost):
+    rows = []
+    for train, test in folds:
+        fold = {}
+        for label, (start, stop) in (('train', train), ('test', test)):
+            part, growth = _segment(start, stop)
+            _, periods, stats = run_backtest(part, candidate, freq, cost, growth)
+            fold[label] = _annual(stats, '策略')
+            fold[label + '_bench'] = _annual(stats, '加權指數')
+            fold[label + '_dd'] = stats.at['最大回撤(%)', '策略']
+            fold[label + '_holdings'] = periods['持股數'].mean()
+        rows.append(fold)
+    return candidate, rows
+
+
+# --- 走勢前推最佳化 ---
+# 每組門檻在每個區段的訓練期與測試期各回測一次；所有組合分散到程序池 (預設用滿所有核心)。
+# 回傳 (每組門檻的彙總表, 每個區段挑訓練期最佳門檻後的樣本外結果)。
+def optimize(panel, candidates, freq='M', cost=0.0, train_years=3, test_years=1, workers=None, progress=None):
+    folds = walk_forward_folds(len(panel['dates']), train_years, test_years)
+    if not folds:
+        raise ValueError("歷史資料不足一個訓練期加測試期，請縮短區間或提早起始日")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='screen-opt-') as array_dir:
+        for name in ARRAYS:
+            if panel.get(name) is not None:
+                np.save(os.path.join(array_dir, f'{name}.npy'), np.ascontiguousarray(panel[name]))
+        dates = [d.strftime('%Y-%m-%d') for d in panel['dates']]
+        # spawn 而不是 fork：Streamlit 程序裡有其他執行緒，fork 可能卡在它們持有的鎖
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(array_dir, dates, panel['tickers'])) as pool:
+            futures = [pool.submit(_evaluate, c, folds, freq, cost) for c in candidates]
+            for i, future in enumerate(futures):
+                results.append(future.result())
+                if progress is not None:
+                    progress(i + 1, len(futures))
+
+    table = pd.DataFrame([{
+        **candidate,
+        '訓練年化(%)': np.nanmean([f['train'] for f in rows]),
+        '測試年化(%)': np.nanmean([f['test'] for f in rows]),
+        '測試超額(%)': np.nanmean([f['test'] - f['test_bench'] for f in rows]),
+        '測試勝過大盤': sum(f['test'] > f['test_bench'] for f in rows),
+        '測試最大回撤(%)': min(f['test_dd'] for f in rows),
+        '平均持股': np.nanmean([f['test_holdings'] for f in rows]),
+    } for candidate, rows in results]).sort_values('測試年化(%)', ascending=False, ignore_index=True)
+
+    walk = []
+    for k, (train, test) in enumerate(folds):
+        best, rows = max(results, key=lambda r: np.nan_to_num(r[1][k]['train'], nan=-np.inf))
+        walk.append({
+            '訓練期': f"{panel['dates'][train[0]]:%Y-%m} ~ {panel['dates'][train[1] - 1]:%Y-%m}",
+            '測試期': f"{panel['dates'][test[0]]:%Y-%m} ~ {panel['dates'][test[1] - 1]:%Y-%m}",
+            **best,
+            '訓練年化(%)': rows[k]['train'],
+            '測試年化(%)': rows[k]['test'],
+            '加權指數(%)': rows[k]['test_bench'],
+        })
+    return table, pd.DataFrame(walk)
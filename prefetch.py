@@ -0,0 +1,160 @@
+import threading
+import time
+
+from cache import FIELDS, SLOW_FIELDS
+from exchange import OFFICIAL_FIELDS, RETRY_LAGGING, trading_day
+from sources import OFFICIAL, YAHOO, yahoo_fields
+from yahoo import fetch_info
+
+
+# --- 背景預抓 ---
+# 獨立於任何使用者 session 的常駐執行緒：依新舊順序巡整個股票清單，
+# 把過期或沒抓過的基本面補進快取。使用者篩選時直接讀快取，不必等網路。
+# 有官方批次檔 (feed，見 exchange.OfficialFeed) 時，每個交易日先整批寫入全市場的價格與估值，
+# 檔案涵蓋的股票只在 ROE / 產業過期時才逐檔抓 Yahoo，寫回時也不蓋掉官方欄位。
+# 有 health (sources.SourceHealth) 時 Yahoo 經過健康檢查呼叫，暫停使用期間預抓跟著停下。
+class Prefetcher:
+    def __init__(self, cache, controller, interval=1.0, idle_sleep=300.0, feed=None, health=None):
+        self.cache = cache
+        self.controller = controller
+        self.feed = feed
+        self.health = health
+        self.bulk_day = None            # 已寫入快取的官方檔日期 (檔案裡的日期)
+        self._bulk_checked = 0.0
+        self._covered = {}              # {yf_ticker: 官方檔提供的欄位}
+        self.interval = interval        # 每檔之間至少間隔幾秒，留速率額度給使用者的掃描
+        self.idle_sleep = idle_sleep    # 全部都新鮮時休息多久再檢查
+
+        self.current = None
+        self.fetched = 0
+        self.failed = 0
+        self.last_error = None
+        self.pending = 0
+
+        self._universe = []
+        self._priority = []             # 新上市的股票插隊優先抓
+        self._version = 0
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def set_universe(self, tickers):
+        tickers = list(tickers)
+        with self._lock:
+            if tickers == self._universe:
+                return
+            self._universe = tickers
+            self._version += 1
+        self._wake.set()
+
+    # 清單異動時呼叫：新代號排到最前面，下市的從巡檢名單拿掉
+    def apply_change(self, new, dropped):
+        dropped = set(dropped)
+        with self._lock:
+            self._priority = [t for t in self._priority if t not in dropped] + [t for t in new if t not in self._priority]
+            self._universe = [t for t in self._universe if t not in dropped] + \
+                             [t for t in new if t not in self._universe]
+            self._version += 1
+        self._wake.set()
+
+    def start(self):
+        self._running.set()
+        self._wake.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def pause(self):
+        self._running.clear()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _sleep(self, seconds):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    # 官方檔依檔案日期寫入，同一天的檔案只寫一次；下載失敗時保留前一天涵蓋的名單，下一輪再試
+    def _refresh_bulk(self):
+        self._bulk_checked = time.monotonic()
+        try:
+            day, infos, errors = self.feed.get()
+        except Exception as e:
+            self.last_error = f"官方批次檔: {e}"
+            return
+        if day is not None and day == self.bulk_day:
+            return
+        self.cache.put_many([(t, info, None) for t, info in infos.items()], OFFICIAL_FIELDS, OFFICIAL, partial=True)
+        self._covered = {t: tuple(info) for t, info in infos.items()}
+        if errors:
+            self.last_error = "官方批次檔: " + ", ".join(f"{m} {e}" for m, e in errors.items())
+        else:
+            self.bulk_day = day
+
+    # 官方檔還沒跟上最近交易日時，巡到一半也定期再問一次 (下載由 feed 自己節流)
+    def _bulk_lagging(self):
+        if self.feed is None or time.monotonic() - self._bulk_checked < RETRY_LAGGING:
+            return False
+        return self.bulk_day is None or self.bulk_day < trading_day()
+
+    # 官方檔涵蓋的只看 ROE / 產業，其餘看全部欄位
+    def _stale(self, tickers):
+        covered = [t for t in tickers if t in self._covered]
+        rest = [t for t in tickers if t not in self._covered]
+        return self.cache.stale(rest) + (self.cache.stale(covered, SLOW_FIELDS) if covered else [])
+
+    def _fetch(self, ticker):
+        if self.health is None:
+            return fetch_info(ticker, self.controller)
+        return self.health.call(YAHOO, fetch_info, ticker, self.controller)
+
+    def _run(self):
+        while True:
+            self._running.wait()
+            if self.feed is not None:
+                self._refresh_bulk()
+            with self._lock:
+                universe, version = list(self._universe), self._version
+                priority, self._priority = self._priority, []
+            stale = self._stale(universe)
+            if priority:
+                fresh = set(priority) - set(self._stale(priority))
+                stale = [t for t in priority if t not in fresh] + [t for t in stale if t not in priority]
+            self.pending = len(stale)
+            if not stale:
+                self.current = None
+                self._sleep(self.idle_sleep)
+                continue
+
+            for ticker in stale:
+                if not self._running.is_set() or version != self._version:
+                    break
+                if self._bulk_lagging():
+                    self._refresh_bulk()
+                if self.health is not None and not self.health.available(YAHOO):
+                    self.last_error = "Yahoo 暫停使用，等冷卻結束再繼續"
+                    self._sleep(self.health.cooldown)
+                    break
+                self.current = ticker
+                try:
+                    info = self._fetch(ticker)
+                    self.cache.put(ticker, info, yahoo_fields(FIELDS, self._covered.get(ticker)))
+                    self.fetched += 1
+                except Exception as e:
+                    self.failed += 1
+                    self.last_error = f"{ticker}: {e}"
+                self.pending -= 1
+                time.sleep(self.interval)
+
+    def status(self):
+        return {
+            'running': self.running,
+            'current': self.current,
+            'pending': self.pending,
+            'fetched': self.fetched,
+            'failed': self.failed,
+            'last_error': self.last_error,
+            'bulk_day': self.bulk_day,
+        }
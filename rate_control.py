@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+OK = "ok"
+BLOCKED = "blocked"   # 429 或回傳資料缺價格 (疑似被鎖 IP)
+ERROR = "error"       # 其他連線錯誤 / 逾時
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    pass
+
+
+# 讓目前執行緒之後的 acquire() 在 stop 被設定時提早放棄 (scanner 的 worker 用，fetch 函式不必多帶參數)
+def bind_stop(stop):
+    _local.stop = stop
+
+
+# --- AIMD 速率控制器 ---
+# 回應正常時每次成功加一點速率 (Additive Increase)，
+# 遇到封鎖時速率砍半並暫停一段時間 (Multiplicative Decrease)。
+# 所有 worker 共用同一個控制器，acquire() 依目前速率排隊取得發送時間；
+# 排隊中被取消 (stop 被設定) 時把預約的時段還回去，後面的請求不必替它空等。
+class RateController:
+    def __init__(self, initial_rate=2.0, min_rate=0.2, max_rate=20.0,
+                 increase=0.1, decrease=0.5, cooldown=15.0, max_cooldown=300.0,
+                 latency_target=3.0):
+        self.rate = initial_rate          # 每秒請求數
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.latency_target = latency_target
+
+        self.latency = None               # 延遲的指數移動平均 (秒)
+        self.counts = {OK: 0, BLOCKED: 0, ERROR: 0}
+        self._streak = 0                  # 連續被封鎖次數，決定冷卻時間
+        self._next_slot = 0.0
+        self._backoff_until = 0.0
+        self._lock = threading.Lock()
+
+    # 回傳 (還要等幾秒, 佔用的間隔)
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._backoff_until)
+            step = 1.0 / self.rate
+            self._next_slot = slot + step
+        return slot - time.monotonic(), step
+
+    def _release(self, step):
+        with self._lock:
+            self._next_slot = max(time.monotonic(), self._next_slot - step)
+
+    def acquire(self, stop=None):
+        stop = stop or getattr(_local, 'stop', None)
+        if stop is not None and stop.is_set():
+            raise Cancelled("已取消")
+        delay, step = self._reserve()
+        if delay <= 0:
+            return
+        if stop is None:
+            time.sleep(delay)
+        elif stop.wait(delay):
+            self._release(step)
+            raise Cancelled("已取消")
+
+    # asyncio 版本：排隊時只讓出 event loop，不卡住其他請求；task 被取消時同樣歸還時段
+    async def acquire_async(self):
+        delay, step = self._reserve()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self._release(step)
+                raise
+
+    def record(self, outcome, latency=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+            if outcome == OK:
+                self._streak = 0
+                if self.latency is not None and self.latency > self.latency_target:
+                    # 延遲升高代表 Yahoo 開始吃緊，先小幅降速
+                    self.rate = max(self.min_rate, self.rate * 0.9)
+                else:
+                    self.rate = min(self.max_rate, self.rate + self.increase)
+            elif outcome == BLOCKED:
+                self._streak += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                pause = min(self.max_cooldown, self.cooldown * 2 ** (self._streak - 1))
+                self._backoff_until = max(self._backoff_until, time.monotonic() + pause)
+            else:
+                self.rate = max(self.min_rate, self.rate * 0.8)
+
+    def state(self):
+        with self._lock:
+            remaining = self._backoff_until - time.monotonic()
+            return {
+                'rate': self.rate,
+                'backoff': max(0.0, remaining),
+                'latency': self.latency,
+                **self.counts,
+            }
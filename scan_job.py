@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+
+from scanner import scan, DEFAULT_WORKERS
+from yahoo import fetch_info
+
+JOB_DIR = os.path.join('data', 'scan_job')
+
+
+class ScanStopped(Exception):
+    pass
+
+
+# --- 可續傳的全市場掃描任務 ---
+# 任務清單寫在 meta.json，每完成一檔就在 done.jsonl 追加一行並 flush，
+# 程序當掉或 Streamlit rerun 後都能從檢查點繼續，已完成的股票不會重抓。
+# 抓到的數據寫進基本面快取，檢查點只記錄「哪些做完了」。
+class ScanJob:
+    def __init__(self, cache, controller, job_dir=JOB_DIR, max_workers=DEFAULT_WORKERS):
+        self.cache = cache
+        self.controller = controller
+        self.job_dir = job_dir
+        self.max_workers = max_workers
+        os.makedirs(job_dir, exist_ok=True)
+        self.meta_path = os.path.join(job_dir, 'meta.json')
+        self.done_path = os.path.join(job_dir, 'done.jsonl')
+
+        self.tickers = []
+        self.done = set()
+        self.failed = {}
+        self.state = 'idle'          # idle / running / paused / done
+        self._run_started = None
+        self._run_done = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        self.tickers = meta['tickers']
+        if os.path.exists(self.done_path):
+            with open(self.done_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['t'])
+                    except (ValueError, KeyError):
+                        pass  # 當機時寫到一半的最後一行
+        # 上次執行到一半就中斷的任務視為暫停，等使用者按繼續
+        self.state = 'done' if meta['state'] == 'done' else 'paused'
+
+    def _save_meta(self):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'tickers': self.tickers, 'state': self.state}, f)
+        os.replace(tmp, self.meta_path)
+
+    def start_new(self, tickers):
+        self.pause()
+        with self._lock:
+            self.tickers = list(tickers)
+            self.done = set()
+            self.failed = {}
+            # 清空而不是刪檔：剛暫停的舊執行緒可能還開著這個檔 (之後不會再寫)
+            open(self.done_path, 'w').close()
+        self.resume()
+
+    # 清單異動：新上市的補進任務、下市的移除，已完成的任務按「繼續」就只抓新股票
+    def apply_change(self, new, dropped):
+        dropped = set(dropped)
+        with self._lock:
+            if not self.tickers:
+                return
+            self.tickers = [t for t in self.tickers if t not in dropped] + [t for t in new if t not in self.tickers]
+            self.done -= dropped
+            if self.state == 'done' and len(self.done) < len(self.tickers):
+                self.state = 'paused'
+            self._save_meta()
+
+    # 每一輪用新的停止旗標；剛暫停、還在等速率控制器的舊執行緒自己收尾，不會寫進新一輪的進度
+    def resume(self):
+        if self.running or not self.tickers:
+            return
+        self._stop = threading.Event()
+        self.failed = {}   # 上一輪失敗的股票這一輪重試
+        self.state = 'running'
+        self._save_meta()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="scan-job", daemon=True)
+        self._thread.start()
+
+    # 不等執行緒結束 (速率控制器退避時可能要等好幾分鐘)，只設旗標並取消還沒開始的工作，頁面不會卡住
+    def pause(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self.state = 'paused'
+        self._save_meta()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def _fetch(self, ticker, stop):
+        if stop.is_set():
+            raise ScanStopped(ticker)
+        # 暫停時還在途的股票沒寫進檢查點，但數據已進快取，續跑時直接用快取
+        info = self.cache.get(ticker)
+        if info is not None:
+            return info
+        info = fetch_info(ticker, self.controller)
+        self.cache.put(ticker, info)
+        return info
+
+    def _run(self, stop):
+        remaining = [t for t in self.tickers if t not in self.done]
+        self._run_started = time.monotonic()
+        self._run_done = 0
+        with open(self.done_path, 'a', encoding='utf-8') as log:
+            stream = scan(remaining, lambda t: self._fetch(t, stop), self.max_workers, stop)
+            for ticker, info, err in stream:
+                with self._lock:
+                    if stop.is_set():
+                        break
+                    if err is None:
+                        self.done.add(ticker)
+                        log.write(json.dumps({'t': ticker, 'at': time.time()}) + '\n')
+                        log.flush()
+                    else:
+                        self.failed[ticker] = str(err)
+                    self._run_done += 1
+            stream.close()   # 取消尚未開始的工作
+        # 暫停時狀態已由 pause() 寫好
+        if not stop.is_set():
+            self.state = 'done'
+            self._save_meta()
+
+    def status(self):
+        with self._lock:
+            total = len(self.tickers)
+            done = len(self.done)
+            processed = self._run_done
+        remaining = total - done
+        rate = eta = None
+        if self.running and processed and self._run_started:
+            rate = processed / (time.monotonic() - self._run_started)
+            eta = remaining / rate if rate else None
+        return {
+            'state': 'running' if self.running else self.state,
+            'total': total,
+            'done': done,
+            'failed': len(self.failed),
+            'rate': rate,        # 本輪實測吞吐量 (檔/秒)
+            'eta': eta,          # 預估剩餘秒數
+        }
@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from rate_control import Cancelled, bind_stop
+
+DEFAULT_WORKERS = 8
+MAX_WORKERS = 32
+
+
+def _call(fn, item, stop):
+    if stop.is_set():
+        raise Cancelled("已取消")
+    bind_stop(stop)
+    try:
+        return fn(item)
+    finally:
+        bind_stop(None)
+
+
+# --- 並行掃描引擎 ---
+# 以固定大小的執行緒池執行 fn(item)，任何一檔完成就立即回傳，
+# 呼叫端 (Streamlit 主執行緒) 可以邊收結果邊更新進度條與表格。
+# 呼叫端中途停止時設定 stop：在速率控制器排隊的 worker 立刻放棄，關閉也不等還在跑的工作。
+def scan(items, fn, max_workers=DEFAULT_WORKERS, stop=None):
+    items = list(items)
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS))
+    if not items:
+        return
+
+    stop = stop or threading.Event()
+    pending = {}
+    it = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+
+    # 最多只排入 2 倍 worker 數的工作，避免一次把整個市場丟進佇列
+    def fill():
+        while len(pending) < max_workers * 2:
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            pending[pool.submit(_call, fn, item, stop)] = item
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = pending.pop(fut)
+                try:
+                    yield item, fut.result(), None
+                except Exception as e:
+                    yield item, None, e
+            fill()
+    finally:
+        # 呼叫端中途停止 (例如 Streamlit rerun) 時，取消尚未開始的工作，不等在途的工作結束
+        if pending:
+            stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,307 @@
+import numpy as np
+import pandas as pd
+
+# 快照欄位：篩選條件的鍵 (pe / pb / yield / roe) 直接對應同名欄位，殖利率與 ROE 以 % 表示；
+# source 為各指標的來源 (sources.source_label)
+SNAPSHOT_COLUMNS = ['code', 'name', 'yf_ticker', 'price', 'pe', 'pb', 'yield', 'roe', 'industry', 'source']
+
+DISPLAY_COLUMNS = {
+    'code': '代號',
+    'name': '名稱',
+    'price': '股價',
+    'pe': '本益比',
+    'pb': '股價淨值比',
+    'yield': '殖利率(%)',
+    'roe': 'ROE(%)',
+    'industry': '產業',
+    'score': '評分',
+    'high_52w': '52週高',
+    'low_52w': '52週低',
+    'range_pos': '52週位置(%)',
+    'ma20': 'MA20',
+    'ma60': 'MA60',
+    'ma240': 'MA240',
+    'vs_ma60': '距MA60(%)',
+    'from_high': '距52週高(%)',
+    'max_drawdown': '一年最大回撤(%)',
+    'source': '數據來源',
+    'updated': '資料時間',
+}
+
+# 上限型條件用 <，下限型用 >=，與原本 analyze_stock 的判斷一致
+MAX_CRITERIA = ('pe', 'pb')
+MIN_CRITERIA = ('yield', 'roe')
+
+SPARSE_RATIO = 8     # 最嚴的條件篩到剩 1/8 以下才走候選集交集
+
+
+# 把 Yahoo .info (或批次報價) 轉成快照的一列原始數據，缺值一律 NaN
+def info_to_metrics(info):
+    def num(key):
+        value = info.get(key)
+        return float(value) if isinstance(value, (int, float)) else np.nan
+
+    pe = num('trailingPE')
+    if np.isnan(pe):
+        pe = num('forwardPE')  # 嘗試用預估本益比替補
+    price = num('currentPrice')
+    if np.isnan(price):
+        price = num('regularMarketPrice')
+    return {
+        'price': price,
+        'pe': pe,
+        'pb': num('priceToBook'),
+        'yield': num('dividendYield') * 100,
+        'roe': num('returnOnEquity') * 100,
+        'industry': info.get('industry') or None,
+    }
+
+
+def build_snapshot(records):
+    df = pd.DataFrame.from_records(records)
+    return df.reindex(columns=SNAPSHOT_COLUMNS)
+
+
+# --- 向量化篩選 ---
+# 四個條件各是一個布林遮罩，整個快照一次算完。
+# NaN 比較結果為 False，所以缺值的股票不會通過；唯一例外是下限設為 0 時，
+# 原本缺值補 0 會通過，這裡維持相同行為。
+def screen_mask(snapshot, criteria):
+    mask = pd.Series(True, index=snapshot.index)
+    for key in MAX_CRITERIA:
+        mask &= snapshot[key].lt(criteria[key])
+    for key in MIN_CRITERIA:
+        col = snapshot[key]
+        mask &= col.ge(criteria[key]) | (col.isna() & (criteria[key] <= 0))
+    return mask
+
+
+# 同 screen_mask 的規則套在 numpy 陣列上 (任意形狀)
+def passes(key, values, threshold):
+    if key in MAX_CRITERIA:
+        return values < threshold
+    keep = values >= threshold
+    if threshold <= 0:
+        keep |= np.isnan(values)
+    return keep
+
+
+# --- 排序索引 ---
+# 四個條件都是單邊範圍 (pe / pb 小於上限、殖利率 / ROE 不低於下限)。
+# 每個指標預先 argsort 一次，門檻用二分搜尋就能定出符合的區段，
+# 計數是 O(log n)；交集從符合檔數最少的條件開始，只對這一小群候選比對其他條件。
+# 快照不變就重複使用，拖動滑桿時不必重掃整張表。
+class SnapshotIndex:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._values = {}
+        self._order = {}
+        self._sorted = {}
+        self._nan = {}
+        for key in MAX_CRITERIA + MIN_CRITERIA:
+            values = snapshot[key].to_numpy(dtype=float, na_value=np.nan)
+            valid = np.flatnonzero(~np.isnan(values))
+            order = valid[np.argsort(values[valid], kind='stable')]
+            self._values[key] = values
+            self._order[key] = order
+            self._sorted[key] = values[order]
+            self._nan[key] = np.flatnonzero(np.isnan(values))
+        self._pct = {}
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    # 符合條件的區段在排序後陣列中的 [lo, hi)
+    def _bounds(self, key, threshold):
+        cut = np.searchsorted(self._sorted[key], threshold, side='left')
+        return (0, cut) if key in MAX_CRITERIA else (cut, len(self._sorted[key]))
+
+    # 缺值只有在下限 <= 0 時算通過，與 screen_mask 一致
+    def _nan_passes(self, key, threshold):
+        return key in MIN_CRITERIA and threshold <= 0
+
+    def count(self, key, threshold):
+        lo, hi = self._bounds(key, threshold)
+        return hi - lo + (len(self._nan[key]) if self._nan_passes(key, threshold) else 0)
+
+    def rows(self, key, threshold):
+        lo, hi = self._bounds(key, threshold)
+        rows = self._order[key][lo:hi]
+        return np.concatenate([rows, self._nan[key]]) if self._nan_passes(key, threshold) else rows
+
+    # 全部條件都符合的列位置 (依快照原順序)
+    def positions(self, criteria):
+        keys = sorted(MAX_CRITERIA + MIN_CRITERIA, key=lambda k: self.count(k, criteria[k]))
+        if self.count(keys[0], criteria[keys[0]]) > len(self) // SPARSE_RATIO:
+            # 條件都很寬時候選集太大，隨機取值反而比整欄比對慢，直接逐欄算遮罩
+            keep = np.ones(len(self), dtype=bool)
+            for key in keys:
+                keep &= passes(key, self._values[key], criteria[key])
+            return np.flatnonzero(keep)
+        rows = self.rows(keys[0], criteria[keys[0]])
+        for key in keys[1:]:
+            if not len(rows):
+                break
+            rows = rows[passes(key, self._values[key][rows], criteria[key])]
+        return np.sort(rows)
+
+    def select(self, criteria):
+        return self.snapshot.iloc[self.positions(criteria)]
+
+    # --- 綜合評分 ---
+    # 每個指標在整個快照中的百分位 (0~1，越大越好；同值取平均名次，缺值為 0)。
+    # 直接用索引裡已排好的值做 searchsorted，每個指標只算一次，之後換權重只是加權相加。
+    def percentile(self, key):
+        if key not in self._pct:
+            ordered = self._sorted[key]
+            pct = np.zeros(len(self))
+            n = len(ordered)
+            if n:
+                # 查詢值本身已排序，searchsorted 幾乎是線性掃過
+                rank = (np.searchsorted(ordered, ordered, 'left') + np.searchsorted(ordered, ordered, 'right') - 1) / 2
+                # 本益比、淨值比越低越好，名次反過來
+                pct[self._order[key]] = (n - 1 - rank if key in MAX_CRITERIA else rank) / max(n - 1, 1)
+            self._pct[key] = pct
+        return self._pct[key]
+
+    # 加權平均的百分位分數 (0~100)
+    def scores(self, weights):
+        total = sum(weights.values())
+        score = np.zeros(len(self))
+        for key, w in weights.items():
+            if w:
+                score += w * self.percentile(key)
+        return score * 100 / total if total else score
+
+    # 分數最高的前 n 檔：argpartition 只做部分排序，再把這 n 檔排好；positions 可限定在篩選結果內
+    def top(self, weights, n, positions=None):
+        score = self.scores(weights)
+        rows = np.arange(len(self)) if positions is None else np.asarray(positions)
+        if n < len(rows):
+            rows = rows[np.argpartition(-score[rows], n - 1)[:n]]
+        rows = rows[np.argsort(-score[rows], kind='stable')]
+        return self.snapshot.iloc[rows].assign(score=score[rows])
+
+
+# --- 產業相對指標 ---
+# 同一個本益比對銀行和半導體意義完全不同，所以另外算每檔在同產業內的百分位 (0~100，越大越好)。
+# 每個產業每個指標保留一份排序好的數值，建立時 groupby 一次；
+# 之後單檔更新只重排它所屬的產業、只重算該產業的列，不必整張表重來。
+# 調整門檻時只剩一次向量化比較。
+class IndustryStats:
+    KEYS = MAX_CRITERIA + MIN_CRITERIA
+
+    def __init__(self, snapshot):
+        self._values = {key: snapshot[key].to_numpy(dtype=float, na_value=np.nan).copy() for key in self.KEYS}
+        # 沒有產業的股票不分組，相對百分位固定為 0
+        self._industry = snapshot['industry'].astype(object).where(snapshot['industry'].notna(), None).to_numpy().copy()
+        self._rows = {}
+        for industry, rows in pd.Series(np.arange(len(snapshot))).groupby(self._industry, sort=False):
+            self._rows[industry] = rows.to_numpy()
+        self._sorted = {key: {} for key in self.KEYS}
+        self._pct = {key: np.zeros(len(snapshot)) for key in self.KEYS}
+        for industry in self._rows:
+            self._rebuild(industry)
+
+    def _rebuild(self, industry):
+        rows = self._rows[industry]
+        for key in self.KEYS:
+            values = self._values[key][rows]
+            ordered = np.sort(values[~np.isnan(values)])
+            self._sorted[key][industry] = ordered
+            self._rank_rows(key, industry, rows, values)
+
+    # 同產業內的平均名次換成百分位；缺值和只有一檔的產業為 0 (無從比較)
+    def _rank_rows(self, key, industry, rows, values):
+        ordered = self._sorted[key][industry]
+        n = len(ordered)
+        pct = np.zeros(len(rows))
+        valid = ~np.isnan(values)
+        if n > 1:
+            v = values[valid]
+            rank = (np.searchsorted(ordered, v, 'left') + np.searchsorted(ordered, v, 'right') - 1) / 2
+            pct[valid] = (n - 1 - rank if key in MAX_CRITERIA else rank) / (n - 1) * 100
+        self._pct[key][rows] = pct
+
+    # 單檔數據更新：只動它原本與新的產業
+    def update(self, position, metrics):
+        old_industry = self._industry[position]
+        new_industry = metrics.get('industry') or None
+        for key in self.KEYS:
+            self._values[key][position] = metrics[key]
+        if new_industry != old_industry:
+            self._industry[position] = new_industry
+            self._pct_reset(position)
+            if old_industry is not None:
+                self._rows[old_industry] = self._rows[old_industry][self._rows[old_industry] != position]
+            if new_industry is not None:
+                self._rows[new_industry] = np.append(self._rows.get(new_industry, np.array([], dtype=int)), position)
+            affected = [old_industry, new_industry]
+        else:
+            affected = [old_industry]
+        for industry in affected:
+            if industry is not None:
+                self._rebuild(industry)
+
+    def _pct_reset(self, position):
+        for key in self.KEYS:
+            self._pct[key][position] = 0.0
+
+    def percentile(self, key):
+        return self._pct[key]
+
+    # rel_criteria: {指標: 至少優於同業幾 %}，0 代表不限
+    def mask(self, rel_criteria):
+        keep = np.ones(len(self._industry), dtype=bool)
+        for key, threshold in rel_criteria.items():
+            if threshold > 0:
+                keep &= self._pct[key] >= threshold
+        return keep
+
+    # 各產業檔數與中位數
+    def summary(self):
+        out = []
+        for industry, rows in self._rows.items():
+            if not len(rows):
+                continue
+            medians = {key: np.median(ordered) if len(ordered) else np.nan
+                       for key, ordered in ((k, self._sorted[k][industry]) for k in self.KEYS)}
+            out.append({'industry': industry, 'count': len(rows), **medians})
+        return pd.DataFrame(out, columns=['industry', 'count', *self.KEYS]).sort_values('count', ascending=False)
+
+
+# 每檔資料的抓取時間 (快取的 fetched_at，epoch 秒) 轉成台北時間欄位
+def attach_freshness(snapshot, fetched_at):
+    ts = pd.to_datetime(snapshot['yf_ticker'].map(fetched_at), unit='s', utc=True)
+    return snapshot.assign(updated=ts.dt.tz_convert('Asia/Taipei').dt.tz_localize(None).dt.floor('min'))
+
+
+# --- 用新股價重算比率 ---
+# 每股數值 (EPS / 每股淨值 / 每股股利) 一季才變一次，股價變了只要整欄相除就能得到新的本益比、淨值比、殖利率。
+# prices 為 {yf_ticker: 價格}，per_share 為 FundamentalsCache.latest_per_share 的結果；
+# 沒有新價格或沒有每股數值的股票維持原值。回傳 (新快照, 有重算的列位置)
+def reprice(snapshot, per_share, prices):
+    tickers = snapshot['yf_ticker']
+    price = tickers.map(prices).to_numpy(dtype=float)
+    ps = per_share.reindex(tickers)
+    eps, bvps, dps = (ps[c].to_numpy(dtype=float) for c in ('eps', 'bvps', 'dps'))
+    known = ~np.isnan(price) & ps[['eps', 'bvps', 'dps']].notna().any(axis=1).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new = {
+            'price': price,
+            'pe': np.where(eps > 0, price / eps, np.nan),
+            'pb': np.where(bvps > 0, price / bvps, np.nan),
+            'yield': dps / price * 100,
+        }
+    out = snapshot.copy()
+    for key, values in new.items():
+        out[key] = np.where(known, values, out[key].to_numpy(dtype=float))
+    return out, np.flatnonzero(known)
+
+
+def format_results(df):
+    out = df[[c for c in DISPLAY_COLUMNS if c in df]].rename(columns=DISPLAY_COLUMNS)
+    digits = {'本益比': 2, '股價淨值比': 2, '殖利率(%)': 2, 'ROE(%)': 2, '評分': 1,
+              '52週高': 2, '52週低': 2, '52週位置(%)': 1, 'MA20': 2, 'MA60': 2, 'MA240': 2,
+              '距MA60(%)': 1, '距52週高(%)': 1, '一年最大回撤(%)': 1}
+    return out.round(digits).reset_index(drop=True)
@@ -0,0 +1,150 @@
+import threading
+import time
+
+OFFICIAL = 'official'     # 證交所 / 櫃買中心批次檔
+YAHOO = 'yahoo'
+CACHE = 'cache'           # 快取裡的值 (可能已過期)，其他來源都拿不到時的最後手段
+BUNDLE = 'bundle'         # 內建離線快照 (bundle.py) 補進快取的值
+SOURCE_LABELS = {OFFICIAL: '官方', YAHOO: 'Yahoo', CACHE: '快取', BUNDLE: '內建快照'}
+
+# 各欄位依序嘗試的來源；官方檔沒有 ROE、產業與預估本益比
+FIELD_PRIORITY = {
+    'currentPrice': (OFFICIAL, YAHOO, CACHE),
+    'trailingPE': (OFFICIAL, YAHOO, CACHE),
+    'forwardPE': (YAHOO, CACHE),
+    'priceToBook': (OFFICIAL, YAHOO, CACHE),
+    'dividendYield': (OFFICIAL, YAHOO, CACHE),
+    'returnOnEquity': (YAHOO, CACHE),
+    'industry': (YAHOO, CACHE),
+}
+# Yahoo 的價格可能放在 regularMarketPrice (批次報價)
+ALIASES = {'currentPrice': ('currentPrice', 'regularMarketPrice')}
+# info 欄位對應到快照的指標，顯示來源用
+METRIC_FIELDS = {
+    'price': ('currentPrice',),
+    'pe': ('trailingPE', 'forwardPE'),
+    'pb': ('priceToBook',),
+    'yield': ('dividendYield',),
+    'roe': ('returnOnEquity',),
+    'industry': ('industry',),
+}
+METRIC_LABELS = {'price': '價', 'pe': 'PE', 'pb': 'PB', 'yield': '殖利率', 'roe': 'ROE', 'industry': '產業'}
+
+
+class SourceUnavailable(Exception):
+    pass
+
+
+# --- 來源健康狀態 ---
+# 每個來源記錄成功 / 失敗與延遲 (指數移動平均)。連續失敗 threshold 次就暫停使用 (down)，
+# cooldown 秒後放一次請求試探，成功就恢復；平均延遲超過 slow 秒的來源排到其他來源後面。
+class SourceHealth:
+    def __init__(self, threshold=3, cooldown=60.0, slow=5.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.slow = slow
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    def _entry(self, source):
+        return self._sources.setdefault(source, {'ok': 0, 'errors': 0, 'streak': 0, 'latency': None,
+                                                 'down_until': 0.0, 'last_error': None})
+
+    def record(self, source, ok, latency=None, error=None):
+        with self._lock:
+            e = self._entry(source)
+            if latency is not None:
+                e['latency'] = latency if e['latency'] is None else 0.8 * e['latency'] + 0.2 * latency
+            if ok:
+                e['ok'] += 1
+                e['streak'] = 0
+                e['down_until'] = 0.0
+            else:
+                e['errors'] += 1
+                e['streak'] += 1
+                e['last_error'] = error
+                if e['streak'] >= self.threshold:
+                    e['down_until'] = time.monotonic() + self.cooldown
+
+    def state(self, source):
+        with self._lock:
+            e = self._entry(source)
+            if e['down_until'] > time.monotonic():
+                return 'down'
+            if e['latency'] is not None and e['latency'] > self.slow:
+                return 'slow'
+            return 'ok'
+
+    def available(self, source):
+        return self.state(source) != 'down'
+
+    # 經過健康檢查呼叫：暫停使用時直接丟 SourceUnavailable，否則記錄成敗與延遲
+    def call(self, source, fn, *args):
+        if not self.available(source):
+            raise SourceUnavailable(f"{SOURCE_LABELS.get(source, source)} 暫停使用 (連續失敗，稍後自動重試)")
+        t0 = time.monotonic()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.record(source, False, time.monotonic() - t0, str(e))
+            raise
+        self.record(source, True, time.monotonic() - t0)
+        return result
+
+    # 依健康狀態調整順序：太慢的排後面，暫停中的排最後 (暫停前已拿到的數值仍可用)
+    def order(self, sources):
+        states = {s: self.state(s) for s in sources}
+        return [s for state in ('ok', 'slow', 'down') for s in sources if states[s] == state]
+
+    def status(self):
+        with self._lock:
+            names = list(self._sources)
+        return {s: {**{k: v for k, v in self._sources[s].items() if k != 'down_until'}, 'state': self.state(s)}
+                for s in names}
+
+
+def _value(info, field):
+    for key in ALIASES.get(field, (field,)):
+        value = info.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+# --- 多來源合併 ---
+# candidates 為 {來源: info}，每個欄位依 FIELD_PRIORITY (再依健康狀態調整) 取第一個有值的來源。
+# 快取 (CACHE) 不受健康狀態影響。回傳 (info, {欄位: 來源})；沒有任何欄位時 info 為 None
+def fuse(candidates, health=None):
+    info, origin = {}, {}
+    for field, priority in FIELD_PRIORITY.items():
+        order = [s for s in priority if s in candidates and candidates[s]]
+        if health is not None:
+            order = health.order([s for s in order if s != CACHE]) + [s for s in order if s == CACHE]
+        for source in order:
+            value = _value(candidates[source], field)
+            if value is not None:
+                info[field] = value
+                origin[field] = source
+                break
+    return (info or None), origin
+
+
+# 抓完 Yahoo 要寫回快取的欄位：官方檔已經提供的欄位 (優先於 Yahoo) 不蓋掉，
+# 否則快取命中時讀回的會是 Yahoo 的數值與來源
+def yahoo_fields(fields, official_info=None):
+    return tuple(f for f in fields if not official_info or f not in official_info)
+
+
+# 取自快取 (CACHE) 的欄位改標成當初寫進快取的來源 (FundamentalsCache.sources_many)
+def resolve_cached(origin, cached_sources):
+    return {f: cached_sources.get(f, s) if s == CACHE else s for f, s in origin.items()}
+
+
+# 快照上每個指標實際用到的來源，整理成一欄文字：「官方: 價 PE PB 殖利率 · Yahoo: ROE 產業」
+def source_label(origin):
+    groups = {}
+    for metric, fields in METRIC_FIELDS.items():
+        source = next((origin[f] for f in fields if f in origin), None)
+        if source is not None:
+            groups.setdefault(source, []).append(METRIC_LABELS[metric])
+    return ' · '.join(f"{SOURCE_LABELS.get(s, s)}: {' '.join(m)}" for s, m in groups.items())
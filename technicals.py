@@ -0,0 +1,93 @@
+import os
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+TRADING_YEAR = 252              # 52 週約 252 個交易日
+MA_WINDOWS = (20, 60, 240)
+TECH_COLUMNS = ['high_52w', 'low_52w', 'range_pos', 'ma20', 'ma60', 'ma240', 'vs_ma60', 'from_high', 'max_drawdown']
+
+
+# --- 技術面指標 (向量化) ---
+# close 為日期 x 股票的收盤價寬表，所有股票一起算：
+# 52 週高低點與目前位置、均線、距 52 週高點跌幅、一年內最大回撤 (%)。
+# 停牌日沿用前一天收盤；資料不足一個視窗的均線為 NaN。
+def compute_technicals(close):
+    close = close.ffill()
+    values = close.to_numpy(dtype=float)
+    window = values[-TRADING_YEAR:]
+    last = values[-1] if len(values) else np.full(values.shape[1], np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # 整欄都是 NaN 的股票
+        high = np.nanmax(window, axis=0)
+        low = np.nanmin(window, axis=0)
+        out = {
+            'high_52w': high,
+            'low_52w': low,
+            'range_pos': (last - low) / (high - low) * 100,
+        }
+        for n in MA_WINDOWS:
+            recent = values[-n:]
+            enough = (~np.isnan(recent)).sum(axis=0) >= n
+            out[f'ma{n}'] = np.where(enough, np.nanmean(recent, axis=0), np.nan)
+        out['vs_ma60'] = (last / out['ma60'] - 1) * 100
+        out['from_high'] = (last / high - 1) * 100
+        # 逐日的歷史高點 (fmax 會略過 NaN)，跟當天收盤比出回撤，取一年內最深的一次
+        running_max = np.fmax.accumulate(window, axis=0)
+        out['max_drawdown'] = np.nanmin(window / running_max - 1, axis=0) * 100
+
+    return pd.DataFrame(out, index=close.columns)[TECH_COLUMNS]
+
+
+# --- 每個交易日一份的計算結果 ---
+# 以歷史資料的最新交易日為鍵存成 technicals/<日期>.parquet，換日後自動重算。
+# 每列記下算的時候該股票歷史資料的最後一天 (as_of)；個別股票之後才補下載到更新的資料時
+# (例如全市場最新日不變、但這檔原本落後)，as_of 對不上就只重算這幾檔。完全不碰網路。
+class TechnicalsCache:
+    def __init__(self, history):
+        self.history = history
+        self.cache_dir = os.path.join(history.root, 'technicals')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._day = None
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def _path(self, day):
+        return os.path.join(self.cache_dir, f'{day}.parquet')
+
+    def get(self, tickers):
+        day = self.history.status()['last']
+        tickers = list(tickers)
+        if day is None:
+            return pd.DataFrame(columns=TECH_COLUMNS)
+        with self._lock:
+            return self._get(day, tickers)
+
+    def _get(self, day, tickers):
+        if self._day != day:
+            path = self._path(day)
+            self._frame = pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame(columns=TECH_COLUMNS, dtype=float)
+            if 'as_of' not in self._frame:
+                self._frame['as_of'] = pd.Series(dtype=object)
+            self._day = day
+            for name in os.listdir(self.cache_dir):   # 前幾天的結果用不到了
+                if name != os.path.basename(path):
+                    os.remove(os.path.join(self.cache_dir, name))
+        last = {t: self.history.last_date(t) for t in tickers}
+        known = self._frame['as_of']
+        stale = [t for t in tickers if last[t] and (t not in known.index or known[t] != last[t])]
+        if stale:
+            start = pd.Timestamp(day) - pd.Timedelta(days=400)   # 240 日均線與 52 週所需的區間
+            close = self.history.load_many(stale, 'Close', start.strftime('%Y-%m-%d'))
+            # 期間內沒有資料的股票也記一列 NaN，資料沒更新前不再重讀
+            computed = compute_technicals(close) if not close.empty else pd.DataFrame(columns=TECH_COLUMNS, dtype=float)
+            computed = computed.reindex(stale)
+            computed['as_of'] = [last[t] for t in stale]
+            self._frame = pd.concat([self._frame.drop(stale, errors='ignore'), computed])
+            tmp = self._path(day) + '.tmp'
+            self._frame.to_parquet(tmp)
+            os.replace(tmp, self._path(day))
+        return self._frame.reindex([t for t in tickers if t in self._frame.index])[TECH_COLUMNS]
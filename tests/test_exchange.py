@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+import exchange as exchange_module
+from cache import FundamentalsCache
+from exchange import OFFICIAL_FIELDS, DailyPrices, OfficialFeed, fetch_prices, fetch_valuations, trading_day
+from sources import OFFICIAL, YAHOO
+from tools.fake_exchange import FakeExchange
+
+NOW = '2026-10-16 15:00'     # 週五收盤後，交易日就是當天 (錄下來的檔案也是這天)
+LAGGING = '2026-10-19 15:00'  # 下週一收盤後
+
+
+@pytest.fixture
+def exchange():
+    servers = []
+
+    def start(**kwargs):
+        fake = FakeExchange(**kwargs)
+        servers.append(fake)
+        return fake, fake.start_in_thread()
+
+    yield start
+    for fake in servers:
+        fake.stop()
+
+
+def test_fetch_valuations(exchange):
+    _, base = exchange()
+    infos, errors, day = fetch_valuations(twse_base=base, tpex_base=base)
+    assert errors == {}
+    assert day == '2026-10-16'          # 上市估值檔沒有日期欄，取上櫃檔的
+    assert infos['1101.TW'] == {'trailingPE': 15.39, 'priceToBook': 4.77, 'dividendYield': pytest.approx(0.0121)}
+    assert infos['3293.TWO']['trailingPE'] == 21.23
+    # 虧損的本益比 (N/A) 為 None，6 碼的 ETF 不收
+    assert infos['3105.TWO']['trailingPE'] is None
+    assert '006201.TWO' not in infos
+
+
+def test_fetch_prices(exchange):
+    _, base = exchange()
+    prices, errors = fetch_prices(twse_base=base, tpex_base=base)
+    assert errors == {}
+    assert prices.loc['1101', 'close'] == 551.07
+    assert prices.loc['1101', 'yf_ticker'] == '1101.TW'
+    assert prices.loc['3293', 'yf_ticker'] == '3293.TWO'
+    assert prices.loc['3293', 'volume'] == 5103708          # 千分位逗號
+    assert prices['close'].isna().loc['3105']               # 沒有成交 ("---")
+    assert '006201' not in prices.index
+
+
+def test_one_market_failing_keeps_the_other(exchange):
+    _, base = exchange(fail=['STOCK_DAY_ALL'])
+    prices, errors = fetch_prices(twse_base=base, tpex_base=base)
+    assert set(errors) == {'twse'}
+    assert set(prices['yf_ticker'].str.rsplit('.', n=1).str[1]) == {'TWO'}
+
+
+def test_daily_prices_downloaded_once_per_trading_day(exchange, tmp_path):
+    fake, base = exchange()
+    prices, errors = DailyPrices(tmp_path, twse_base=base, tpex_base=base).get(NOW)
+    assert errors == {}
+    assert os.path.exists(tmp_path / f'prices-{trading_day(NOW)}.parquet')
+    requests = fake.requests
+    # 另一個實例 (例如重啟後) 直接讀檔，不再下載
+    again, _ = DailyPrices(tmp_path, twse_base=base, tpex_base=base).get(NOW)
+    assert fake.requests == requests
+    assert again['close'].equals(prices['close'])
+
+
+def test_partial_download_is_not_persisted(exchange, tmp_path):
+    fake, base = exchange(fail=['tpex_mainboard_daily_close_quotes'])
+    daily = DailyPrices(tmp_path, twse_base=base, tpex_base=base)
+    prices, errors = daily.get(NOW)
+    assert set(errors) == {'tpex'} and len(prices)
+    assert os.listdir(tmp_path) == []
+    fake.fail.clear()
+    _, errors = daily.get(NOW)
+    assert errors == {}
+    assert os.listdir(tmp_path) == [f'prices-{trading_day(NOW)}.parquet']
+
+
+# 下週一收盤後官方還沒更新：檔案仍是週五的，不寫檔也不當成今天已下載，隔一段時間再重新下載
+def test_lagging_file_is_not_persisted(exchange, tmp_path, monkeypatch):
+    fake, base = exchange()
+    daily = DailyPrices(tmp_path, twse_base=base, tpex_base=base)
+    prices, errors = daily.get(LAGGING)
+    assert errors == {} and prices.loc['1101', 'date'] == '2026-10-16'
+    assert daily.status()['day'] == '2026-10-16'
+    assert os.listdir(tmp_path) == []
+    requests = fake.requests
+    daily.get(LAGGING)
+    assert fake.requests == requests
+    monkeypatch.setattr(exchange_module, 'RETRY_LAGGING', 0)
+    daily.get(LAGGING)
+    assert fake.requests > requests
+
+
+# 官方檔還是上週五的：回傳檔案日期而不是今天，估值檔也會隔一段時間重新下載
+def test_feed_reports_file_date_while_lagging(exchange, tmp_path, monkeypatch):
+    fake, base = exchange()
+    feed = OfficialFeed(DailyPrices(tmp_path, twse_base=base, tpex_base=base), twse_base=base, tpex_base=base)
+    day, infos, errors = feed.get(LAGGING)
+    assert (day, errors) == ('2026-10-16', {})
+    assert infos['2330.TW']['currentPrice'] == 363.57
+    requests = fake.requests
+    feed.get(LAGGING)
+    assert fake.requests == requests
+    monkeypatch.setattr(exchange_module, 'RETRY_LAGGING', 0)
+    feed.get(LAGGING)
+    assert fake.requests == requests + 4      # 估值、收盤檔各兩個市場
+
+
+# 沒有官方收盤價 (沒成交，或該市場收盤檔下載失敗) 時不能拿 null 蓋掉快取裡的價格
+def test_missing_close_keeps_cached_price(exchange, tmp_path):
+    _, base = exchange(fail=['STOCK_DAY_ALL'])
+    feed = OfficialFeed(DailyPrices(tmp_path / 'prices', twse_base=base, tpex_base=base), twse_base=base, tpex_base=base)
+    _, infos, errors = feed.get(NOW)
+    assert set(errors) == {'twse'}
+    assert 'currentPrice' not in infos['2330.TW']           # 上市收盤檔失敗
+    assert 'currentPrice' not in infos['3105.TWO']          # 當天沒有成交
+    assert infos['3293.TWO']['currentPrice'] == 15.56
+
+    cache = FundamentalsCache(str(tmp_path / 'cache.sqlite'))
+    for t in ('2330.TW', '3105.TWO'):
+        cache.put(t, {'currentPrice': 500.0, 'trailingPE': 20.0, 'returnOnEquity': 0.2, 'industry': 'x'})
+    cache.put_many([(t, info, None) for t, info in infos.items()], OFFICIAL_FIELDS, OFFICIAL, partial=True)
+
+    loaded = cache.load_many(['2330.TW', '3105.TWO', '3293.TWO'])
+    sources = cache.sources_many(['2330.TW', '3105.TWO', '3293.TWO'])
+    for t in ('2330.TW', '3105.TWO'):
+        assert loaded[t][0]['currentPrice'] == 500.0
+        assert sources[t]['currentPrice'] == YAHOO
+        assert sources[t]['priceToBook'] == OFFICIAL
+    assert loaded['3293.TWO'][0]['currentPrice'] == 15.56
+    assert sources['3293.TWO']['currentPrice'] == OFFICIAL
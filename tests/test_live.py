@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from live import LivePoller, LiveScreen, channel, quote_price
+from screen import build_snapshot, reprice, screen_mask
+from tools.fake_mis import FakeMIS
+
+CRITERIA = {'pe': 12.0, 'pb': 1.5, 'yield': 4.0, 'roe': 0.0}
+
+
+@pytest.fixture
+def mis():
+    fake = FakeMIS(step=0)
+    base = fake.start_in_thread()
+    yield fake, base
+    fake.stop()
+
+
+def frame_prices(fake, i):
+    suffix = {'tse': '.TW', 'otc': '.TWO'}
+    return {r['c'] + suffix[r['ex']]: quote_price(r) for r in fake.frames[i]['msgArray']}
+
+
+# 以第一格的價格為底建快照：每股數值讓本益比、淨值比、殖利率都落在門檻附近，價格一動就可能進出篩選；
+# 最後一檔沒有每股數值，不能隨股價重算
+def make_screen(fake):
+    prices = frame_prices(fake, 0)
+    tickers = [t for t in prices if len(t.split('.')[0]) == 4]
+    per_share = pd.DataFrame({
+        'eps': [prices[t] / (11 + i % 3 * 0.5) for i, t in enumerate(tickers)],
+        'bvps': [prices[t] / 1.2 for t in tickers],
+        'dps': [prices[t] * 0.045 for t in tickers],
+        'roe': 15.0,
+    }, index=tickers)
+    per_share.iloc[-1] = np.nan
+    snapshot, _ = reprice(build_snapshot([{'yf_ticker': t, 'code': t.split('.')[0], 'name': t, 'price': prices[t],
+                                           'pe': 20.0, 'pb': 2.0, 'yield': 1.0, 'roe': 15.0} for t in tickers]),
+                          per_share, prices)
+    return LiveScreen(snapshot, per_share, CRITERIA), per_share
+
+
+def test_channel():
+    assert channel('2330.TW') == 'tse_2330.tw'
+    assert channel('6488.TWO') == 'otc_6488.tw'
+
+
+def test_quote_price_falls_back_to_bid_then_previous_close():
+    assert quote_price({'z': '101.5', 'b': '101.0_', 'y': '99'}) == 101.5
+    assert quote_price({'z': '-', 'b': '101.0_100.5_', 'y': '99'}) == 101.0
+    assert quote_price({'z': '-', 'b': '-', 'y': '99'}) == 99.0
+
+
+def test_poll_matches_full_recompute_and_reports_crossings(mis):
+    fake, base = mis
+    screen, per_share = make_screen(fake)
+    poller = LivePoller(screen, base=base)
+    prices = frame_prices(fake, 0)
+    passed = set(screen.snapshot.loc[screen.mask, 'yf_ticker'])
+    entries = exits = 0
+    for i in range(1, len(fake.frames)):
+        fake.advance()
+        seen = poller.events()[-1]['seq'] if poller.events() else 0
+        poller.poll()
+        prices.update(frame_prices(fake, i))
+        full, _ = reprice(screen.snapshot, per_share, prices)
+        expected = set(full.loc[screen_mask(full, CRITERIA), 'yf_ticker'])
+        assert set(poller.matches()['yf_ticker']) == expected
+
+        events = poller.events(seen)
+        assert {e['yf_ticker'] for e in events if e['kind'] == 'entry'} == expected - passed
+        assert {e['yf_ticker'] for e in events if e['kind'] == 'exit'} == passed - expected
+        entries += sum(e['kind'] == 'entry' for e in events)
+        exits += sum(e['kind'] == 'exit' for e in events)
+        passed = expected
+    assert entries and exits
+    assert poller.status()['polls'] == len(fake.frames) - 1
+
+
+def test_only_moved_rows_are_recomputed(mis):
+    fake, base = mis
+    screen, _ = make_screen(fake)
+    live = {t for t, ok in zip(screen.tickers, screen.live) if ok}
+    before = frame_prices(fake, 0)
+    # 同一格再套用一次，價格都沒變，什麼都不重算
+    assert len(screen.apply(before)[2]) == 0
+    # 錄到的每一格幾乎全部都有成交；只讓一半的股票換成下一格的價格，另一半維持不變
+    after = dict(before)
+    after.update(dict(list(frame_prices(fake, 1).items())[::2]))
+    pe = screen.values['pe'].copy()
+    _, _, changed = screen.apply(after)
+    moved = {t for t in live if after[t] != before[t]}
+    assert 0 < len(moved) < len(live)
+    assert {screen.tickers[r] for r in changed} == moved
+    untouched = [i for i, t in enumerate(screen.tickers) if t not in moved]
+    np.testing.assert_array_equal(screen.values['pe'][untouched], pe[untouched])
+    # 沒有每股數值的那檔價格照樣更新，比率維持快照上的值
+    last = len(screen.tickers) - 1
+    assert screen.values['price'][last] == after[screen.tickers[last]]
+    assert screen.values['pe'][last] == screen.snapshot['pe'].iat[last]
+
+
+def test_no_requests_outside_trading_hours(mis):
+    fake, base = mis
+    screen, _ = make_screen(fake)
+    poller = LivePoller(screen, interval=0.01, base=base, is_open=lambda: False)
+    poller.start()
+    try:
+        poller._stop.wait(0.2)
+        assert fake.requests == 0
+        assert poller.status()['market_open'] is False
+    finally:
+        poller.stop()
+
+
+def test_stops_when_page_stops_reading(mis):
+    fake, base = mis
+    screen, _ = make_screen(fake)
+    poller = LivePoller(screen, interval=0.01, base=base, is_open=lambda: True, idle_timeout=0.1)
+    poller.start()
+    poller._thread.join(2)
+    assert not poller.running
+    requests = fake.requests
+    assert requests > 0
+    poller._stop.wait(0.1)
+    assert fake.requests == requests
@@ -0,0 +1,80 @@
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import bundle
+import exchange
+import prefetch
+import yahoo
+from cache import FundamentalsCache
+from sources import OFFICIAL, YAHOO
+from tools.fake_exchange import FakeExchange
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+UNIVERSE = {'2': [('2330', '台積電', '2330.TW'), ('1101', '台泥', '1101.TW')],
+            '4': [('3293', '鈊象', '3293.TWO')]}
+
+
+# Yahoo 的估值刻意跟官方檔不同，寫錯來源一眼就看得出來
+def fake_info(ticker, controller=None):
+    return {'currentPrice': 1.0, 'trailingPE': 99.0, 'forwardPE': 50.0, 'priceToBook': 9.0,
+            'dividendYield': 0.09, 'returnOnEquity': 0.2, 'industry': '半導體業'}
+
+
+# 在暫存目錄跑整個 app：股票清單先存好 (不連證交所)，官方檔指到 FakeExchange，Yahoo 換成 fake_info
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    fake = FakeExchange()
+    base = fake.start_in_thread()
+    monkeypatch.setattr(exchange, 'TWSE_BASE', base)
+    monkeypatch.setattr(exchange, 'TPEX_BASE', base)
+    monkeypatch.setattr(yahoo, 'fetch_info', fake_info)
+    monkeypatch.setattr(prefetch, 'fetch_info', fake_info)
+    monkeypatch.setattr(bundle, 'download_bundle', lambda *args, **kwargs: False)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('data', 'universe'))
+    for mode, rows in UNIVERSE.items():
+        pd.DataFrame(rows, columns=['code', 'name', 'yf_ticker']).to_csv(
+            os.path.join('data', 'universe', f'market_{mode}.csv'), index=False)
+    with open(os.path.join('data', 'universe', 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({mode: {'checked_at': time.time()} for mode in UNIVERSE}, f)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    at = AppTest.from_file(MAIN, default_timeout=120)
+    at.run()
+    at.sidebar.number_input[0].set_value(100.0).run()
+    at.sidebar.number_input[1].set_value(20.0).run()
+    at.sidebar.slider[0].set_value(0.0).run()
+    at.sidebar.slider[1].set_value(0.0).run()
+    yield at
+    st.cache_resource.clear()
+    fake.stop()
+
+
+def scan(at, mode):
+    [r for r in at.sidebar.radio if r.label == "抓取模式"][0].set_value(mode).run()
+    at.main.button[0].click().run()
+    assert not at.exception
+    return at.main.dataframe[0].value.set_index('代號')
+
+
+# 官方檔掃過之後再重掃 (包括改用 Yahoo 的模式)，Yahoo 補 ROE / 產業時不能蓋掉官方的價格與估值
+@pytest.mark.parametrize('rescan', ["官方批次檔", "執行緒池"])
+def test_rescan_keeps_official_fields(app, rescan):
+    first = scan(app, "官方批次檔")
+    assert first.loc['2330', '本益比'] == 33.48
+    again = scan(app, rescan)
+    assert again.loc['2330', '本益比'] == 33.48
+    assert again.loc['2330', 'ROE(%)'] == 20.0
+    assert again.loc['2330', '數據來源'].startswith("官方: 價 PE")
+
+    sources = FundamentalsCache().sources_many(['2330.TW'])['2330.TW']
+    assert sources['trailingPE'] == OFFICIAL
+    assert sources['currentPrice'] == OFFICIAL
+    assert sources['returnOnEquity'] == YAHOO
@@ -0,0 +1,40 @@
+import time
+
+from rate_control import BLOCKED, RateController
+from scanner import scan
+
+
+# 控制器退避中 (每個 worker 都卡在 acquire)，呼叫端拿到第一筆就停：關閉要立刻返回，不等在途的工作
+def test_close_does_not_wait_for_queued_workers():
+    controller = RateController(initial_rate=20.0, cooldown=30.0)
+    calls = []
+
+    def fetch(item):
+        controller.acquire()
+        calls.append(item)
+        if item == 0:
+            controller.record(BLOCKED)
+        return item
+
+    stream = scan(range(32), fetch, max_workers=8)
+    assert next(stream)[1] == 0
+    t0 = time.monotonic()
+    stream.close()
+    assert time.monotonic() - t0 < 1.0
+
+    # 排隊中放棄的 worker 不會送出請求，佔用的時段也已還回去
+    time.sleep(0.2)
+    assert len(calls) <= 2
+    assert controller._next_slot - time.monotonic() < 31.0
+
+
+def test_results_and_errors_are_all_returned():
+    def fetch(item):
+        if item % 3 == 0:
+            raise ValueError(item)
+        return item * 2
+
+    got = {item: (result, err) for item, result, err in scan(range(20), fetch, max_workers=4)}
+    assert set(got) == set(range(20))
+    assert got[4] == (8, None)
+    assert isinstance(got[3][1], ValueError)
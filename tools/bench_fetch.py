@@ -0,0 +1,62 @@
+import argparse
+import time
+
+import httpx
+
+from rate_control import RateController
+from tools.fake_yahoo import FakeYahoo
+from yahoo_async import fetch_many, MODULES
+
+# --- 抓取吞吐量比較 (離線) ---
+# 對本機 Yahoo 替身比較「逐檔阻塞抓取」與 asyncio 管線的每秒處理檔數。
+# asyncio 分兩種量：不經速率控制器 (管線本身的上限)，以及跟 App 一樣經過預設的 RateController
+# (從 initial_rate 起步、最多 max_rate 檔/秒)，後者才是 App 實際拿得到的吞吐量。
+# 用法: python -m tools.bench_fetch --n 500 --latency 0.2
+
+
+def bench_serial(base_url, symbols):
+    with httpx.Client(base_url=base_url) as client:
+        for s in symbols:
+            client.get(f"/v10/finance/quoteSummary/{s}", params={'modules': MODULES, 'crumb': 'fake-crumb'})
+
+
+def bench_async(base_url, symbols, concurrency, connections, controller=None):
+    # 對替身用明文 HTTP/2 (h2c)，跟真實 Yahoo 的 HTTPS + HTTP/2 一樣在少量連線上多工
+    ok = 0
+    for _, info, err in fetch_many(symbols, concurrency=concurrency, controller=controller, base_url=base_url,
+                                   cookie_url=base_url + "/", max_connections=connections, http1=False):
+        ok += err is None
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--serial-sample', type=int, default=20)
+    args = parser.parse_args()
+
+    fake = FakeYahoo(latency=args.latency)
+    base_url = fake.start_in_thread()
+    symbols = [f"{1000 + i}.TW" for i in range(args.n)]
+
+    t0 = time.perf_counter()
+    bench_serial(base_url, symbols[:args.serial_sample])
+    serial_rate = args.serial_sample / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    ok = bench_async(base_url, symbols, args.concurrency, args.connections)
+    async_rate = args.n / (time.perf_counter() - t0)
+
+    controller = RateController()     # 與 main.get_rate_controller 相同的預設值
+    t0 = time.perf_counter()
+    capped_ok = bench_async(base_url, symbols, args.concurrency, args.connections, controller)
+    capped_rate = args.n / (time.perf_counter() - t0)
+
+    print(f"逐檔阻塞              : {serial_rate:8.1f} 檔/秒")
+    print(f"asyncio (無速率控制)  : {async_rate:8.1f} 檔/秒 (成功 {ok}/{args.n}，連線數 {fake.connections})")
+    print(f"asyncio (App 速率控制): {capped_rate:8.1f} 檔/秒 (成功 {capped_ok}/{args.n}，"
+          f"速率上限 {controller.max_rate:g} 檔/秒，結束時 {controller.state()['rate']:.1f})")
+    print(f"加速倍數: 管線 {async_rate / serial_rate:.1f}x，App 實際 {capped_rate / serial_rate:.1f}x")
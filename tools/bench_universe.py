@@ -0,0 +1,135 @@
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import StringIO
+from urllib.parse import urlsplit, parse_qs
+
+# --- 股票清單冷啟動比較 (離線) ---
+# 產生與證交所 ISIN 頁面結構相同的假頁面 (含大量權證列)，以限速的本機伺服器提供，
+# 分別在獨立子程序中執行「舊版：依序下載 + pd.read_html」與「新版：UniverseStore.refresh
+# (並行下載，邊下載邊算雜湊與解析，寫入本機存檔)」，比較耗時與峰值記憶體 (RSS)。
+# 用法: python -m tools.bench_universe --warrants 20000 --bandwidth 2
+
+SECTIONS = {
+    '2': [('股票', 1000, 4), ('ETF', 200, 4), ('上市認購(售)權證', None, 6), ('臺灣存託憑證(TDR)', 20, 6)],
+    '4': [('股票', 850, 4), ('ETF', 100, 5), ('上櫃認購(售)權證', None, 6)],
+}
+HEADER = ('<tr align=center><td bgcolor=#D5FFD5>有價證券代號及名稱 </td><td bgcolor=#D5FFD5>國際證券辨識號碼(ISIN Code)</td>'
+          '<td bgcolor=#D5FFD5>上市日</td><td bgcolor=#D5FFD5>市場別</td><td bgcolor=#D5FFD5>產業別</td>'
+          '<td bgcolor=#D5FFD5>CFICode</td><td bgcolor=#D5FFD5>備註</td></tr>')
+
+
+def make_page(mode, warrants):
+    rnd = random.Random(mode)
+    parts = ['<html><head><meta http-equiv="Content-Type" content="text/html; charset=MS950"></head><body>'
+             '<table class=\'h4\' align=center cellSpacing=3 cellPadding=2 width=750 border=0>', HEADER]
+    for title, count, digits in SECTIONS[mode]:
+        parts.append(f'<tr><td bgcolor=#FAFAD2 colspan=7 ><B> {title} <B> </td></tr>')
+        for i in range(count or warrants):
+            code = str(rnd.randrange(10 ** (digits - 1), 10 ** digits))
+            cells = [f'{code}　測試{i}', f'TW000{code}00{i % 10}', '2001/01/01', '上市' if mode == '2' else '上櫃',
+                     '半導體業', 'ESVUFR', '']
+            parts.append('<tr>' + ''.join(f'<td bgcolor=#FAFAD2>{c}</td>' for c in cells) + '</tr>')
+    parts.append('</table></body></html>')
+    return ''.join(parts).encode('cp950')
+
+
+def serve(pages, bandwidth_mb):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages[parse_qs(urlsplit(self.path).query)['strMode'][0]]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=MS950')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            step = 64 * 1024
+            for i in range(0, len(body), step):   # 模擬頻寬限制
+                self.wfile.write(body[i:i + step])
+                time.sleep(step / (bandwidth_mb * 1024 * 1024))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/isin/C_public.jsp?strMode={{mode}}"
+
+
+# 原本 get_tw_stock_list 的做法，保留作為比較基準
+def legacy(url_template):
+    import pandas as pd
+    import requests
+
+    def fetch_and_process(url, suffix):
+        response = requests.get(url, verify=False)
+        response.encoding = 'big5'
+        df = pd.read_html(StringIO(response.text))[0]
+        header_idx = next(i for i in range(min(5, len(df))) if '有價證券代號' in str(df.iloc[i].values))
+        df.columns = df.iloc[header_idx]
+        df = df.iloc[header_idx + 1:].copy()
+        df = df.dropna(subset=['有價證券代號及名稱'])
+        df = df[df['有價證券代號及名稱'].astype(str).str.contains('　')]
+        df['code'] = df['有價證券代號及名稱'].str.split('　').str[0]
+        df['name'] = df['有價證券代號及名稱'].str.split('　').str[1]
+        df = df[df['code'].str.len() == 4]
+        df['yf_ticker'] = df['code'] + suffix
+        return df[['code', 'name', 'yf_ticker']]
+
+    return pd.concat([fetch_and_process(url_template.format(mode='2'), '.TW'),
+                      fetch_and_process(url_template.format(mode='4'), '.TWO')], ignore_index=True)
+
+
+# app 冷啟動實際走的路徑 (get_tw_stock_list -> UniverseStore)，存檔放在暫存目錄
+def streaming(url_template):
+    from universe import UniverseStore
+    store = UniverseStore(store_dir=tempfile.mkdtemp(prefix='bench-universe-'), url_template=url_template)
+    store.refresh()
+    return store.load()
+
+
+def run_child(which, url_template):
+    # 先載入兩邊都會用到的模組，峰值扣掉這個基準才是下載與解析本身用掉的記憶體
+    import pandas, lxml.html, requests  # noqa: F401
+    import universe  # noqa: F401
+    base_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    t0 = time.perf_counter()
+    df = {'legacy': legacy, 'streaming': streaming}[which](url_template)
+    elapsed = time.perf_counter() - t0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'seconds': elapsed, 'peak_mb': peak_mb, 'base_mb': base_mb, 'rows': len(df)}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--warrants', type=int, default=20000, help='每頁權證列數 (真實頁面約數萬列)')
+    parser.add_argument('--bandwidth', type=float, default=2.0, help='每條連線頻寬 MB/s')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.url)
+        sys.exit()
+
+    pages = {mode: make_page(mode, args.warrants) for mode in SECTIONS}
+    url = serve(pages, args.bandwidth)
+    print(f"頁面大小: 上市 {len(pages['2']) / 1e6:.1f} MB / 上櫃 {len(pages['4']) / 1e6:.1f} MB")
+
+    results = {}
+    for which in ('legacy', 'streaming'):
+        out = subprocess.run([sys.executable, '-m', 'tools.bench_universe', '--child', which, '--url', url],
+                             capture_output=True, text=True, check=True)
+        results[which] = json.loads(out.stdout.strip().splitlines()[-1])
+        r = results[which]
+        print(f"{which:10s}: {r['seconds']:6.2f} 秒　峰值 RSS {r['peak_mb']:7.1f} MB "
+              f"(載入模組後 +{r['peak_mb'] - r['base_mb']:.1f} MB)　{r['rows']} 檔")
+
+    old, new = results['legacy'], results['streaming']
+    print(f"冷啟動加速 {old['seconds'] / new['seconds']:.1f}x，峰值記憶體減少 {old['peak_mb'] - new['peak_mb']:.0f} MB")
@@ -0,0 +1,61 @@
+import argparse
+import os
+
+from bundle import BUNDLE_PATH, build_bundle
+from cache import CACHE_PATH, FIELDS, SLOW_FIELDS, FundamentalsCache
+from exchange import OFFICIAL_FIELDS, OfficialFeed
+from rate_control import RateController
+from scanner import DEFAULT_WORKERS, scan
+from sources import OFFICIAL, yahoo_fields
+from universe import STORE_DIR, UniverseStore
+from yahoo import fetch_info
+
+# --- 產生內建離線快照 ---
+# 讀取本機的股票清單存檔與基本面快取，壓縮成 bundle/market.json.gz。
+# 發佈前先在 App 裡跑完「全市場掃描任務」把快取補滿，再執行:
+#   python -m tools.build_bundle
+# 沒有清單存檔時會先向證交所下載一次。
+# 加 --official 先把證交所 / 櫃買中心當天的估值與收盤價寫進快取，不必掃 Yahoo 也有全市場的
+# 本益比 / 淨值比 / 殖利率；再加 --yahoo 向 Yahoo 補 ROE 與產業還沒有或已過期的股票 (不蓋掉官方欄位)。
+# .github/workflows/bundle.yml 用 --official --yahoo 定期重建並發佈成 release 附件。
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', default=CACHE_PATH, help='基本面快取 (SQLite)')
+    parser.add_argument('--universe', default=STORE_DIR, help='股票清單存檔目錄')
+    parser.add_argument('--out', default=BUNDLE_PATH)
+    parser.add_argument('--official', action='store_true', help='先用官方批次檔補快取')
+    parser.add_argument('--yahoo', action='store_true', help='向 Yahoo 補 ROE 與產業')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    store = UniverseStore(args.universe)
+    universe = store.load()
+    if universe is None:
+        store.refresh()
+        universe = store.load()
+    cache = FundamentalsCache(args.cache)
+    infos = {}
+    if args.official:
+        _, infos, errors = OfficialFeed().get()
+        if errors:
+            raise SystemExit("官方批次檔下載失敗: " + ", ".join(f"{m} {e}" for m, e in errors.items()))
+        tickers = set(universe['yf_ticker'])
+        cache.put_many([(t, info, None) for t, info in infos.items() if t in tickers], OFFICIAL_FIELDS, OFFICIAL,
+                       partial=True)
+    if args.yahoo:
+        controller = RateController()
+
+        def fetch(ticker):
+            cache.put(ticker, fetch_info(ticker, controller), yahoo_fields(FIELDS, infos.get(ticker)))
+
+        need = cache.stale(universe['yf_ticker'], SLOW_FIELDS)
+        failed = 0
+        for i, (ticker, _, err) in enumerate(scan(need, fetch, args.workers), 1):
+            failed += err is not None
+            if i % 100 == 0 or i == len(need):
+                print(f"Yahoo {i}/{len(need)}，失敗 {failed}，速率 {controller.state()['rate']:.1f}/秒", flush=True)
+    loaded = cache.load_many(universe['yf_ticker'])
+
+    build_bundle(universe, loaded, args.out)
+    print(f"{len(universe)} 檔清單，{len(loaded)} 檔基本面 → {args.out} ({os.path.getsize(args.out) / 1024:.0f} KB)")
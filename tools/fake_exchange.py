@@ -0,0 +1,42 @@
+import argparse
+import os
+from urllib.parse import urlsplit
+
+from tools.stub_server import StubServer
+
+# --- 本機證交所 / 櫃買中心 OpenAPI 替身 ---
+# 依路徑最後一段回傳 tools/recorded/<名稱>.json (錄下來的官方批次檔)，
+# 離線驗證 exchange.py 的解析與整條抓取流程用。兩個市場共用同一個埠，
+# 啟動後把 TWSE_OPENAPI / TPEX_OPENAPI 指到這裡即可。
+# 用法: python -m tools.fake_exchange --port 8766 --latency 0.3
+#       TWSE_OPENAPI=http://127.0.0.1:8766 TPEX_OPENAPI=http://127.0.0.1:8766 streamlit run main.py
+RECORDED_DIR = os.path.join(os.path.dirname(__file__), 'recorded')
+
+
+class FakeExchange(StubServer):
+    port = 8766
+
+    def __init__(self, latency=0.0, recorded_dir=RECORDED_DIR, fail=()):
+        self.latency = latency
+        self.recorded_dir = recorded_dir
+        self.fail = set(fail)      # 這些檔名回 503，模擬其中一個市場掛掉
+        self.requests = 0
+
+    def route(self, path):
+        name = urlsplit(path).path.rstrip('/').rsplit('/', 1)[-1]
+        if name in self.fail:
+            return 503, b'Service Unavailable'
+        file = os.path.join(self.recorded_dir, name + '.json')
+        if not os.path.exists(file):
+            return 404, b'[]'
+        with open(file, 'rb') as f:
+            return 200, f.read()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail', nargs='*', default=(), help="回 503 的檔名，例如 BWIBBU_ALL")
+    args = parser.parse_args()
+    FakeExchange(args.latency, fail=args.fail).serve(port=args.port).serve_forever()
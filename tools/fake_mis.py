@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from tools.stub_server import StubServer
+
+# --- 本機 MIS 即時報價替身 ---
+# 重播 tools/recorded/mis_ticks.jsonl：每行是一次輪詢錄到的 {"t": 時間, "msgArray": [...]}。
+# step 秒換下一格 (播完停在最後一格)；step 為 0 時只在呼叫 advance() 時換格，測試可逐格驗證。
+# 回應只包含請求 ex_ch 裡有的代號，格式與 getStockInfo.jsp 相同。
+# 用法: python -m tools.fake_mis --port 8767 --step 5
+#       TWSE_MIS=http://127.0.0.1:8767 streamlit run main.py
+TICKS_PATH = os.path.join(os.path.dirname(__file__), 'recorded', 'mis_ticks.jsonl')
+
+
+class FakeMIS(StubServer):
+    port = 8767
+
+    def __init__(self, path=TICKS_PATH, step=5.0):
+        with open(path, encoding='utf-8') as f:
+            self.frames = [json.loads(line) for line in f if line.strip()]
+        self.step = step
+        self.requests = 0
+        self._frame = 0
+        self._t0 = time.monotonic()
+
+    @property
+    def frame(self):
+        if self.step:
+            self._frame = int((time.monotonic() - self._t0) / self.step)
+        return min(self._frame, len(self.frames) - 1)
+
+    def advance(self):
+        self._frame += 1
+
+    def route(self, target):
+        url = urlsplit(target)
+        if url.path != '/stock/api/getStockInfo.jsp':
+            return 404, json.dumps({'rtcode': '9999', 'rtmessage': 'Not Found'}).encode()
+        wanted = set(parse_qs(url.query).get('ex_ch', [''])[0].split('|'))
+        frame = self.frames[self.frame]
+        rows = [r for r in frame['msgArray'] if f"{r['ex']}_{r['c']}.tw" in wanted]
+        payload = {'msgArray': rows, 'rtcode': '0000', 'rtmessage': 'OK', 'queryTime': {'sysTime': frame['t']}}
+        return 200, json.dumps(payload, ensure_ascii=False).encode()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--step', type=float, default=5.0)
+    parser.add_argument('--ticks', default=TICKS_PATH)
+    args = parser.parse_args()
+    FakeMIS(args.ticks, args.step).serve(port=args.port).serve_forever()
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+import h2.config
+import h2.connection
+import h2.settings
+import h2.events
+
+# --- 本機 Yahoo 替身伺服器 ---
+# 離線量測抓取吞吐量用：模擬 cookie / crumb / quoteSummary / v7 批次報價，
+# 每個請求加上固定延遲，並可依比例回 429 模擬被鎖 IP。
+# 同時支援 HTTP/1.1 keep-alive 與明文 HTTP/2 (h2c prior knowledge)，
+# 後者才能量測「少量連線、大量請求多工」的情境。
+# 用法: python -m tools.fake_yahoo --port 8765 --latency 0.2
+
+
+def fake_metrics(symbol):
+    # 以代號雜湊產生固定的假數據，重跑結果一致
+    rnd = random.Random(hashlib.md5(symbol.encode()).hexdigest())
+    price = round(rnd.uniform(10, 1000), 2)
+    return {
+        'price': price,
+        'trailingPE': round(rnd.uniform(3, 60), 2) if rnd.random() > 0.1 else None,
+        'forwardPE': round(rnd.uniform(3, 60), 2),
+        'priceToBook': round(rnd.uniform(0.3, 10), 2),
+        'dividendYield': round(rnd.uniform(0, 0.09), 4),
+        'returnOnEquity': round(rnd.uniform(-0.1, 0.4), 4),
+        'industry': rnd.choice(['Semiconductors', 'Banks—Regional', 'Steel', 'Telecom Services', 'Shipping & Ports']),
+    }
+
+
+def raw(value):
+    return {} if value is None else {'raw': value, 'fmt': str(value)}
+
+
+def quote_summary(symbol):
+    m = fake_metrics(symbol)
+    return {'quoteSummary': {'error': None, 'result': [{
+        'price': {'symbol': symbol, 'regularMarketPrice': raw(m['price'])},
+        'summaryDetail': {'trailingPE': raw(m['trailingPE']), 'forwardPE': raw(m['forwardPE']),
+                          'dividendYield': raw(m['dividendYield'])},
+        'defaultKeyStatistics': {'priceToBook': raw(m['priceToBook'])},
+        'financialData': {'currentPrice': raw(m['price']), 'returnOnEquity': raw(m['returnOnEquity'])},
+        'assetProfile': {'industry': m['industry']},
+    }]}}
+
+
+def quote(symbol):
+    m = fake_metrics(symbol)
+    return {'symbol': symbol, 'regularMarketPrice': m['price'], 'trailingPE': m['trailingPE'],
+            'forwardPE': m['forwardPE'], 'priceToBook': m['priceToBook'],
+            'trailingAnnualDividendYield': m['dividendYield']}
+
+
+class FakeYahoo:
+    def __init__(self, latency=0.2, block_rate=0.0):
+        self.latency = latency
+        self.block_rate = block_rate
+        self.requests = 0
+        self.connections = 0
+
+    def route(self, path, query):
+        if path == '/v1/test/getcrumb':
+            return 200, 'text/plain', b'fake-crumb'
+        if path.startswith('/v10/finance/quoteSummary/'):
+            if random.random() < self.block_rate:
+                return 429, 'text/plain', b'Too Many Requests'
+            if query.get('crumb', [''])[0] != 'fake-crumb':
+                return 401, 'application/json', b'{"finance":{"error":{"code":"Unauthorized"}}}'
+            symbol = path.rsplit('/', 1)[1]
+            return 200, 'application/json', json.dumps(quote_summary(symbol)).encode()
+        if path == '/v7/finance/quote':
+            if random.random() < self.block_rate:
+                return 429, 'text/plain', b'Too Many Requests'
+            symbols = query.get('symbols', [''])[0].split(',')
+            body = {'quoteResponse': {'error': None, 'result': [quote(s) for s in symbols if s]}}
+            return 200, 'application/json', json.dumps(body).encode()
+        return 200, 'text/plain', b''  # fc.yahoo.com 的 cookie 請求
+
+    async def respond(self, target):
+        self.requests += 1
+        url = urlsplit(target)
+        await asyncio.sleep(self.latency)
+        return self.route(url.path, parse_qs(url.query))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            request_line = await reader.readline()
+            if request_line.startswith(b'PRI * HTTP/2.0'):
+                await self.handle_h2(reader, writer, request_line + await reader.readexactly(8))
+                return
+            while request_line:
+                keep_alive = True
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    if line.lower().startswith(b'connection:') and b'close' in line.lower():
+                        keep_alive = False
+                status, ctype, body = await self.respond(request_line.split()[1].decode())
+                writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: {ctype}\r\n"
+                             f"Content-Length: {len(body)}\r\nSet-Cookie: A3=fake\r\n\r\n".encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+                request_line = await reader.readline()
+        except (ConnectionError, IndexError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_h2(self, reader, writer, preface):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 1000})
+        pending = {}      # stream_id -> 尚未送出的 body (受流量控制限制)
+        tasks = set()
+
+        def flush():
+            for stream_id in list(pending):
+                body = pending[stream_id]
+                size = min(len(body), conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)
+                if size <= 0 and body:
+                    continue
+                conn.send_data(stream_id, body[:size], end_stream=size == len(body))
+                if size == len(body):
+                    del pending[stream_id]
+                else:
+                    pending[stream_id] = body[size:]
+            writer.write(conn.data_to_send())
+
+        async def reply(stream_id, headers):
+            status, ctype, body = await self.respond(headers[':path'])
+            conn.send_headers(stream_id, [(':status', str(status)), ('content-type', ctype),
+                                          ('content-length', str(len(body))), ('set-cookie', 'A3=fake')])
+            pending[stream_id] = body
+            flush()
+            await writer.drain()
+
+        data = preface
+        while data:
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                               for k, v in event.headers}
+                    task = asyncio.create_task(reply(event.stream_id, headers))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif isinstance(event, h2.events.WindowUpdated):
+                    flush()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            data = await reader.read(65536)
+
+    async def serve(self, host='127.0.0.1', port=8765, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        if ready:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+    # 在背景執行緒啟動，回傳 base_url (port=0 代表隨機埠)
+    def start_in_thread(self, port=0):
+        ready = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(self.serve(port=port, ready=ready)), daemon=True).start()
+        ready.wait()
+        return f"http://127.0.0.1:{self.port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--block-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(FakeYahoo(args.latency, args.block_rate).serve(port=args.port))
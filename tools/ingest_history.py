@@ -0,0 +1,28 @@
+import argparse
+import time
+
+from history import HISTORY_DIR, HISTORY_START, BATCH_SIZE, HistoryStore
+from rate_control import RateController
+from universe import UniverseStore
+
+# --- 歷史股價下載 / 每日更新 ---
+# 第一次執行下載全市場自 --start 起的日線，之後每次只補缺的交易日。
+#   python -m tools.ingest_history
+#   python -m tools.ingest_history --tickers 2330.TW 2317.TW --start 2020-01-01
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tickers', nargs='*', help='預設為整個股票清單')
+    parser.add_argument('--start', default=HISTORY_START)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='每次 yf.download 帶幾檔')
+    parser.add_argument('--root', default=HISTORY_DIR)
+    args = parser.parse_args()
+
+    tickers = args.tickers or list(UniverseStore().get()['yf_ticker'])
+    store = HistoryStore(args.root, RateController(), args.batch)
+    plan = store.plan(tickers, args.start)
+    print(f"{len(tickers)} 檔，需要更新 {sum(len(v) for v in plan.values())} 檔，分 {len(plan)} 組起始日")
+
+    t0 = time.perf_counter()
+    result = store.update(tickers, args.start)
+    print(f"完成 {result['fetched']} 檔，失敗 {len(result['failed'])} 檔，耗時 {time.perf_counter() - t0:.1f} 秒")
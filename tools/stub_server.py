@@ -0,0 +1,49 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- 本機替身伺服器共用的 HTTP 外殼 ---
+# 子類別只實作 route(path) -> (狀態碼, body bytes)；每個請求的固定延遲 (latency)、
+# 請求計數與背景啟動都在這裡。fake_exchange、fake_mis 共用。
+class StubServer:
+    port = 0                  # serve() 的預設埠，子類別覆寫
+    latency = 0.0
+    requests = 0
+    content_type = 'application/json; charset=utf-8'
+
+    def route(self, path):
+        raise NotImplementedError
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                status, body = server.route(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', server.content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host='127.0.0.1', port=None):
+        self.httpd = ThreadingHTTPServer((host, self.port if port is None else port), self.handler())
+        self.port = self.httpd.server_address[1]
+        return self.httpd
+
+    # 在背景執行緒啟動，回傳 base_url (port=0 代表隨機埠)
+    def start_in_thread(self, port=0):
+        httpd = self.serve(port=port)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
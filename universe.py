@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from lxml import etree
+
+from http_client import get_session
+
+ISIN_URL = "https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}"
+# (strMode, yfinance 後綴)：2 = 上市，4 = 上櫃
+MARKETS = (('2', '.TW'), ('4', '.TWO'))
+COLUMNS = ['code', 'name', 'yf_ticker']
+
+ENCODING = 'cp950'         # 頁面宣告 MS950 (Big5 的微軟擴充)
+STOCK_SECTION = '股票'     # 只收這個分類底下的普通股，跳過 ETF、權證、特別股等
+CHUNK_SIZE = 64 * 1024
+
+STORE_DIR = os.path.join('data', 'universe')
+MAX_AGE = 12 * 3600        # 超過這個時間才回頭跟證交所確認清單有沒有變
+
+
+# --- 串流解析 ISIN 頁面 ---
+# 邊下載邊丟給 lxml 的 pull parser，每讀完一個 <tr> 就判斷、取值、丟掉，
+# 不必先把數 MB 的整頁轉成字串再交給 pd.read_html 建出全部證券的大表。
+def parse_isin(chunks, suffix):
+    parser = etree.HTMLPullParser(events=('end',), tag='tr', encoding=ENCODING)
+    section = None
+    rows = []
+
+    def drain():
+        nonlocal section
+        for _, tr in parser.read_events():
+            tds = tr.findall('td')
+            if len(tds) == 1:
+                section = ''.join(tds[0].itertext()).strip()   # 分類標題列，例如「股票」、「ETF」
+            elif section == STOCK_SECTION and tds:
+                # 權證等其他分類的數萬列連文字都不取，直接丟掉
+                code, _, name = ''.join(tds[0].itertext()).strip().partition('　')
+                code = code.strip()
+                if len(code) == 4 and code.isdigit():
+                    rows.append((code, name.strip(), code + suffix))
+            # 釋放已處理的節點，記憶體只保留目前這一列
+            tr.clear()
+            parent = tr.getparent()
+            if parent is not None:
+                while tr.getprevious() is not None:
+                    del parent[0]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    parser.close()
+    drain()
+    return rows
+
+
+def fetch_market(mode, suffix, session=None, url_template=ISIN_URL):
+    session = session or get_session()
+    with session.get(url_template.format(mode=mode), verify=False, stream=True) as response:
+        response.raise_for_status()
+        return parse_isin(response.iter_content(CHUNK_SIZE), suffix)
+
+
+# 上市、上櫃兩頁同時下載與解析
+def fetch_universe(session=None, url_template=ISIN_URL):
+    with ThreadPoolExecutor(max_workers=len(MARKETS)) as pool:
+        futures = [pool.submit(fetch_market, mode, suffix, session, url_template) for mode, suffix in MARKETS]
+        rows = [row for f in futures for row in f.result()]
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+# --- 清單異動比對 ---
+# 以 code 對齊新舊清單：新上市、下市，以及同代號改名或轉市場 (上櫃轉上市時 yf_ticker 後綴會變)
+def diff_universe(old, new):
+    old = old.set_index('code')
+    new = new.set_index('code')
+    added = new.index.difference(old.index)
+    removed = old.index.difference(new.index)
+    both = new.index.intersection(old.index)
+    changed = both[(old.loc[both, 'name'] != new.loc[both, 'name']).to_numpy()
+                   | (old.loc[both, 'yf_ticker'] != new.loc[both, 'yf_ticker']).to_numpy()]
+    return {
+        'added': [{'code': c, **new.loc[c, ['name', 'yf_ticker']].to_dict()} for c in added],
+        'removed': [{'code': c, **old.loc[c, ['name', 'yf_ticker']].to_dict()} for c in removed],
+        'renamed': [{'code': c, 'old_name': old.at[c, 'name'], 'name': new.at[c, 'name'],
+                     'old_ticker': old.at[c, 'yf_ticker'], 'yf_ticker': new.at[c, 'yf_ticker']} for c in changed],
+    }
+
+
+# 異動對應到需要新抓與需要丟掉的 yf_ticker；只改名的股票代號沒變，快取照用
+def change_tickers(change):
+    moved = [r for r in change['renamed'] if r['old_ticker'] != r['yf_ticker']]
+    new = [r['yf_ticker'] for r in change['added']] + [r['yf_ticker'] for r in moved]
+    dropped = [r['yf_ticker'] for r in change['removed']] + [r['old_ticker'] for r in moved]
+    return new, dropped
+
+
+# --- 股票清單的本機存檔 ---
+# 每個市場存一份解析後的 CSV，meta.json 記錄 ETag / Last-Modified / 內容雜湊與確認時間。
+# 重新確認時帶條件式 GET；伺服器回 304 或內容雜湊相同就沿用舊檔，不重新解析。
+# 內容有變時與舊清單比對，異動追加到 changes.jsonl 並通知訂閱者 (快取、背景預抓) 只處理差異。
+class UniverseStore:
+    def __init__(self, store_dir=STORE_DIR, session=None, url_template=ISIN_URL):
+        self.store_dir = store_dir
+        self.session = session
+        self.url_template = url_template
+        os.makedirs(store_dir, exist_ok=True)
+        self.meta_path = os.path.join(store_dir, 'meta.json')
+        self.changes_path = os.path.join(store_dir, 'changes.jsonl')
+        self._lock = threading.Lock()             # 一次只跑一個 refresh (含網路確認)
+        self._thread_lock = threading.Lock()      # 只保護背景執行緒的啟動，get() 不會被下載卡住
+        self._refreshing = None
+        self._listeners = []
+        self._baseline = None     # 還沒有存檔時暫用的清單 (內建快照)，第一次下載後拿來比對異動
+
+    # fn(change) 在清單有異動時被呼叫 (可能在背景執行緒)
+    def subscribe(self, fn):
+        self._listeners.append(fn)
+
+    def _market_path(self, mode):
+        return os.path.join(self.store_dir, f'market_{mode}.csv')
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.meta_path)
+
+    def load(self):
+        frames = []
+        for mode, _ in MARKETS:
+            path = self._market_path(mode)
+            if not os.path.exists(path):
+                return None
+            frames.append(pd.read_csv(path, dtype=str, keep_default_na=False))
+        return pd.concat(frames, ignore_index=True)[COLUMNS]
+
+    def age(self):
+        meta = self._read_meta()
+        checked = [meta.get(mode, {}).get('checked_at') for mode, _ in MARKETS]
+        return None if None in checked else time.time() - min(checked)
+
+    def _revalidate_market(self, mode, suffix, meta):
+        session = self.session or get_session()
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        with session.get(self.url_template.format(mode=mode), headers=headers, verify=False, stream=True) as response:
+            if response.status_code == 304 and os.path.exists(self._market_path(mode)):
+                return {**meta, 'checked_at': time.time()}, None
+            response.raise_for_status()
+            # ISIN 頁面是動態產生的，通常沒有 ETag；每個區塊同時送進雜湊與 parser，不留整頁在記憶體，
+            # 內容沒變 (雜湊相同) 就丟掉解析結果、沿用舊檔
+            digest = hashlib.sha256()
+
+            def chunks():
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    yield chunk
+
+            rows = parse_isin(chunks(), suffix)
+            new_meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                        'sha256': digest.hexdigest(), 'checked_at': time.time()}
+
+        if new_meta['sha256'] == meta.get('sha256') and os.path.exists(self._market_path(mode)):
+            return {**new_meta, 'changed_at': meta.get('changed_at')}, None
+        if not rows:
+            raise ValueError(f"strMode={mode} 解析結果為空")
+        return {**new_meta, 'changed_at': time.time()}, rows
+
+    def _write_market(self, mode, rows):
+        path = self._market_path(mode)
+        pd.DataFrame(rows, columns=COLUMNS).to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    # 兩個市場並行確認，回傳是否有任何一頁內容變動。
+    # 兩頁都確認成功才寫入 CSV 與 meta：其中一頁失敗時什麼都不動，另一頁的異動留到下次一起比對，不會遺失
+    def refresh(self):
+        with self._lock:
+            meta = self._read_meta()
+            old = self.load()
+            if old is None:
+                old = self._baseline
+            with ThreadPoolExecutor(max_workers=len(MARKETS)) as pool:
+                futures = {mode: pool.submit(self._revalidate_market, mode, suffix, meta.get(mode, {}))
+                           for mode, suffix in MARKETS}
+                results = {mode: f.result() for mode, f in futures.items()}
+            for mode, (_, rows) in results.items():
+                if rows is not None:
+                    self._write_market(mode, rows)
+            self._write_meta({**meta, **{mode: m for mode, (m, _) in results.items()}})
+            changed = any(rows is not None for _, rows in results.values())
+            # 第一次下載且沒有暫用清單可比，不算異動
+            change = diff_universe(old, self.load()) if changed and old is not None else None
+            if change is not None and any(change.values()):
+                change = {'at': time.time(), **change}
+                with open(self.changes_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(change, ensure_ascii=False) + '\n')
+            else:
+                change = None
+        if change is not None:
+            for fn in self._listeners:
+                try:
+                    fn(change)
+                except Exception:
+                    pass  # 訂閱者出錯不影響清單本身的更新
+        return changed
+
+    # 最近的異動紀錄，新的在前
+    def changes(self, limit=20):
+        if not os.path.exists(self.changes_path):
+            return []
+        out = []
+        with open(self.changes_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    pass  # 寫到一半的最後一行
+        return out[::-1][:limit]
+
+    def refresh_in_background(self):
+        with self._thread_lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            self._refreshing = threading.Thread(target=self._safe_refresh, name="universe-refresh", daemon=True)
+            self._refreshing.start()
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass  # 背景確認失敗就繼續用舊清單，下次再試
+
+    # 冷啟動：有存檔就立刻回傳，過期的話背景重新確認；沒有存檔時，
+    # 有 fallback (內建快照的清單) 就先回傳它並在背景下載，否則同步下載
+    def get(self, max_age=MAX_AGE, fallback=None):
+        df = self.load()
+        if df is None:
+            if fallback is not None:
+                self._baseline = fallback
+                self.refresh_in_background()
+                return fallback
+            self.refresh()
+            return self.load()
+        age = self.age()
+        if age is None or age > max_age:
+            self.refresh_in_background()
+        return df
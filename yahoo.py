@@ -0,0 +1,78 @@
+import time
+
+import yfinance as yf
+from yfinance.data import YfData
+from yfinance.exceptions import YFRateLimitError
+
+from http_client import get_session
+from rate_control import OK, BLOCKED, ERROR
+
+
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+QUOTE_CHUNK = 50   # 一次請求帶幾個代號 (網址長度與回應大小的折衷)
+
+
+class BlockedError(Exception):
+    pass
+
+
+# --- Yahoo 基本面抓取 ---
+# 經過速率控制器取得 .info，並把結果 (正常 / 被鎖 / 錯誤) 回報給控制器
+def fetch_info(yf_ticker, controller):
+    controller.acquire()
+    t0 = time.monotonic()
+    try:
+        info = yf.Ticker(yf_ticker, session=get_session('yahoo')).info
+    except YFRateLimitError as e:
+        controller.record(BLOCKED, time.monotonic() - t0)
+        raise BlockedError(str(e)) from e
+    except Exception:
+        controller.record(ERROR, time.monotonic() - t0)
+        raise
+
+    if not (info.get('currentPrice') or info.get('regularMarketPrice')):
+        # 連線成功但沒有價格，通常是被 Yahoo 擋下
+        controller.record(BLOCKED, time.monotonic() - t0)
+        raise BlockedError(f"{yf_ticker} 無價格資料")
+
+    controller.record(OK, time.monotonic() - t0)
+    return info
+
+
+# v7 quote 的欄位名稱跟 .info 大致相同，但殖利率要用小數版的 trailingAnnualDividendYield，
+# 且沒有 ROE / 產業 (那兩個只有 quoteSummary 才有)
+QUOTE_FIELDS = ('regularMarketPrice', 'trailingPE', 'forwardPE', 'priceToBook', 'dividendYield')
+
+
+def quote_to_info(quote):
+    info = {
+        'regularMarketPrice': quote.get('regularMarketPrice'),
+        'trailingPE': quote.get('trailingPE'),
+        'forwardPE': quote.get('forwardPE'),
+        'priceToBook': quote.get('priceToBook'),
+        'dividendYield': quote.get('trailingAnnualDividendYield'),
+    }
+    return {k: v for k, v in info.items() if v is not None}
+
+
+# --- 批次報價 ---
+# 一次請求取回一整批代號的價格與評價欄位，回傳 {yf_ticker: info}
+def fetch_quotes(symbols, controller):
+    controller.acquire()
+    t0 = time.monotonic()
+    try:
+        data = YfData(session=get_session('yahoo')).get_raw_json(QUOTE_URL, params={'symbols': ','.join(symbols)})
+    except YFRateLimitError as e:
+        controller.record(BLOCKED, time.monotonic() - t0)
+        raise BlockedError(str(e)) from e
+    except Exception:
+        controller.record(ERROR, time.monotonic() - t0)
+        raise
+
+    quotes = {q['symbol']: quote_to_info(q) for q in (data.get('quoteResponse') or {}).get('result') or []}
+    if not any(q.get('regularMarketPrice') for q in quotes.values()):
+        controller.record(BLOCKED, time.monotonic() - t0)
+        raise BlockedError(f"批次報價無價格資料 ({symbols[0]} 等 {len(symbols)} 檔)")
+
+    controller.record(OK, time.monotonic() - t0)
+    return {s: q for s, q in quotes.items() if q.get('regularMarketPrice')}
@@ -0,0 +1,196 @@
+import asyncio
+import queue
+import threading
+import time
+
+import httpx
+
+from http_client import httpx_hooks, USER_AGENT
+from rate_control import OK, BLOCKED, ERROR
+from yahoo import BlockedError
+
+YAHOO_BASE = "https://query2.finance.yahoo.com"
+COOKIE_URL = "https://fc.yahoo.com"
+
+# analyze_stock 用到的欄位分散在這幾個 quoteSummary 模組
+MODULES = "price,summaryDetail,defaultKeyStatistics,financialData,assetProfile"
+
+
+# quoteSummary 的值長得像 {"raw": 12.3, "fmt": "12.30"}，攤平成跟 yf.Ticker().info 一樣的結構
+def flatten_quote_summary(result):
+    info = {}
+    for module in result.values():
+        if not isinstance(module, dict):
+            continue
+        for key, value in module.items():
+            if isinstance(value, dict):
+                value = value.get('raw')
+            if value is not None and value != {} and key not in info:
+                info[key] = value
+    return info
+
+
+# --- asyncio 版 Yahoo 基本面抓取 ---
+# 單一 httpx.AsyncClient 只開少量連線 (HTTP/2 時多個請求共用同一條連線)，
+# 以 semaphore 控制同時在途的請求數，網路等待時間彼此重疊。
+class AsyncYahooClient:
+    def __init__(self, base_url=YAHOO_BASE, cookie_url=COOKIE_URL, max_connections=4,
+                 concurrency=200, controller=None, http2=True, http1=True, timeout=15.0):
+        self.base_url = base_url
+        self.cookie_url = cookie_url
+        self.max_connections = max_connections
+        self.concurrency = concurrency
+        self.controller = controller
+        self.http2 = http2
+        self.http1 = http1      # http1=False 搭配 http2=True 為明文 h2c (本機替身伺服器用)
+        self.timeout = timeout
+        self._client = None
+        self._crumb = None
+        self._crumb_lock = None
+        self._sem = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections)
+        self._client = httpx.AsyncClient(base_url=self.base_url, http1=self.http1, http2=self.http2,
+                                         limits=limits,
+                                         timeout=self.timeout, headers={'User-Agent': USER_AGENT},
+                                         follow_redirects=True, event_hooks=httpx_hooks())
+        self._crumb_lock = asyncio.Lock()
+        self._sem = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    async def _get_crumb(self, stale=None):
+        if self._crumb is not None and self._crumb != stale:
+            return self._crumb
+        async with self._crumb_lock:
+            # 拿到鎖時可能別的請求已經更新過 crumb
+            if self._crumb is None or self._crumb == stale:
+                try:
+                    await self._client.get(self.cookie_url)   # 只為了拿 cookie，狀態碼不重要
+                except httpx.HTTPError:
+                    pass
+                r = await self._client.get("/v1/test/getcrumb")
+                if r.status_code == 429:
+                    raise BlockedError("取得 crumb 時被限流")
+                r.raise_for_status()
+                self._crumb = r.text.strip()
+            return self._crumb
+
+    async def _request(self, symbol):
+        crumb = await self._get_crumb()
+        r = await self._client.get(f"/v10/finance/quoteSummary/{symbol}",
+                                   params={'modules': MODULES, 'crumb': crumb})
+        if r.status_code == 401:
+            # crumb 過期，重拿一次
+            crumb = await self._get_crumb(stale=crumb)
+            r = await self._client.get(f"/v10/finance/quoteSummary/{symbol}",
+                                       params={'modules': MODULES, 'crumb': crumb})
+        return r
+
+    # 已取得速率額度與並行名額後才呼叫
+    async def _fetch(self, symbol):
+        t0 = time.monotonic()
+        outcome = ERROR
+        try:
+            r = await self._request(symbol)
+            if r.status_code == 429:
+                raise BlockedError(f"{symbol} 被限流 (429)")
+            r.raise_for_status()
+            result = (r.json().get('quoteSummary', {}).get('result') or [None])[0]
+            info = flatten_quote_summary(result or {})
+            if not (info.get('currentPrice') or info.get('regularMarketPrice')):
+                raise BlockedError(f"{symbol} 無價格資料")
+            outcome = OK
+            return info
+        except BlockedError:
+            outcome = BLOCKED
+            raise
+        finally:
+            if self.controller:
+                self.controller.record(outcome, time.monotonic() - t0)
+
+    async def fetch(self, symbol):
+        if self.controller:
+            await self.controller.acquire_async()
+        async with self._sem:
+            return await self._fetch(symbol)
+
+    # 單一派送迴圈：先等到並行名額，再向速率控制器要送出時間，輪到了才建立請求。
+    # 不會一開始就替所有代號以起始速率預約好時段，控制器加速或退避都能立刻套用到還沒送出的請求。
+    async def fetch_many(self, symbols):
+        # 先拿好 cookie / crumb 並建立連線，之後的請求才能直接在同一條連線上多工
+        await self._get_crumb()
+        symbols = list(symbols)
+        results = asyncio.Queue()
+
+        async def one(symbol):
+            try:
+                item = symbol, await self._fetch(symbol), None
+            except Exception as e:
+                item = symbol, None, e
+            finally:
+                self._sem.release()
+            results.put_nowait(item)
+
+        tasks = set()
+
+        async def dispatch():
+            for symbol in symbols:
+                await self._sem.acquire()
+                if self.controller:
+                    await self.controller.acquire_async()
+                task = asyncio.create_task(one(symbol))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        dispatcher = asyncio.create_task(dispatch())
+        try:
+            for _ in symbols:
+                yield await results.get()
+        finally:
+            # 呼叫端提早結束時，還沒送出與在途的請求一起取消
+            dispatcher.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+
+# 給 Streamlit 主執行緒用的同步介面：event loop 跑在背景執行緒，
+# 每完成一檔就透過 queue 交回 (symbol, info, error)。
+def fetch_many(symbols, concurrency=200, controller=None, **client_kwargs):
+    out = queue.Queue()
+    done = object()
+    stop = threading.Event()
+
+    async def run():
+        async with AsyncYahooClient(concurrency=concurrency, controller=controller, **client_kwargs) as client:
+            async for item in client.fetch_many(symbols):
+                out.put(item)
+                if stop.is_set():
+                    break
+
+    def worker():
+        try:
+            asyncio.run(run())
+        except Exception as e:
+            out.put(e)
+        finally:
+            out.put(done)
+
+    threading.Thread(target=worker, name="yahoo-async", daemon=True).start()
+    remaining = set(symbols)
+    try:
+        while (item := out.get()) is not done:
+            if isinstance(item, Exception):
+                # event loop 本身掛掉 (例如拿不到 crumb)：剩下的都算失敗
+                for symbol in remaining:
+                    yield symbol, None, item
+                remaining = set()
+                continue
+            remaining.discard(item[0])
+            yield item
+    finally:
+        stop.set()